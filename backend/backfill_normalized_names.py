@@ -0,0 +1,77 @@
+"""
+products テーブルに正規化カラム（normalized_name / normalized_brand）を追加し、
+既存レコードを一括で埋めるワンショットスクリプト。
+
+処理内容:
+1. カラムが無ければ ALTER TABLE で追加（SQLite / Postgres 共通）
+2. 完全一致検索用のインデックスを作成
+3. 未設定（または --all 指定時は全件）のレコードに normalize_name の結果を書き込む
+
+使い方:
+  python backfill_normalized_names.py
+  python backfill_normalized_names.py --all   # 正規化ロジック変更後の再計算
+"""
+import sys
+sys.stdout.reconfigure(encoding='utf-8')
+
+import argparse
+from sqlalchemy import inspect, text
+from database import SessionLocal, engine
+from models import Product
+from services.product_matcher import normalize_name
+
+NORMALIZED_COLUMNS = ['normalized_name', 'normalized_brand']
+CHUNK_SIZE = 1000
+
+
+def ensure_columns():
+    """正規化カラムとインデックスが無ければ作成する"""
+    existing = {c['name'] for c in inspect(engine).get_columns('products')}
+    with engine.begin() as conn:
+        for column in NORMALIZED_COLUMNS:
+            if column not in existing:
+                print(f"カラム追加: products.{column}")
+                conn.execute(text(f"ALTER TABLE products ADD COLUMN {column} VARCHAR"))
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_products_{column} ON products ({column})"))
+
+
+def backfill(recompute_all: bool = False):
+    db = SessionLocal()
+    try:
+        query = db.query(Product).order_by(Product.id)
+        if not recompute_all:
+            query = query.filter(Product.normalized_name.is_(None))
+
+        total = query.count()
+        print(f"対象商品数: {total}")
+
+        updated = 0
+        last_id = None
+        while True:
+            # キーセットページングで CHUNK_SIZE 件ずつ処理
+            chunk_query = query if last_id is None else query.filter(Product.id > last_id)
+            products = chunk_query.limit(CHUNK_SIZE).all()
+            if not products:
+                break
+
+            for product in products:
+                product.normalized_name = normalize_name(product.name) if product.name else None
+                product.normalized_brand = normalize_name(product.brand) if product.brand else None
+            db.commit()
+
+            updated += len(products)
+            last_id = products[-1].id
+            print(f"  {updated}/{total} 件更新")
+
+        print(f"\n=== バックフィル完了: {updated}件 ===")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="商品の正規化カラムを追加・バックフィルする")
+    parser.add_argument("--all", action="store_true", help="設定済みのレコードも再計算する")
+    args = parser.parse_args()
+
+    ensure_columns()
+    backfill(recompute_all=args.all)
@@ -1,19 +1,22 @@
 import typer
-from typing import List, Optional
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
 from sqlalchemy.orm import Session
 from database import SessionLocal, engine, Base
-from models import Product, Video, Review
+from models import ChannelSyncState, Product, Video, Review
 from services.youtube import YouTubeService
-from services.gemini import GeminiService
+from services.transcript import CompactTranscript
+from services.term_matcher import TermMatcher, WindowDensity, term_density
+from services.youtube_quota import QuotaExceededError, get_youtube_api_store, quota_day
+from services.gemini import ENRICH_BATCH_SIZE, GeminiService, VideoAnalysisError
+from services.product_matcher import ProductMatcher, normalize_name
+from services.amazon import search_amazon
+from services import gemini_usage, job_queue
+import asyncio
 import logging
-import re
-import unicodedata
-from difflib import SequenceMatcher
 import json
 from datetime import datetime
-import requests
-from bs4 import BeautifulSoup
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Build DB tables if they don't exist
 Base.metadata.create_all(bind=engine)
@@ -21,12 +24,6 @@ Base.metadata.create_all(bind=engine)
 app = typer.Typer()
 logger = logging.getLogger(__name__)
 
-# Amazon検索用ヘッダー
-_SEARCH_HEADERS = {
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-    'Accept-Language': 'ja,en-US;q=0.9,en;q=0.8',
-}
-
 def resolve_official_product_info(product_name: str, brand_name: str = None) -> dict:
     """
     Amazon の検索結果から画像URL・価格を取得する。
@@ -37,93 +34,124 @@ def resolve_official_product_info(product_name: str, brand_name: str = None) ->
     """
     result = {'name': product_name, 'image_url': '', 'price': None}
     
-    # Amazon から画像・価格を取得
-    try:
-        query = f"{brand_name} {product_name}" if brand_name else product_name
-        amazon_url = f"https://www.amazon.co.jp/s?k={requests.utils.quote(query)}"
-        resp = requests.get(amazon_url, headers=_SEARCH_HEADERS, timeout=10)
-        
-        if resp.status_code == 200:
-            soup = BeautifulSoup(resp.text, 'html.parser')
-            first_result = soup.select_one('[data-component-type="s-search-result"]')
-            
-            if first_result:
-                # 画像URL（Amazonは商品名は使わず画像だけ取得）
-                img_el = first_result.select_one('img.s-image')
-                if img_el:
-                    src = img_el.get('src', '')
-                    if src.startswith('http'):
-                        result['image_url'] = src
-                
-                # 価格
-                price_el = first_result.select_one('.a-price .a-offscreen')
-                if price_el:
-                    result['price'] = price_el.get_text(strip=True)
-                    logger.info(f"  価格: {result['price']}")
-        
-        time.sleep(1)
-        
-    except Exception as e:
-        logger.warning(f"Amazon検索エラー ({product_name}): {e}")
+    # Amazon から画像・価格を取得（検索結果はキャッシュされ、詳細補完・画像取得でも再利用される）
+    amazon = search_amazon(product_name, brand_name)
+    if amazon:
+        # 画像URL（Amazonは商品名は使わず画像だけ取得）
+        if amazon.image_url:
+            result['image_url'] = amazon.image_url
+        if amazon.price:
+            result['price'] = amazon.price
+            logger.info(f"  価格: {result['price']}")
     
     return result
 
-def normalize_name(name: str) -> str:
-    """商品名を正規化する（スペース除去、全角半角統一、カッコ内除去）"""
-    if not name:
-        return ""
-    # NFKC正規化（全角→半角、濁点統一など）
-    name = unicodedata.normalize('NFKC', name)
-    # 括弧とその中身を除去（例: (Medicube) → 空）
-    name = re.sub(r'[\(（][^)）]*[\)）]', '', name)
-    # 空白を全て除去
-    name = re.sub(r'\s+', '', name)
-    # 小文字化（英字の表記揺れ対応）
-    name = name.lower()
-    return name.strip()
+_product_matcher: Optional[ProductMatcher] = None
+
+def get_product_matcher(db: Session) -> ProductMatcher:
+    """名寄せ用の n-gram 索引を返す（初回のみDBから構築し、以降は差分更新）"""
+    global _product_matcher
+    if _product_matcher is None:
+        matcher = ProductMatcher()
+        rows = db.query(
+            Product.id, Product.name, Product.brand,
+            Product.normalized_name, Product.normalized_brand,
+        )
+        for product_id, name, brand, normalized, normalized_brand in rows:
+            if normalized is None and name:
+                # バックフィル前の行はその場で正規化する
+                matcher.add(product_id, name, brand)
+            else:
+                matcher.add_normalized(product_id, normalized, normalized_brand)
+        logger.info(f"名寄せ索引を構築: {len(matcher)} 件")
+        _product_matcher = matcher
+    return _product_matcher
 
 def find_matching_product(db: Session, product_name: str, brand_name: str = None) -> Optional[Product]:
     """既存の商品から名寄せで一致するものを探す"""
     normalized_new = normalize_name(product_name)
     if not normalized_new:
         return None
-    
-    # 全商品を取得して比較（データ量が少ないうちはこれで十分）
-    all_products = db.query(Product).all()
-    
-    best_match = None
-    best_score = 0.0
-    
-    for existing in all_products:
-        normalized_existing = normalize_name(existing.name)
-        
-        # 完全一致（正規化後）
-        if normalized_new == normalized_existing:
-            return existing
-        
-        # 類似度計算
-        score = SequenceMatcher(None, normalized_new, normalized_existing).ratio()
-        
-        # ブランド名も考慮（ブランドが一致すれば閾値を下げる）
-        if brand_name and existing.brand:
-            brand_score = SequenceMatcher(
-                None, 
-                normalize_name(brand_name), 
-                normalize_name(existing.brand)
-            ).ratio()
-            if brand_score > 0.7:
-                score += 0.1  # ブランド一致ボーナス
-        
-        if score > best_score:
-            best_score = score
-            best_match = existing
-    
-    # 閾値0.85以上なら同一商品と判定
-    if best_score >= 0.85 and best_match:
-        logger.info(f"名寄せ: '{product_name}' → 既存 '{best_match.name}' (スコア: {best_score:.2f})")
-        return best_match
-    
-    return None
+
+    # 正規化名の完全一致はインデックス付きカラムで1クエリ
+    exact = db.query(Product).filter(Product.normalized_name == normalized_new).first()
+    if exact:
+        return exact
+
+    # 完全一致がなければ n-gram 索引であいまい検索
+    matcher = get_product_matcher(db)
+
+    while True:
+        match = matcher.find(product_name, brand_name)
+        if not match:
+            return None
+
+        product = db.get(Product, match.product_id)
+        if product is None:
+            # 別プロセスで削除された商品は索引から外して再検索
+            matcher.remove(match.product_id)
+            continue
+
+        if not match.exact:
+            logger.info(f"名寄せ: '{product_name}' → 既存 '{product.name}' (スコア: {match.score:.2f})")
+        return product
+
+def match_products(db: Session, items: List[Tuple[str, Optional[str]]]) -> List[Tuple[Optional[Product], Optional[int]]]:
+    """
+    1本の動画から抽出された (商品名, ブランド名) のリストをまとめて名寄せする。
+
+    Returns:
+        list: 各要素について (一致した既存商品 or None, バッチ内で先行する同一商品の添字 or None)
+    """
+    normalized = [normalize_name(name) for name, _ in items]
+
+    # 正規化名の完全一致は IN クエリ1回で解決
+    exact = {}
+    keys = {n for n in normalized if n}
+    if keys:
+        for product in db.query(Product).filter(Product.normalized_name.in_(keys)):
+            exact.setdefault(product.normalized_name, product)
+
+    # 残りは n-gram 索引でまとめてあいまい検索（バッチ内の重複もここで判定）
+    matcher = get_product_matcher(db)
+    batch_matches = matcher.find_many(items)
+
+    fuzzy_ids = {
+        m.match.product_id for n, m in zip(normalized, batch_matches)
+        if m.match and n not in exact
+    }
+    found = {}
+    if fuzzy_ids:
+        found = {p.id: p for p in db.query(Product).filter(Product.id.in_(fuzzy_ids))}
+
+    results = []
+    for i, ((product_name, brand_name), batch_match) in enumerate(zip(items, batch_matches)):
+        product = exact.get(normalized[i])
+        if product is None and batch_match.match:
+            product = found.get(batch_match.match.product_id)
+            if product is None:
+                # 別プロセスで削除された商品は索引から外して単体で再検索
+                matcher.remove(batch_match.match.product_id)
+                product = find_matching_product(db, product_name, brand_name)
+            elif not batch_match.match.exact:
+                logger.info(f"名寄せ: '{product_name}' → 既存 '{product.name}' (スコア: {batch_match.match.score:.2f})")
+        results.append((product, batch_match.duplicate_of if product is None else None))
+    return results
+
+# 登録済みチェックの IN 句に一度に渡す動画IDの数
+EXISTENCE_CHECK_CHUNK_SIZE = 500
+
+def find_existing_video_ids(db: Session, video_ids: Iterable[str], chunk_size: int = EXISTENCE_CHECK_CHUNK_SIZE) -> Set[str]:
+    """
+    video_ids のうち DB に登録済みの動画IDを返す。
+    1本ずつ問い合わせる代わりに chunk_size 件ずつの IN 句でまとめて調べる（500本でも1往復）。
+    """
+    video_ids = list(dict.fromkeys(video_ids))
+    existing = set()
+    for i in range(0, len(video_ids), chunk_size):
+        chunk = video_ids[i:i + chunk_size]
+        existing.update(row.id for row in db.query(Video.id).filter(Video.id.in_(chunk)))
+    return existing
 
 def get_db():
     db = SessionLocal()
@@ -147,10 +175,15 @@ def run_batch(query: str = "コスメ レビュー", max_videos: int = 5):
     videos = youtube_service.search_videos(query, max_results=max_videos)
     logger.info(f"Found {len(videos)} videos.")
 
+    existing = find_existing_video_ids(db, [item['id']['videoId'] for item in videos])
     for item in videos:
         video_id = item['id']['videoId']
+        if video_id in existing:
+            logger.info(f"Video {video_id} already exists. Skipping.")
+            continue
         snippet = item['snippet']
-        process_video_item(db, youtube_service, gemini_service, video_id, snippet)
+        process_video_item(db, youtube_service, gemini_service, video_id, snippet, known_new=True)
+        existing.add(video_id)
 
     db.close()
     logger.info("Batch process completed.")
@@ -174,6 +207,7 @@ def process_urls(
     keys = [api_key] if api_key else None
     gemini_service = GeminiService(api_keys=keys)
 
+    video_ids = []
     for url in urls:
         # Extract Video ID
         parsed = urlparse(url)
@@ -190,9 +224,18 @@ def process_urls(
             continue
 
         logger.info(f"Processing URL: {url} -> ID: {video_id}")
-        
-        # Fetch Video Details
-        video_details = youtube_service.get_video_details(video_id)
+        video_ids.append(video_id)
+
+    # 登録済みの動画は詳細を取得する前にまとめて除外する
+    existing = find_existing_video_ids(db, video_ids)
+    new_ids = [v for v in dict.fromkeys(video_ids) if v not in existing]
+    for video_id in existing:
+        logger.info(f"Video {video_id} already exists. Skipping.")
+
+    # Fetch Video Details（50本ずつまとめて取得）
+    details = youtube_service.get_videos_details(new_ids)
+    for video_id in new_ids:
+        video_details = details.get(video_id)
         if not video_details:
             logger.error(f"Could not fetch details for video {video_id}")
             continue
@@ -204,62 +247,98 @@ def process_urls(
             gemini_service, 
             video_id, 
             snippet, 
-            skip_enrich=main_only
+            skip_enrich=main_only,
+            known_new=True,
         )
 
     db.close()
     logger.info("Custom video process completed.")
 
-def process_video_item(db: Session, youtube_service: YouTubeService, gemini_service: GeminiService, video_id: str, snippet: dict, enrich_gemini_service: GeminiService = None, skip_enrich: bool = False):
-    title = snippet['title']
-    channel_name = snippet['channelTitle']
-    description = snippet.get('description', '')  # 概要欄テキストを取得
-    published_at_str = snippet['publishedAt']
-    # Handle different date formats or ensure consistency. API usually returns ISO 8601
-    try:
-        published_at = datetime.fromisoformat(published_at_str.replace('Z', '+00:00'))
-    except ValueError:
-        # Fallback if format is different
-        published_at = datetime.utcnow()
-
-    thumbnail_url = snippet['thumbnails']['high']['url']
-
+def process_video_item(db: Session, youtube_service: YouTubeService, gemini_service: GeminiService, video_id: str, snippet: dict, skip_enrich: bool = False, known_new: bool = False):
+    """
+    1本の動画から商品を抽出して保存する。
+    呼び出し側が find_existing_video_ids で未登録と確認済みなら known_new=True で個別の確認を省く。
+    """
     # Check if video already exists
-    existing_video = db.query(Video).filter(Video.id == video_id).first()
-    if existing_video:
+    if not known_new and find_existing_video_ids(db, [video_id]):
         logger.info(f"Video {video_id} already exists. Skipping.")
         return
 
+    try:
+        analysis_results = extract_video_products(youtube_service, gemini_service, video_id, snippet)
+    except VideoAnalysisError as e:
+        logger.error(f"Gemini analysis failed ({video_id}): {e}")
+        return
+    except Exception as e:
+        # 字幕取得・区間分けなどの想定外のエラーでも、この動画だけ飛ばして残りの処理を続ける
+        logger.exception(f"Video processing failed ({video_id}): {e}")
+        return
+    if not analysis_results:
+        return
+
+    save_video_results(db, video_id, snippet, analysis_results, skip_enrich=skip_enrich)
+
+def extract_video_products(youtube_service: YouTubeService, gemini_service: GeminiService, video_id: str, snippet: dict, transcript: CompactTranscript = None) -> Optional[list]:
+    """
+    字幕取得とGeminiによる商品抽出（ネットワーク処理のみ。DBには触れない）。
+
+    Returns:
+        list: 抽出結果。字幕も概要欄もない場合・商品なしの場合は None
+
+    Raises:
+        VideoAnalysisError: Gemini の呼び出しに失敗した（再試行すべき失敗を「商品なし」と区別する）
+    """
+    title = snippet['title']
+    description = snippet.get('description', '')  # 概要欄テキストを取得
+
     logger.info(f"Processing video: {title} ({video_id})")
     if description:
         logger.info(f"概要欄あり: {len(description)}文字")
 
     # 2. Get Transcript
-    transcript = youtube_service.get_transcript(video_id)
+    if not transcript:
+        transcript = youtube_service.get_transcript(video_id)
     if not transcript:
         if description:
             # 字幕なしでも概要欄があれば分析を続行
             logger.warning(f"字幕取得失敗 ({video_id})。概要欄のみで商品抽出を試みます。")
-            transcript = [{"start": 0, "text": "（字幕なし）"}]
+            transcript = None
         else:
             logger.warning(f"No transcript and no description for video {video_id}. Skipping.")
-            return
+            return None
 
     # 3. Analyze with Gemini（概要欄 + 字幕を渡す）
     logger.info(f"Analyzing video {video_id} with description + transcript...")
-    try:
-        analysis_results = gemini_service.analyze_video(
-            transcript=transcript,
-            description=description,
-            title=title
-        )
-    except Exception as e:
-        logger.error(f"Gemini analysis failed: {e}")
-        return
+    analysis_results = gemini_service.analyze_video(
+        transcript=transcript,
+        description=description,
+        title=title
+    )
 
     if not analysis_results:
         logger.info("No products found in video.")
-        return
+        return None
+    return analysis_results
+
+def save_video_results(db: Session, video_id: str, snippet: dict, analysis_results: list, skip_enrich: bool = False):
+    """
+    抽出結果を動画・商品・レビューとしてDBに保存する。
+
+    新規商品は抽出結果の名前で即座に登録し、公式情報（画像・価格）の解決と
+    詳細生成はジョブとして積む（work-queue コマンドのワーカーが処理する）。
+    skip_enrich=True の場合は詳細生成のジョブを積まない。
+    """
+    title = snippet['title']
+    channel_name = snippet['channelTitle']
+    published_at_str = snippet['publishedAt']
+    # Handle different date formats or ensure consistency. API usually returns ISO 8601
+    try:
+        published_at = datetime.fromisoformat(published_at_str.replace('Z', '+00:00'))
+    except ValueError:
+        # Fallback if format is different
+        published_at = datetime.utcnow()
+
+    thumbnail_url = snippet['thumbnails']['high']['url']
 
     # 4. Save to DB
     # Save Video
@@ -273,38 +352,48 @@ def process_video_item(db: Session, youtube_service: YouTubeService, gemini_serv
     db.add(new_video)
     db.commit() # Commit video first to satisfy FK
 
-    for result in analysis_results:
+    # 名寄せ: 動画内の全商品をまとめて既存商品と照合（同じ商品の重複記載も解決）
+    matches = match_products(
+        db, [(result.get('product_name'), result.get('brand_name')) for result in analysis_results]
+    )
+    batch_products = {}     # 添字 → この動画で確定した商品
+    reviewed_ids = set()    # この動画でレビュー登録済みの商品ID
+    new_products = 0        # この動画で新規登録した商品数
+
+    for i, result in enumerate(analysis_results):
         product_name = result.get('product_name')
         if not product_name:
             continue
 
-        # 名寄せ: 正規化名と類似度で既存商品を検索
         brand_name = result.get('brand_name')
-        product = find_matching_product(db, product_name, brand_name)
+        product, duplicate_of = matches[i]
+        if product is None and duplicate_of is not None:
+            product = batch_products.get(duplicate_of)
         if not product:
-            # 新規商品: Amazon から正規の商品名・画像・価格を取得
-            logger.info(f"新規商品検出: '{product_name}' → 公式情報を検索中...")
-            official_info = resolve_official_product_info(product_name, brand_name)
-            
+            # 新規商品: まず登録だけ行い、公式情報の解決と詳細生成は後回しにする
             product = Product(
-                name=official_info['name'],
+                name=product_name,
                 brand=brand_name,
                 category=result.get('category'),
-                image_url=official_info['image_url'],
-                price=official_info['price'],
+                image_url='',
+                enrichment_status=None if skip_enrich else job_queue.STATUS_PENDING,
             )
             db.add(product)
             db.commit()
             db.refresh(product)
-            logger.info(f"新規商品登録: '{official_info['name']}' (ID: {product.id[:8]}...)")
-            
-            # 新規商品の詳細情報をGemini AIで生成
+            get_product_matcher(db).add(product.id, product.name, product.brand)
+            job_queue.enqueue(db, job_queue.JOB_RESOLVE_PRODUCT, product.id)
             if not skip_enrich:
-                enrich_svc = enrich_gemini_service or gemini_service
-                enrich_new_product(product, enrich_svc, db)
-                time.sleep(1)  # API レート制限対策
-            else:
-                logger.info(f"  メイン処理のみ実行のためエンリッチ処理をスキップします")
+                job_queue.enqueue(db, job_queue.JOB_ENRICH_PRODUCT, product.id)
+            new_products += 1
+            logger.info(f"新規商品登録: '{product_name}' (ID: {product.id[:8]}...)")
+        batch_products[i] = product
+
+        if product.id in reviewed_ids:
+            logger.info(f"  同一動画内の重複記載: '{product_name}' → レビューは1件のみ登録")
+            continue
+        reviewed_ids.add(product.id)
+
         # Save Review
         review = Review(
             product_id=product.id,
@@ -316,55 +405,32 @@ def process_video_item(db: Session, youtube_service: YouTubeService, gemini_serv
         db.add(review)
     
     db.commit()
-    count = db.query(Video).count()
-    logger.info(f"Saved results for video {video_id}. Total videos in DB: {count}")
-
 
-def enrich_new_product(product: Product, gemini_service: GeminiService, db):
-    """新規登録した商品の詳細情報をGemini AIで生成する"""
-    try:
-        prompt = f"""以下のコスメ商品について、正確な情報を提供してください。
+    if new_products:
+        logger.info(f"  新規商品 {new_products} 件の公式情報・詳細生成をキューに追加しました")
+        if skip_enrich:
+            logger.info(f"  メイン処理のみ実行のため詳細生成のジョブは積みません")
 
-商品名: {product.name}
-ブランド: {product.brand or '不明'}
-カテゴリ: {product.category or '不明'}
+    count = db.query(Video).count()
+    logger.info(f"Saved results for video {video_id}. Total videos in DB: {count}")
 
-以下のJSON形式で回答。確信がない情報は null にしてください。嘘は絶対に入れないこと。
 
-{{
-  "description": "商品の簡潔な説明文（100〜200文字程度）",
-  "features": ["特徴1", "特徴2", "特徴3"],
-  "ingredients": "主な成分（わかる場合のみ）",
-  "volume": "容量（例: 30ml, 12g）",
-  "how_to_use": "基本的な使い方（50〜100文字程度）"
-}}
+def apply_product_details(product: Product, data: dict):
+    """Gemini が生成した商品詳細のうち、値のある項目だけを商品に反映する"""
+    if data.get('description'):
+        product.description = data['description']
+    if data.get('features') and isinstance(data['features'], list):
+        product.features = json.dumps(data['features'], ensure_ascii=False)
+    if data.get('ingredients'):
+        product.ingredients = data['ingredients']
+    if data.get('volume'):
+        product.volume = data['volume']
+    if data.get('how_to_use'):
+        product.how_to_use = data['how_to_use']
 
-JSON以外の文字を含めないこと。"""
 
-        response = gemini_service.model.generate_content(prompt)
-        text = response.text.strip()
-        if '```json' in text:
-            text = text.split('```json')[1].split('```')[0].strip()
-        elif '```' in text:
-            text = text.split('```')[1].split('```')[0].strip()
-        
-        data = json.loads(text)
-        
-        if data.get('description'):
-            product.description = data['description']
-        if data.get('features') and isinstance(data['features'], list):
-            product.features = json.dumps(data['features'], ensure_ascii=False)
-        if data.get('ingredients'):
-            product.ingredients = data['ingredients']
-        if data.get('volume'):
-            product.volume = data['volume']
-        if data.get('how_to_use'):
-            product.how_to_use = data['how_to_use']
-        
-        db.commit()
-        logger.info(f"  商品詳細を生成しました")
-    except Exception as e:
-        logger.warning(f"  商品詳細の生成に失敗: {e}")
+def _enrichment_request(product: Product) -> dict:
+    return {'product_id': product.id, 'name': product.name, 'brand': product.brand, 'category': product.category}
 
 
 # ============================================================
@@ -407,7 +473,10 @@ COSME_TERMS = [
     'プチプラ', 'デパコス', 'コスメ', 'メイク',
 ]
 
-def filter_by_transcript_density(transcript: list) -> float:
+# COSME_TERMS を事前にコンパイルしたマッチャー（字幕全文を1回の走査で数える）
+COSME_TERM_MATCHER = TermMatcher(COSME_TERMS)
+
+def filter_by_transcript_density(transcript: CompactTranscript) -> float:
     """
     ②字幕密度判定: コスメ関連用語の出現率を計算する。
     
@@ -417,26 +486,40 @@ def filter_by_transcript_density(transcript: list) -> float:
     if not transcript:
         return 0.0
     
-    # 字幕テキストを結合
-    full_text = ' '.join([item.get('text', '') for item in transcript])
+    # 正規化済みの字幕は全文を1本の文字列として持っているので、そのまま数える
+    full_text = transcript.text
     total_chars = len(full_text)
     
     if total_chars == 0:
         return 0.0
     
     # コスメ用語の出現回数をカウント
-    hit_count = 0
-    for term in COSME_TERMS:
-        hit_count += full_text.count(term)
+    hit_count = COSME_TERM_MATCHER.count(full_text)
     
-    # 密度 = ヒット数 / 総文字数 * 100（パーセント）
-    density = (hit_count / total_chars) * 100
-    return density
+    # 密度 = ヒット数 / 総文字数 * 100（パーセント。時間枠ごとの密度と同じ数え方）
+    return term_density(hit_count, total_chars)
 
 
 # 字幕密度の閾値（%）: これ以上ならコスメ関連と判定
 COSME_DENSITY_THRESHOLD = 0.3
 
+# 長い動画は全体の密度が閾値未満でも、この長さ（秒）の時間枠のどこかで閾値を超えれば通す
+# （雑談・Vlog の一部でコスメを紹介している動画）。文字数の少なすぎる枠は判定に使わない
+COSME_DENSITY_WINDOW_SECONDS = 300
+COSME_DENSITY_WINDOW_MIN_CHARS = 300
+
+
+def find_dense_window(transcript: CompactTranscript, density_threshold: float) -> Optional[WindowDensity]:
+    """
+    ②字幕密度（時間枠ごと）: COSME_DENSITY_WINDOW_SECONDS 秒ごとの時間枠のうち、
+    密度が閾値以上で最も高い枠を返す（なければ None）。
+    """
+    windows = [
+        w for w in COSME_TERM_MATCHER.window_density(transcript, COSME_DENSITY_WINDOW_SECONDS)
+        if w.chars >= COSME_DENSITY_WINDOW_MIN_CHARS and w.density >= density_threshold
+    ]
+    return max(windows, key=lambda w: w.density, default=None)
+
 
 def filter_by_ai_classification(
     gemini_service: GeminiService,
@@ -450,27 +533,352 @@ def filter_by_ai_classification(
     Returns:
         True = コスメレビューと判定、False = コスメレビューではない
     """
-    prompt = f"""以下のYouTube動画は「コスメ（化粧品）のレビューまたは紹介動画」ですか？
-Yes か No のいずれか1単語のみで回答してください。
+    try:
+        return gemini_service.classify_video(title, description, transcript_sample)
+    except Exception as e:
+        logger.warning(f"AI分類エラー: {e}")
+        # エラー時は安全側（通す）
+        return True
+
+
+# ③ AI分類を1リクエストにまとめる動画数
+AI_CLASSIFICATION_BATCH_SIZE = 10
+
+
+def filter_by_ai_classification_batch(
+    gemini_service: GeminiService,
+    videos: List[dict],
+) -> Dict[str, bool]:
+    """
+    ③AI分類（バッチ版）: 複数の動画を1リクエストにまとめて Yes/No 判定する。
+
+    Args:
+        videos: [{'video_id', 'title', 'description', 'transcript_sample'}, ...]
+
+    Returns:
+        dict: {video_id: True/False}。レスポンスに含まれなかった動画だけ個別に判定し直す。
+    """
+    if len(videos) == 1:
+        v = videos[0]
+        return {v['video_id']: filter_by_ai_classification(gemini_service, v['title'], v['description'], v['transcript_sample'])}
 
+    blocks = []
+    for v in videos:
+        blocks.append(f"""### video_id: {v['video_id']}
 【タイトル】
-{title}
+{v['title']}
 
 【概要欄（冒頭）】
-{description[:1000] if description else '（なし）'}
+{v['description'][:500] if v['description'] else '（なし）'}
 
 【字幕（冒頭）】
-{transcript_sample[:1500]}
-"""
+{v['transcript_sample'][:800]}
+""")
+
+    prompt = f"""以下の {len(videos)} 本のYouTube動画それぞれについて、「コスメ（化粧品）のレビューまたは紹介動画」かどうかを判定してください。
+
+{chr(10).join(blocks)}
+【出力フォーマット】
+以下のJSON配列のみを出力してください。Markdownのコードブロックは不要です。
+全ての video_id について1件ずつ回答すること。
+
+[
+    {{"video_id": "動画ID", "is_cosme_review": true または false}}
+]"""
+
+    verdicts = {}
     try:
-        response = gemini_service.model.generate_content(prompt)
-        answer = response.text.strip().lower()
-        is_cosme = answer.startswith('yes') or 'yes' in answer
-        return is_cosme
+        text = gemini_service.generate(prompt, gemini_usage.PROMPT_CLASSIFICATION_BATCH)
+        if '```json' in text:
+            text = text.split('```json')[1].split('```')[0].strip()
+        elif '```' in text:
+            text = text.split('```')[1].split('```')[0].strip()
+        try:
+            items = json.loads(text)
+        except json.JSONDecodeError:
+            gemini_service.invalidate_cached(prompt)
+            raise
+
+        requested = {v['video_id'] for v in videos}
+        for item in items if isinstance(items, list) else []:
+            if not isinstance(item, dict) or item.get('video_id') not in requested:
+                continue
+            verdict = item.get('is_cosme_review')
+            if isinstance(verdict, str):
+                verdict = verdict.strip().lower() in ('true', 'yes')
+            if isinstance(verdict, bool):
+                verdicts[item['video_id']] = verdict
     except Exception as e:
-        logger.warning(f"AI分類エラー: {e}")
-        # エラー時は安全側（通す）
-        return True
+        logger.warning(f"AI分類（バッチ）エラー: {e}")
+
+    # 回答が欠けた動画だけ1本ずつ判定する
+    missing = [v for v in videos if v['video_id'] not in verdicts]
+    if missing:
+        logger.info(f"  ③AI分類: {len(missing)}/{len(videos)} 本の回答が欠けていたため個別に判定")
+    for v in missing:
+        verdicts[v['video_id']] = filter_by_ai_classification(
+            gemini_service, v['title'], v['description'], v['transcript_sample']
+        )
+    return verdicts
+
+
+def _channel_video_snippet(video_info: dict) -> dict:
+    """get_channel_videos の要素を process_video_item 互換の snippet に変換する"""
+    return {
+        'title': video_info['title'],
+        'channelTitle': video_info['channel_name'],
+        'description': video_info['description'],
+        'publishedAt': video_info['published_at'],
+        'thumbnails': {'high': {'url': video_info['thumbnail_url']}},
+    }
+
+
+def screen_channel_video(
+    youtube_service: YouTubeService,
+    video_info: dict,
+    label: str,
+    density_threshold: float,
+) -> dict:
+    """
+    ①を通過した動画に対して ②字幕密度判定 を行う。
+    ネットワーク処理のみで DB には触れないため、ワーカースレッドから並列に呼べる。
+
+    Returns:
+        dict: 通過結果と、③・詳細抽出で再利用する字幕
+    """
+    video_id = video_info['video_id']
+    outcome = {'label': label, 'video_info': video_info, 'pass_density': False, 'transcript': None, 'transcript_sample': ''}
+
+    transcript = youtube_service.get_transcript(video_id)
+    if not transcript:
+        # 字幕取得失敗時：タイトル判定を通過しているのでスキップせず先に進む
+        logger.info(f"{label}  ⚠️  ②字幕取得失敗 → タイトル判定通過済みのため、字幕密度チェックをスキップ")
+    else:
+        density = filter_by_transcript_density(transcript)
+        sample_from = 0
+        if density < density_threshold:
+            window = find_dense_window(transcript, density_threshold)
+            if window is None:
+                logger.info(f"{label}  ❌ ②字幕密度: {density:.2f}% < 閾値{density_threshold}% → スキップ")
+                return outcome
+            # ③AI分類にはコスメを紹介している時間枠の字幕を見せる
+            sample_from = transcript.segment_at(window.start)
+            logger.info(
+                f"{label}  ✅ ②字幕密度: 全体 {density:.2f}% < 閾値{density_threshold}% だが "
+                f"{int(window.start)}〜{int(window.end)}秒が {window.density:.2f}% → 通過"
+            )
+        else:
+            logger.info(f"{label}  ✅ ②字幕密度: {density:.2f}% ≥ 閾値{density_threshold}% → 通過")
+        outcome['transcript'] = transcript
+        outcome['transcript_sample'] = transcript.sample(start=sample_from)
+    outcome['pass_density'] = True
+    return outcome
+
+
+def classify_channel_videos(gemini_service: GeminiService, outcomes: List[dict]) -> List[dict]:
+    """②を通過した動画をまとめて ③AI分類 し、通過したものだけ返す"""
+    verdicts = filter_by_ai_classification_batch(gemini_service, [
+        {
+            'video_id': o['video_info']['video_id'],
+            'title': o['video_info']['title'],
+            'description': o['video_info']['description'],
+            'transcript_sample': o['transcript_sample'],
+        }
+        for o in outcomes
+    ])
+    # 呼び出し間隔は GeminiService のキーごとのレートリミッターが調整するので、ここでは待たない
+
+    passed = []
+    for o in outcomes:
+        if verdicts.get(o['video_info']['video_id'], True):
+            logger.info(f"{o['label']}  ✅ ③AI分類: コスメレビューと判定 → 通過")
+            passed.append(o)
+        else:
+            logger.info(f"{o['label']}  ❌ ③AI分類: コスメレビューではないと判定 → スキップ")
+    return passed
+
+
+class TaskFailure(NamedTuple):
+    """_run_parallel で例外を投げた要素"""
+    item: Any
+    error: Exception
+
+
+def _run_parallel(fn: Callable, items: Iterable, workers: int) -> Iterable:
+    """
+    fn(item) を最大 workers 並列で実行し、終わった順に結果を返す。
+    workers <= 1 のときは順番に実行する。例外はログに出し、結果の代わりに TaskFailure を返す。
+    """
+    items = list(items)
+    if workers <= 1:
+        for item in items:
+            try:
+                yield fn(item)
+            except Exception as e:
+                logger.error(f"処理エラー: {e}")
+                yield TaskFailure(item, e)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fn, item): item for item in items}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                logger.error(f"処理エラー: {e}")
+                yield TaskFailure(futures[future], e)
+
+
+def run_channel_pipeline(
+    db: Session,
+    youtube_service: YouTubeService,
+    gemini_service: GeminiService,
+    videos: List[dict],
+    density_threshold: float = COSME_DENSITY_THRESHOLD,
+    skip_ai: bool = False,
+    title_only: bool = False,
+    workers: int = 1,
+    ai_batch_size: int = AI_CLASSIFICATION_BATCH_SIZE,
+    enqueue: bool = False,
+) -> dict:
+    """
+    チャンネルから取得した動画を3段階フィルタリングにかけ、通過したものの詳細を抽出して保存する
+    （process-channel / sync-channel 共通）。enqueue=True なら①の通過分をジョブとして積むだけにする。
+
+    Returns:
+        dict: 各段階の通過数などの統計。failed_video_ids は途中で失敗した（保存も除外もされていない）動画
+    """
+    logger.info(f"=== {len(videos)} 本の動画を取得。3段階フィルタリング開始 ===")
+
+    stats = {
+        'total': len(videos), 'pass_title': 0, 'pass_density': 0, 'pass_ai': 0, 'processed': 0,
+        'skipped_existing': 0, 'failed': 0, 'failed_video_ids': [],
+    }
+
+    # 処理済みチェックと①タイトル判定はDB/文字列処理のみなので先にまとめて行う
+    existing = find_existing_video_ids(db, [v['video_id'] for v in videos])
+    candidates = []
+    for i, video_info in enumerate(videos, 1):
+        video_id = video_info['video_id']
+        title = video_info['title']
+        description = video_info['description']
+
+        logger.info(f"\n[{i}/{len(videos)}] 📹 {title}")
+
+        # 処理済みチェック
+        if video_id in existing:
+            logger.info(f"  ⏭️  既に処理済み。スキップ。")
+            stats['skipped_existing'] += 1
+            continue
+
+        # ===== ① タイトル判定 =====
+        if not filter_by_title(title, description):
+            logger.info(f"  ❌ ①タイトル判定: 「ベストコスメ/ベスコス」が含まれていません → スキップ")
+            continue
+        logger.info(f"  ✅ ①タイトル判定: 通過")
+        stats['pass_title'] += 1
+        candidates.append((f"[{i}/{len(videos)}]", video_info))
+
+    if enqueue:
+        # ②以降はワーカーに任せる（payload は次の段階のジョブへ引き継がれる）
+        first_type = job_queue.JOB_EXTRACT if title_only else job_queue.JOB_FETCH_TRANSCRIPT
+        queued = 0
+        for _, video_info in candidates:
+            payload = {'video_info': video_info, 'density_threshold': density_threshold, 'skip_ai': skip_ai}
+            if job_queue.enqueue(db, first_type, video_info['video_id'], payload):
+                queued += 1
+        db.commit()
+        logger.info(f"\n①タイトル通過 {stats['pass_title']} 本のうち {queued} 本を {JOB_LABELS[first_type]} のジョブとして追加しました")
+        return stats
+
+    # ===== ② 字幕密度判定（並列） =====
+    if title_only:
+        logger.info(f"  ⏩ ②③スキップ（--title-only モード）")
+        screened = [{'label': label, 'video_info': v, 'transcript': None} for label, v in candidates]
+        stats['pass_density'] += len(screened)
+    else:
+        screened = []
+        for outcome in _run_parallel(
+            lambda c: screen_channel_video(youtube_service, c[1], c[0], density_threshold),
+            candidates, workers
+        ):
+            if isinstance(outcome, TaskFailure):
+                stats['failed'] += 1
+                stats['failed_video_ids'].append(outcome.item[1]['video_id'])
+                continue
+            if outcome['pass_density']:
+                stats['pass_density'] += 1
+                screened.append(outcome)
+        # 完了順ではなく元の並び順でバッチを組む
+        order = {v['video_id']: n for n, (_, v) in enumerate(candidates)}
+        screened.sort(key=lambda o: order[o['video_info']['video_id']])
+
+    # ===== ③ AI分類（ai_batch_size 本ずつまとめて判定、バッチ同士は並列） =====
+    if title_only or skip_ai:
+        passed = screened
+    else:
+        batches = [screened[i:i + ai_batch_size] for i in range(0, len(screened), ai_batch_size)]
+        passed = []
+        for batch_passed in _run_parallel(
+            lambda batch: classify_channel_videos(gemini_service, batch),
+            batches, workers
+        ):
+            if isinstance(batch_passed, TaskFailure):
+                stats['failed'] += len(batch_passed.item)
+                stats['failed_video_ids'].extend(o['video_info']['video_id'] for o in batch_passed.item)
+                continue
+            passed.extend(batch_passed)
+    stats['pass_ai'] += len(passed)
+
+    # ===== 詳細抽出（並列）→ DB保存（メインスレッドのみ） =====
+    def extract(outcome: dict) -> dict:
+        logger.info(f"{outcome['label']}  🔍 詳細抽出開始...")
+        video_info = outcome['video_info']
+        outcome['analysis'] = extract_video_products(
+            youtube_service, gemini_service, video_info['video_id'],
+            _channel_video_snippet(video_info), transcript=outcome['transcript']
+        )
+        return outcome
+
+    for outcome in _run_parallel(extract, passed, workers):
+        if isinstance(outcome, TaskFailure):
+            stats['failed'] += 1
+            stats['failed_video_ids'].append(outcome.item['video_info']['video_id'])
+            continue
+        video_info = outcome['video_info']
+        if outcome['analysis']:
+            save_video_results(
+                db, video_info['video_id'], _channel_video_snippet(video_info), outcome['analysis']
+            )
+        stats['processed'] += 1
+
+    # 統計レポート
+    logger.info(f"\n{'='*50}")
+    logger.info(f"📊 処理結果サマリー")
+    logger.info(f"{'='*50}")
+    logger.info(f"  全動画数:        {stats['total']}")
+    logger.info(f"  処理済スキップ:  {stats['skipped_existing']}")
+    logger.info(f"  ①タイトル通過:   {stats['pass_title']}")
+    logger.info(f"  ②字幕密度通過:   {stats['pass_density']}")
+    logger.info(f"  ③AI分類通過:     {stats['pass_ai']}")
+    logger.info(f"  詳細抽出完了:    {stats['processed']}")
+    logger.info(f"  エラー:          {stats['failed']}")
+    cache_stats = gemini_service.cache_stats()
+    logger.info(f"  Geminiキャッシュ: ヒット {cache_stats['hits']} / ミス {cache_stats['misses']}")
+    for usage in gemini_service.key_utilization():
+        logger.info(
+            f"  キー{usage['key_index']+1}: {usage['requests']}回 (429: {usage['throttled']}回) "
+            f"RPM {usage['rpm_utilization']:.0%} / TPM {usage['tpm_utilization']:.0%}"
+        )
+    run_usage = gemini_service.usage_ledger.summary(run_id=gemini_usage.RUN_ID)
+    if run_usage:
+        logger.info(
+            f"  Gemini使用量:    {sum(u['calls'] for u in run_usage)}回 "
+            f"入力 {sum(u['input_tokens'] for u in run_usage)} / 出力 {sum(u['output_tokens'] for u in run_usage)} トークン "
+            f"(実行ID {gemini_usage.RUN_ID})"
+        )
+    logger.info(f"{'='*50}")
+    return stats
 
 
 @app.command()
@@ -480,6 +888,9 @@ def process_channel(
     density_threshold: float = typer.Option(COSME_DENSITY_THRESHOLD, help="字幕密度閾値（%）"),
     skip_ai: bool = typer.Option(False, help="③AI分類をスキップする"),
     title_only: bool = typer.Option(False, help="①タイトル判定のみで②③をスキップ"),
+    workers: int = typer.Option(1, help="②③と詳細抽出を並列実行するワーカー数（DB書き込みは常に1スレッド）"),
+    ai_batch_size: int = typer.Option(AI_CLASSIFICATION_BATCH_SIZE, help="③AI分類を1リクエストにまとめる動画数"),
+    enqueue: bool = typer.Option(False, help="①の通過分をジョブとして積むだけにし、②以降は work-queue に任せる"),
 ):
     """
     特定YouTuberのチャンネルから動画をフィルタリングで収集する。
@@ -487,10 +898,19 @@ def process_channel(
     ① タイトルに「ベストコスメ」「ベスコス」を含む動画のみ通過
     ② 字幕のコスメ用語密度が閾値以上の動画のみ通過（--title-only で省略可）
     ③ Gemini AI で「コスメレビューか？」を Yes/No 判定（--title-only で省略可）
+       ②を通過した動画を --ai-batch-size 本ずつ1リクエストにまとめて判定する
+
+    --workers N を指定すると、②③と詳細抽出（字幕取得・Gemini 呼び出し）を
+    N 本の動画で同時に進める。DB への保存はメインスレッドが1件ずつ行う。
+
+    --enqueue を指定すると、①を通過した動画を字幕取得（--title-only なら詳細抽出）の
+    ジョブとして積んで終了する。②以降は work-queue のワーカーが処理する。
     
     Example:
         python batch_processor.py process-channel https://www.youtube.com/@cosmemory --title-only
         python batch_processor.py process-channel https://www.youtube.com/@cosmemory --max-videos 20
+        python batch_processor.py process-channel https://www.youtube.com/@cosmemory --max-videos 500 --workers 8
+        python batch_processor.py process-channel https://www.youtube.com/@cosmemory --max-videos 500 --enqueue
     """
     db = SessionLocal()
     youtube_service = YouTubeService()
@@ -514,90 +934,560 @@ def process_channel(
         db.close()
         return
 
-    logger.info(f"=== {len(videos)} 本の動画を取得。3段階フィルタリング開始 ===")
+    run_channel_pipeline(
+        db, youtube_service, gemini_service, videos,
+        density_threshold=density_threshold, skip_ai=skip_ai, title_only=title_only,
+        workers=workers, ai_batch_size=ai_batch_size, enqueue=enqueue,
+    )
+
+    db.close()
+    logger.info("チャンネル処理完了。")
 
-    stats = {'total': len(videos), 'pass_title': 0, 'pass_density': 0, 'pass_ai': 0, 'processed': 0, 'skipped_existing': 0}
 
-    for i, video_info in enumerate(videos, 1):
-        video_id = video_info['video_id']
-        title = video_info['title']
-        description = video_info['description']
+def load_sync_state(db: Session, youtube_service: YouTubeService, channel: str) -> Optional[ChannelSyncState]:
+    """
+    channel（URL / @ハンドル / ID）の同期状態を返す。
+    未登録なら uploads プレイリストを調べて新しく作る（コミットは呼び出し側で行う）。
+    """
+    state = db.query(ChannelSyncState).filter(ChannelSyncState.channel_input == channel).first()
+    if state:
+        return state
 
-        logger.info(f"\n[{i}/{len(videos)}] 📹 {title}")
+    channel_id = youtube_service.resolve_channel_id(channel)
+    if not channel_id:
+        logger.error(f"チャンネルIDを解決できません: {channel}")
+        return None
+    state = db.query(ChannelSyncState).filter(ChannelSyncState.channel_id == channel_id).first()
+    if state:
+        return state
 
-        # 処理済みチェック
-        existing = db.query(Video).filter(Video.id == video_id).first()
-        if existing:
-            logger.info(f"  ⏭️  既に処理済み。スキップ。")
-            stats['skipped_existing'] += 1
-            continue
+    uploads_playlist_id = youtube_service.get_uploads_playlist_id(channel_id)
+    if not uploads_playlist_id:
+        return None
+    state = ChannelSyncState(channel_id=channel_id, channel_input=channel, uploads_playlist_id=uploads_playlist_id)
+    db.add(state)
+    return state
 
-        # ===== ① タイトル判定 =====
-        if not filter_by_title(title, description):
-            logger.info(f"  ❌ ①タイトル判定: 「ベストコスメ/ベスコス」が含まれていません → スキップ")
+
+def sync_watermark(videos: List[dict], failed_video_ids: Iterable[str]) -> Optional[dict]:
+    """
+    同期位置として記録してよい最新の動画: 公開日時の古い順にたどり、最初に失敗した動画の直前まで。
+    失敗した動画を同期位置より古くすると、次回の取得で二度と取り直されないため。
+    """
+    failed = set(failed_video_ids)
+    newest = None
+    for video in sorted(videos, key=lambda v: v['published_at']):
+        if video['video_id'] in failed:
+            break
+        newest = video
+    return newest
+
+
+def sync_channel_videos(
+    db: Session,
+    youtube_service: YouTubeService,
+    gemini_service: GeminiService,
+    state: ChannelSyncState,
+    max_videos: int,
+    **pipeline_options,
+) -> Optional[dict]:
+    """
+    前回の同期以降に公開された動画だけを取得してパイプラインにかけ、同期状態を進める。
+    取得・処理の途中で例外が出た場合は同期状態を更新しない（次回同じ範囲を取り直す）。
+    一部の動画だけが失敗した場合は、失敗した最も古い動画の直前までしか進めない
+    （次回はその動画から取り直す。保存済みの動画は処理済みとして飛ばされる）。
+    """
+    label = state.channel_name or state.channel_id
+    videos = youtube_service.get_playlist_videos(
+        state.uploads_playlist_id,
+        max_results=max_videos,
+        stop_at_video_id=state.newest_video_id,
+        published_after=state.newest_published_at,
+    )
+    if state.newest_video_id and len(videos) >= max_videos:
+        logger.warning(f"{label}: 新着が {max_videos} 本以上あるため、それより古い新着動画は取得していません")
+
+    stats = None
+    if videos:
+        logger.info(f"{label}: 新着 {len(videos)} 本")
+        stats = run_channel_pipeline(db, youtube_service, gemini_service, videos, **pipeline_options)
+        newest = sync_watermark(videos, stats['failed_video_ids'])
+        if stats['failed_video_ids']:
+            logger.warning(
+                f"{label}: {len(stats['failed_video_ids'])} 本の処理に失敗したため、"
+                f"同期位置は{'その手前まで' if newest else '進めません'}（次回取り直します）"
+            )
+        if newest and (not state.newest_published_at or newest['published_at'] >= state.newest_published_at):
+            state.newest_video_id = newest['video_id']
+            state.newest_published_at = newest['published_at']
+        state.channel_name = max(videos, key=lambda v: v['published_at'])['channel_name']
+    else:
+        logger.info(f"{label}: 新着なし")
+    state.last_synced_at = datetime.utcnow()
+    db.commit()
+    return stats
+
+
+@app.command()
+def sync_channel(
+    channel: Optional[str] = typer.Argument(None, help="チャンネルURL、@ハンドル、またはチャンネルID（省略時は登録済みの全チャンネル）"),
+    max_videos: int = typer.Option(500, help="1チャンネルで取得する最大動画数（初回同期・間隔が空いた場合の上限）"),
+    density_threshold: float = typer.Option(COSME_DENSITY_THRESHOLD, help="字幕密度閾値（%）"),
+    skip_ai: bool = typer.Option(False, help="③AI分類をスキップする"),
+    title_only: bool = typer.Option(False, help="①タイトル判定のみで②③をスキップ"),
+    workers: int = typer.Option(1, help="②③と詳細抽出を並列実行するワーカー数（DB書き込みは常に1スレッド）"),
+    ai_batch_size: int = typer.Option(AI_CLASSIFICATION_BATCH_SIZE, help="③AI分類を1リクエストにまとめる動画数"),
+    enqueue: bool = typer.Option(False, help="①の通過分をジョブとして積むだけにし、②以降は work-queue に任せる"),
+):
+    """
+    チャンネルの新着動画だけを取得して処理する（差分同期）。
+
+    チャンネルごとに uploads プレイリストIDと取り込み済みの最新動画（channel_sync_states）を記録し、
+    次回はその動画に達した時点でページングを止める。毎日の更新なら API 呼び出しは1〜2ページで済む。
+    初回は process-channel と同じく最新から --max-videos 本を処理する。
+    フィルタリングと詳細抽出の内容は process-channel と同じ。
+
+    Example:
+        python batch_processor.py sync-channel https://www.youtube.com/@cosmemory
+        python batch_processor.py sync-channel            # 登録済みの全チャンネル
+        python batch_processor.py sync-channel --enqueue
+    """
+    db = SessionLocal()
+    youtube_service = YouTubeService()
+    gemini_service = GeminiService()
+    pipeline_options = dict(
+        density_threshold=density_threshold, skip_ai=skip_ai, title_only=title_only,
+        workers=workers, ai_batch_size=ai_batch_size, enqueue=enqueue,
+    )
+
+    if channel:
+        state = load_sync_state(db, youtube_service, channel)
+        states = [state] if state else []
+    else:
+        states = db.query(ChannelSyncState).order_by(ChannelSyncState.channel_id).all()
+        if not states:
+            logger.info("同期状態が登録されたチャンネルはありません。チャンネルを指定して実行してください。")
+
+    for state in states:
+        try:
+            sync_channel_videos(db, youtube_service, gemini_service, state, max_videos, **pipeline_options)
+        except QuotaExceededError as e:
+            # 同期状態は進めていないので、クォータが戻ってから再実行すれば続きから取り直せる
+            db.rollback()
+            logger.error(f"{e} 残りのチャンネルの同期を中止します。")
+            break
+        except Exception as e:
+            db.rollback()
+            logger.error(f"チャンネル同期エラー ({state.channel_name or state.channel_id}): {e}")
+
+    db.close()
+    logger.info("チャンネル同期完了。")
+
+
+@app.command()
+def enrich_missing(
+    limit: int = typer.Option(100, help="今回詳細を生成する最大商品数"),
+    batch_size: int = typer.Option(ENRICH_BATCH_SIZE, help="1リクエストにまとめる商品数"),
+    concurrency_per_key: int = typer.Option(None, help="APIキー1本あたりの同時リクエスト数（既定は GEMINI_CONCURRENCY_PER_KEY）"),
+):
+    """
+    説明文が未生成の商品について、Gemini で詳細情報を一括生成する。
+
+    --batch-size 件ずつ1リクエストにまとめ、バッチ同士は非同期で同時に投げて
+    キーごとの同時実行数とレート上限の範囲でキープール全体に振り分ける。
+    DB への反映は最後に1回のコミットで行う。
+
+    Example:
+        python batch_processor.py enrich-missing --limit 200
+    """
+    db = SessionLocal()
+    gemini_service = GeminiService(concurrency_per_key=concurrency_per_key)
+
+    products = (
+        db.query(Product)
+        .filter(Product.description.is_(None) | (Product.description == ''))
+        .order_by(Product.id)
+        .limit(limit)
+        .all()
+    )
+    logger.info(f"詳細未生成の商品: {len(products)} 件")
+    if not products:
+        db.close()
+        return
+
+    details = asyncio.run(
+        gemini_service.enrich_products_async([_enrichment_request(p) for p in products], batch_size)
+    )
+
+    enriched = 0
+    for product in products:
+        data = details.get(product.id)
+        if data is None:
+            logger.warning(f"  商品詳細の生成に失敗: {product.name}")
             continue
-        logger.info(f"  ✅ ①タイトル判定: 通過")
-        stats['pass_title'] += 1
+        apply_product_details(product, data)
+        product.enrichment_status = job_queue.STATUS_DONE
+        enriched += 1
+    db.commit()
 
-        # ===== ② 字幕密度判定 =====
-        if not title_only:
-            transcript = youtube_service.get_transcript(video_id)
-            if not transcript:
-                # 字幕取得失敗時：タイトル判定を通過しているのでスキップせず先に進む
-                logger.info(f"  ⚠️  ②字幕取得失敗 → タイトル判定通過済みのため、字幕密度チェックをスキップ")
-                stats['pass_density'] += 1
+    logger.info(f"商品詳細を生成しました: {enriched}/{len(products)} 件")
+    db.close()
+
+
+# ジョブの種類ごとの表示名
+JOB_LABELS = {
+    job_queue.JOB_FETCH_TRANSCRIPT: '②字幕取得・密度判定',
+    job_queue.JOB_CLASSIFY: '③AI分類',
+    job_queue.JOB_EXTRACT: '詳細抽出',
+    job_queue.JOB_RESOLVE_PRODUCT: '公式情報の解決',
+    job_queue.JOB_ENRICH_PRODUCT: '詳細生成',
+}
+
+
+class QueueWorker:
+    """
+    work-queue コマンドのワーカー本体。
+
+    種類ごとにジョブをリース付きで取り出し、処理中はハートビートでリースを延長する。
+    字幕取得・Gemini 呼び出し・Amazon 検索はスレッドで並列に行い、
+    次の段階のジョブ登録や DB への反映はメインスレッドで行う。
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        workers: int,
+        batch_size: int,
+        ai_batch_size: int,
+        lease_seconds: float = job_queue.JOB_LEASE_SECONDS,
+    ):
+        self.db = db
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.ai_batch_size = ai_batch_size
+        self.lease_seconds = lease_seconds
+        self.worker_id = job_queue.new_worker_id()
+        self.gemini_service = GeminiService()
+        self._youtube_service: Optional[YouTubeService] = None
+        self.handlers = {
+            job_queue.JOB_FETCH_TRANSCRIPT: self.fetch_transcripts,
+            job_queue.JOB_CLASSIFY: self.classify,
+            job_queue.JOB_EXTRACT: self.extract,
+            job_queue.JOB_RESOLVE_PRODUCT: self.resolve_products,
+            job_queue.JOB_ENRICH_PRODUCT: self.enrich_products,
+        }
+
+    @property
+    def youtube_service(self) -> YouTubeService:
+        # 商品のジョブだけを処理するワーカーでは YouTube API を使わない
+        if self._youtube_service is None:
+            self._youtube_service = YouTubeService()
+        return self._youtube_service
+
+    def run_once(self, job_types: List[str], claim_size: int) -> int:
+        """各種類のジョブを最大 claim_size 件ずつ取り出して処理し、処理した件数を返す"""
+        handled = 0
+        for job_type in job_types:
+            jobs = job_queue.claim(self.db, job_type, claim_size, self.worker_id, self.lease_seconds)
+            if not jobs:
+                continue
+            logger.info(f"{JOB_LABELS[job_type]}: {len(jobs)} 件")
+            with job_queue.Heartbeat(SessionLocal, jobs, self.worker_id, self.lease_seconds):
+                try:
+                    self.handlers[job_type](jobs)
+                except Exception as e:
+                    logger.error(f"{JOB_LABELS[job_type]}の処理エラー: {e}")
+                    self.db.rollback()
+                    for job in jobs:
+                        job_queue.fail(self.db, job, self.worker_id, str(e))
+                    self.db.commit()
+            handled += len(jobs)
+        return handled
+
+    def _complete(self, job):
+        job_queue.complete(self.db, job, self.worker_id)
+
+    def _fail(self, job, error: str) -> bool:
+        return job_queue.fail(self.db, job, self.worker_id, error)
+
+    def fetch_transcripts(self, jobs: list):
+        """②字幕取得・密度判定。通過した動画は③AI分類（skip_ai なら詳細抽出）のジョブを積む"""
+        payloads = {job.id: job_queue.payload_of(job) for job in jobs}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(
+                    screen_channel_video, self.youtube_service, payloads[job.id]['video_info'],
+                    f"[{job.key}]", payloads[job.id].get('density_threshold', COSME_DENSITY_THRESHOLD),
+                ): job
+                for job in jobs
+            }
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    outcome = future.result()
+                except Exception as e:
+                    self._fail(job, str(e))
+                    self.db.commit()
+                    continue
+                if outcome['pass_density']:
+                    payload = dict(payloads[job.id], transcript_sample=outcome['transcript_sample'])
+                    next_type = job_queue.JOB_EXTRACT if payload.get('skip_ai') else job_queue.JOB_CLASSIFY
+                    job_queue.enqueue(self.db, next_type, job.key, payload)
+                self._complete(job)
+                # 1件ごとにコミットし、ハートビートが同じ行を更新するのを待たせない
+                self.db.commit()
+
+    def classify(self, jobs: list):
+        """③AI分類を ai_batch_size 本ずつまとめて行い、通過した動画は詳細抽出のジョブを積む"""
+        payloads = {job.id: job_queue.payload_of(job) for job in jobs}
+        batches = [jobs[i:i + self.ai_batch_size] for i in range(0, len(jobs), self.ai_batch_size)]
+        verdicts = {}
+        for batch_verdicts in _run_parallel(
+            lambda batch: filter_by_ai_classification_batch(self.gemini_service, [
+                {
+                    'video_id': job.key,
+                    'title': payloads[job.id]['video_info']['title'],
+                    'description': payloads[job.id]['video_info']['description'],
+                    'transcript_sample': payloads[job.id].get('transcript_sample', ''),
+                }
+                for job in batch
+            ]),
+            batches, self.workers
+        ):
+            # 失敗したバッチの動画は下で verdicts にないものとして失敗を記録する
+            if not isinstance(batch_verdicts, TaskFailure):
+                verdicts.update(batch_verdicts)
+
+        for job in jobs:
+            if job.key not in verdicts:
+                self._fail(job, "AI分類の結果がありません")
+                continue
+            if verdicts[job.key]:
+                logger.info(f"[{job.key}]  ✅ ③AI分類: コスメレビューと判定 → 通過")
+                job_queue.enqueue(self.db, job_queue.JOB_EXTRACT, job.key, payloads[job.id])
+            else:
+                logger.info(f"[{job.key}]  ❌ ③AI分類: コスメレビューではないと判定 → スキップ")
+            self._complete(job)
+        self.db.commit()
+
+    def extract(self, jobs: list):
+        """詳細抽出: Gemini での商品抽出は並列に行い、保存はメインスレッドで1本ずつ行う"""
+        payloads = {job.id: job_queue.payload_of(job) for job in jobs}
+        existing = find_existing_video_ids(self.db, [job.key for job in jobs])
+
+        pending = []
+        for job in jobs:
+            if job.key in existing:
+                logger.info(f"[{job.key}]  ⏭️  既に処理済み。スキップ。")
+                self._complete(job)
             else:
-                density = filter_by_transcript_density(transcript)
-                if density < density_threshold:
-                    logger.info(f"  ❌ ②字幕密度: {density:.2f}% < 閾値{density_threshold}% → スキップ")
+                pending.append(job)
+        self.db.commit()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(
+                    extract_video_products, self.youtube_service, self.gemini_service,
+                    job.key, _channel_video_snippet(payloads[job.id]['video_info']),
+                ): job
+                for job in pending
+            }
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    analysis = future.result()
+                except Exception as e:
+                    self._fail(job, str(e))
+                    self.db.commit()
                     continue
-                logger.info(f"  ✅ ②字幕密度: {density:.2f}% ≥ 閾値{density_threshold}% → 通過")
-                stats['pass_density'] += 1
-
-            # ===== ③ AI分類 =====
-            if not skip_ai:
-                transcript_sample = ''
-                if transcript:
-                    transcript_sample = ' '.join([item.get('text', '') for item in transcript[:50]])
-                is_cosme = filter_by_ai_classification(gemini_service, title, description, transcript_sample)
-                if not is_cosme:
-                    logger.info(f"  ❌ ③AI分類: コスメレビューではないと判定 → スキップ")
+                # 他のワーカーがリース切れ後に取り直して先に保存している場合がある
+                if analysis and not self.db.query(Video.id).filter(Video.id == job.key).first():
+                    save_video_results(
+                        self.db, job.key, _channel_video_snippet(payloads[job.id]['video_info']), analysis
+                    )
+                self._complete(job)
+                self.db.commit()
+
+    def resolve_products(self, jobs: list):
+        """公式情報の解決: Amazon 検索は並列に行い、DB への反映はメインスレッドで行う"""
+        products = {p.id: p for p in self.db.query(Product).filter(Product.id.in_([job.key for job in jobs]))}
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {}
+            for job in jobs:
+                product = products.get(job.key)
+                if product is None:
+                    self._fail(job, "商品が存在しません")
                     continue
-                logger.info(f"  ✅ ③AI分類: コスメレビューと判定 → 通過")
-                time.sleep(1)  # API レート制限対策
-            stats['pass_ai'] += 1
-        else:
-            logger.info(f"  ⏩ ②③スキップ（--title-only モード）")
-            stats['pass_density'] += 1
-            stats['pass_ai'] += 1
-
-        # ===== 詳細抽出 =====
-        logger.info(f"  🔍 詳細抽出開始...")
-        snippet = {
-            'title': title,
-            'channelTitle': video_info['channel_name'],
-            'description': description,
-            'publishedAt': video_info['published_at'],
-            'thumbnails': {'high': {'url': video_info['thumbnail_url']}},
-        }
-        process_video_item(db, youtube_service, gemini_service, video_id, snippet)
-        stats['processed'] += 1
+                futures[executor.submit(resolve_official_product_info, product.name, product.brand)] = job
+            self.db.commit()
+
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    info = future.result()
+                except Exception as e:
+                    self._fail(job, str(e))
+                    self.db.commit()
+                    continue
+                product = products[job.key]
+                if info['image_url'] and not product.image_url:
+                    product.image_url = info['image_url']
+                if info['price'] and not product.price:
+                    product.price = info['price']
+                self._complete(job)
+                # 1件ごとにコミットし、ハートビートが同じ行を更新するのを待たせない
+                self.db.commit()
+
+    def enrich_products(self, jobs: list):
+        """詳細生成: batch_size 件ずつ1リクエストにまとめ、バッチ同士は非同期で同時に投げる"""
+        products = {p.id: p for p in self.db.query(Product).filter(Product.id.in_([job.key for job in jobs]))}
+        details = asyncio.run(
+            self.gemini_service.enrich_products_async(
+                [_enrichment_request(p) for p in products.values()], self.batch_size
+            )
+        )
 
-    # 統計レポート
-    logger.info(f"\n{'='*50}")
-    logger.info(f"📊 処理結果サマリー")
-    logger.info(f"{'='*50}")
-    logger.info(f"  全動画数:        {stats['total']}")
-    logger.info(f"  処理済スキップ:  {stats['skipped_existing']}")
-    logger.info(f"  ①タイトル通過:   {stats['pass_title']}")
-    logger.info(f"  ②字幕密度通過:   {stats['pass_density']}")
-    logger.info(f"  ③AI分類通過:     {stats['pass_ai']}")
-    logger.info(f"  詳細抽出完了:    {stats['processed']}")
-    logger.info(f"{'='*50}")
+        for job in jobs:
+            product = products.get(job.key)
+            if product is None:
+                self._fail(job, "商品が存在しません")
+                continue
+            data = details.get(product.id)
+            if data is None:
+                if not self._fail(job, "詳細を生成できませんでした"):
+                    product.enrichment_status = job_queue.STATUS_FAILED
+                continue
+            apply_product_details(product, data)
+            product.enrichment_status = job_queue.STATUS_DONE
+            self._complete(job)
+        self.db.commit()
+
+
+@app.command()
+def work_queue(
+    workers: int = typer.Option(4, help="字幕取得・Gemini 呼び出し・Amazon 検索を並列実行するスレッド数"),
+    batch_size: int = typer.Option(ENRICH_BATCH_SIZE, help="詳細生成で1リクエストにまとめる商品数"),
+    ai_batch_size: int = typer.Option(AI_CLASSIFICATION_BATCH_SIZE, help="③AI分類を1リクエストにまとめる動画数"),
+    claim_size: int = typer.Option(50, help="1回に取り出すジョブ数（種類ごと）"),
+    types: str = typer.Option(",".join(job_queue.JOB_TYPES), help="処理するジョブの種類（カンマ区切り）"),
+    lease_seconds: float = typer.Option(job_queue.JOB_LEASE_SECONDS, help="取り出したジョブのリースの長さ（秒）"),
+    poll_interval: float = typer.Option(10.0, help="キューが空のときに次の確認まで待つ秒数"),
+    once: bool = typer.Option(False, help="キューが空になったら終了する"),
+):
+    """
+    キューに積まれたジョブ（字幕取得・AI分類・詳細抽出・商品の公式情報解決・詳細生成）を処理するワーカー。
+
+    同じ DB に繋いでいれば、何プロセス・何台で同時に起動しても同じジョブを二重に処理しない。
+    ワーカーが落ちたジョブはリースが切れた後に他のワーカーが取り直し、
+    失敗したジョブは間隔を空けて再試行する。--types で処理する段階を分担できる。
+
+    Example:
+        python batch_processor.py work-queue --once
+        python batch_processor.py work-queue --workers 8 --batch-size 20
+        python batch_processor.py work-queue --types fetch_transcript,classify,extract
+    """
+    job_types = [t.strip() for t in types.split(',') if t.strip()]
+    unknown = [t for t in job_types if t not in job_queue.JOB_TYPES]
+    if unknown:
+        raise typer.BadParameter(f"未知のジョブ種類: {', '.join(unknown)}（{', '.join(job_queue.JOB_TYPES)}）")
 
+    db = SessionLocal()
+    worker = QueueWorker(db, workers, batch_size, ai_batch_size, lease_seconds)
+    logger.info(f"ワーカー {worker.worker_id} を起動: {', '.join(job_types)}")
+
+    handled = 0
+    while True:
+        processed = worker.run_once(job_types, claim_size)
+        handled += processed
+        if processed:
+            continue
+        if once:
+            break
+        time.sleep(poll_interval)
+
+    for job_type, by_status in job_queue.counts(db).items():
+        logger.info(f"  {job_type}: " + ", ".join(f"{status} {count}" for status, count in sorted(by_status.items())))
+    logger.info(f"ジョブ処理完了: {handled} 件")
     db.close()
-    logger.info("チャンネル処理完了。")
+
+
+@app.command()
+def youtube_quota(
+    day: str = typer.Option(None, help="集計日（太平洋時間の YYYY-MM-DD、既定は今日）"),
+):
+    """
+    YouTube Data API のクォータ使用量（メソッドごとの消費・呼び出し回数と残り）を表示する。
+
+    Example:
+        python batch_processor.py youtube-quota
+    """
+    store = get_youtube_api_store()
+    day = day or quota_day()
+    usage = store.usage(day)
+    used = sum(units for units, _ in usage.values())
+    logger.info(f"YouTube API クォータ（{day}、太平洋時間）: {used}/{store.daily_quota} 使用、残り {max(0, store.daily_quota - used)}")
+    for method, (units, calls) in usage.items():
+        logger.info(f"  {method}: {units} ({calls}回)")
+
+
+@app.command("gemini-usage")
+def gemini_usage_report(
+    run_id: str = typer.Option(None, "--run", help="集計する実行ID（既定は直近の実行）"),
+    hours: float = typer.Option(None, help="実行IDではなく直近 N 時間の全実行を集計する"),
+    group_by: str = typer.Option("prompt_type", "--by", help="集計単位: prompt_type / key_index / model"),
+    runs: bool = typer.Option(False, "--runs", help="直近の実行の一覧を表示する"),
+):
+    """
+    Gemini API の使用量（呼び出し回数・入出力トークン・レイテンシ・リトライ）を実行単位で集計して表示する。
+
+    Example:
+        python batch_processor.py gemini-usage --runs
+        python batch_processor.py gemini-usage --run 20250101-120000-1234 --by key_index
+        python batch_processor.py gemini-usage --hours 24
+    """
+    if group_by not in ('prompt_type', 'key_index', 'model'):
+        logger.error(f"--by は prompt_type / key_index / model のいずれか: {group_by}")
+        raise typer.Exit(1)
+
+    ledger = gemini_usage.get_usage_ledger()
+    if runs:
+        for run in ledger.runs():
+            started = datetime.fromtimestamp(run['started_at']).strftime('%Y-%m-%d %H:%M:%S')
+            logger.info(
+                f"  {run['run_id']}  {started}〜  {run['calls']}回  "
+                f"入力 {run['input_tokens']} / 出力 {run['output_tokens']} トークン"
+            )
+        return
+
+    since = None
+    if hours is not None:
+        since = time.time() - hours * 3600
+        label = f"直近 {hours:g} 時間"
+    else:
+        if not run_id:
+            recent = ledger.runs(limit=1)
+            if not recent:
+                logger.info("Gemini の使用記録がありません")
+                return
+            run_id = recent[0]['run_id']
+        label = f"実行 {run_id}"
+
+    rows = ledger.summary(run_id=run_id, since=since, group_by=group_by)
+
+    logger.info(f"Gemini 使用量（{label}）: {sum(r['calls'] for r in rows)}回")
+    for r in rows:
+        ratio = f"{r['estimate_ratio']:.2f}" if r['estimate_ratio'] is not None else "-"
+        logger.info(
+            f"  {r[group_by]}: {r['calls']}回 (エラー {r['errors']} / リトライ {r['retries']}) "
+            f"入力 {r['input_tokens']} / 出力 {r['output_tokens']} トークン "
+            f"平均 {r['avg_latency_ms']:.0f}ms / 最大 {r['max_latency_ms']:.0f}ms 見積/実績 {ratio}"
+        )
 
 
 if __name__ == "__main__":
-    app()
+    try:
+        app()
+    except QuotaExceededError as e:
+        logger.error(str(e))
+        raise SystemExit(1)
@@ -0,0 +1,195 @@
+"""
+検索結果ページ解析（services/html_extract.py）のベンチマーク。
+
+Amazon / @cosme / 楽天の検索結果ページについて、従来のページ全体の解析
+（BeautifulSoup + html.parser）と、先頭の結果だけを切り出す部分解析の
+1ページあたりの処理時間を比較し、抽出結果が一致することを確認する。
+
+ページは bench_fixtures/ に保存したものを使う（ブラウザで「ページを保存」した HTML）:
+  bench_fixtures/amazon_search.html
+  bench_fixtures/cosme_search.html
+  bench_fixtures/rakuten_search.html
+保存されていないサイトは、実際のページに近い大きさ・構造の合成ページで計測する。
+加えて、リポジトリに入れてある小さなページ（tests/fixtures/html/。UTF-8・Shift_JIS・EUC-JP）でも
+結果が一致することを確認する（こちらは小さいので処理時間の比較には向かない）。
+
+使い方:
+  python bench_html_parsing.py
+  python bench_html_parsing.py --repeat 50 --results 60
+"""
+import argparse
+import os
+import random
+import time
+
+from bs4 import BeautifulSoup
+
+from fetch_product_images import (
+    COSME_FALLBACK_IMAGE_SELECTOR, COSME_IMAGE_SELECTOR, RAKUTEN_IMAGE_MARKERS, RAKUTEN_IMAGE_SELECTOR,
+    find_cosme_image,
+)
+from services.amazon import parse_search_page
+from services.html_extract import HTML_PARSER, select_first, sniff_encoding
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BASE_DIR, "bench_fixtures")
+TEST_FIXTURE_DIR = os.path.join(BASE_DIR, "tests", "fixtures", "html")
+TEST_FIXTURES = {
+    "amazon": "amazon_search.html",
+    "cosme": "cosme_search_sjis.html",
+    "rakuten": "rakuten_search_eucjp.html",
+}
+
+
+def _filler(rng: random.Random, size: int) -> str:
+    """ページ先頭のスクリプト・スタイル・ナビゲーション相当の要素"""
+    parts = []
+    total = 0
+    while total < size:
+        chunk = rng.choice([
+            '<script>window.__data = {"k": "%s"};</script>' % ('x' * rng.randint(200, 2000)),
+            '<style>.c%d { margin: 0; padding: 0; }</style>' % rng.randint(0, 10 ** 6),
+            '<div class="nav"><ul>%s</ul></div>' % ''.join(
+                '<li><a href="/c/%d">カテゴリ%d</a></li>' % (i, i) for i in range(rng.randint(5, 30))
+            ),
+        ])
+        parts.append(chunk)
+        total += len(chunk)
+    return ''.join(parts)
+
+
+def synth_amazon(rng: random.Random, results: int) -> str:
+    cards = []
+    for i in range(results):
+        asin = f"B0{rng.randint(10 ** 7, 10 ** 8 - 1)}"
+        cards.append(f"""
+<div data-component-type="s-search-result" data-asin="{asin}" class="s-result-item">
+  <div class="s-card-container">{'<span class="a-declarative"></span>' * rng.randint(50, 200)}
+    <img class="s-image" src="https://m.media-amazon.com/images/I/{asin}.jpg" alt="商品{i}">
+    <h2><a href="/商品{i}/dp/{asin}/ref=sr_1_{i}">商品{i} リキッドファンデーション</a></h2>
+    <span class="a-price"><span class="a-offscreen">￥{rng.randint(500, 9000):,}</span></span>
+  </div>
+</div>""")
+    return f"<html><head>{_filler(rng, 150_000)}</head><body>{_filler(rng, 50_000)}{''.join(cards)}{_filler(rng, 100_000)}</body></html>"
+
+
+def synth_cosme(rng: random.Random, results: int) -> str:
+    items = []
+    for i in range(results):
+        items.append(f"""
+<li class="p-cosme-product-list__item">{'<span class="star"></span>' * rng.randint(20, 80)}
+  <a href="/product/product_id/{10 ** 7 + i}/top">
+    <img class="p-cosme-product-list__image" data-src="https://cosme-global-production.s3.amazonaws.com/{i}.jpg" src="/blank.gif">
+  </a>
+  <p class="p-cosme-product-list__name">商品{i}</p>
+</li>""")
+    return f"<html><head>{_filler(rng, 120_000)}</head><body>{_filler(rng, 40_000)}<ul>{''.join(items)}</ul>{_filler(rng, 80_000)}</body></html>"
+
+
+def synth_rakuten(rng: random.Random, results: int) -> str:
+    items = []
+    for i in range(results):
+        items.append(f"""
+<div class="searchresultitem">
+  <div class="dui-card__imageContainer">{'<i class="badge"></i>' * rng.randint(20, 80)}
+    <img src="https://thumbnail.image.rakuten.co.jp/@0_mall/shop/cabinet/{i}.jpg" alt="商品{i}">
+  </div>
+  <div class="content title"><a href="https://item.rakuten.co.jp/shop/{i}/">商品{i}</a></div>
+</div>""")
+    return f"<html><head>{_filler(rng, 150_000)}</head><body>{_filler(rng, 60_000)}{''.join(items)}{_filler(rng, 100_000)}</body></html>"
+
+
+def _img_src(img, primary: str, secondary: str):
+    return (img.get(primary) or img.get(secondary)) if img is not None else None
+
+
+def _full_parse(content: bytes) -> BeautifulSoup:
+    """従来の解析（ページ全体をデコードして html.parser で解析）"""
+    return BeautifulSoup(content.decode(sniff_encoding(content) or 'utf-8'), 'html.parser')
+
+
+def full_amazon(content: bytes):
+    first = _full_parse(content).select_one('[data-component-type="s-search-result"]')
+    if not first:
+        return None
+    img = first.select_one('img.s-image')
+    price = first.select_one('.a-price .a-offscreen')
+    return (img.get('src') if img else None, price.get_text(strip=True) if price else None)
+
+
+def partial_amazon(content: bytes):
+    result = parse_search_page(content)
+    return (result.image_url, result.price) if result else None
+
+
+def full_cosme(content: bytes):
+    soup = _full_parse(content)
+    img = soup.select_one(COSME_IMAGE_SELECTOR) or soup.select_one(COSME_FALLBACK_IMAGE_SELECTOR)
+    return _img_src(img, 'data-src', 'src')
+
+
+def partial_cosme(content: bytes):
+    return _img_src(find_cosme_image(content), 'data-src', 'src')
+
+
+def full_rakuten(content: bytes):
+    img = _full_parse(content).select_one(RAKUTEN_IMAGE_SELECTOR)
+    return _img_src(img, 'src', 'data-src')
+
+
+def partial_rakuten(content: bytes):
+    return _img_src(select_first(content, RAKUTEN_IMAGE_SELECTOR, RAKUTEN_IMAGE_MARKERS), 'src', 'data-src')
+
+
+SITES = [
+    ("amazon", "amazon_search.html", synth_amazon, full_amazon, partial_amazon),
+    ("cosme", "cosme_search.html", synth_cosme, full_cosme, partial_cosme),
+    ("rakuten", "rakuten_search.html", synth_rakuten, full_rakuten, partial_rakuten),
+]
+
+
+def _time_per_page(fn, content: bytes, repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn(content)
+    return (time.perf_counter() - t0) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="検索結果ページ解析のベンチマーク")
+    parser.add_argument("--repeat", type=int, default=20, help="1ページあたりの計測回数")
+    parser.add_argument("--results", type=int, default=48, help="合成ページに含める検索結果の件数")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"部分解析のパーサー: {HTML_PARSER}")
+    print(f"{'サイト':<8} {'ページ':<6} {'サイズ(KB)':>10} {'全体解析(ms)':>13} {'部分解析(ms)':>13} {'倍率':>7} {'結果一致':>8}")
+    for name, fixture, synth, full_fn, partial_fn in SITES:
+        path = os.path.join(FIXTURE_DIR, fixture)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                content = f.read()
+            source = "保存"
+        else:
+            content = synth(rng, args.results).encode('utf-8')
+            source = "合成"
+
+        full_ms = _time_per_page(full_fn, content, args.repeat)
+        partial_ms = _time_per_page(partial_fn, content, args.repeat)
+        same = full_fn(content) == partial_fn(content)
+        print(
+            f"{name:<8} {source:<6} {len(content) / 1024:>10.0f} {full_ms:>13.2f} {partial_ms:>13.2f} "
+            f"{full_ms / partial_ms:>6.1f}x {('OK' if same else 'NG'):>8}"
+        )
+
+    print(f"\n{'サイト':<8} {'テスト用ページ':<28} {'文字コード':<10} {'結果':<60} {'結果一致':>8}")
+    for name, _, _, full_fn, partial_fn in SITES:
+        with open(os.path.join(TEST_FIXTURE_DIR, TEST_FIXTURES[name]), 'rb') as f:
+            content = f.read()
+        expected = full_fn(content)
+        same = expected == partial_fn(content)
+        print(f"{name:<8} {TEST_FIXTURES[name]:<28} {sniff_encoding(content) or '-':<10} {str(expected)[:60]:<60} {('OK' if same else 'NG'):>8}")
+
+
+if __name__ == "__main__":
+    main()
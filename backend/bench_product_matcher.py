@@ -0,0 +1,132 @@
+"""
+名寄せ索引（ProductMatcher）のベンチマーク。
+
+合成した商品カタログに対して 1件あたりの検索レイテンシを計測し、
+従来の全件走査（normalize_name + SequenceMatcher）と比較する。
+一括照合（find_many）は1本の動画分（--batch-size 件）ずつまとめて計測する。
+
+使い方:
+  python bench_product_matcher.py
+  python bench_product_matcher.py --sizes 1000 10000 100000 --queries 200
+"""
+import argparse
+import random
+import time
+from difflib import SequenceMatcher
+
+from services.product_matcher import (
+    BRAND_BONUS, BRAND_MATCH_THRESHOLD, MATCH_THRESHOLD, ProductMatcher, normalize_name,
+)
+
+KANA = 'アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモヤユヨラリルレロワン'
+WORDS = [
+    'リキッド', 'ファンデーション', 'クッション', 'リップ', 'ティント', 'グロス', 'アイシャドウ',
+    'パレット', 'マスカラ', 'アイライナー', 'チーク', 'ハイライト', 'コンシーラー', 'プライマー',
+    'セラム', 'エッセンス', 'ローション', 'クリーム', 'ミルク', 'バーム', 'オイル', 'UV',
+    'トーンアップ', 'モイスト', 'マット', 'グロウ', 'ベルベット', 'シアー', 'ロングウェア', 'プロテクション',
+]
+
+
+def _random_word(rng: random.Random, length: int) -> str:
+    return ''.join(rng.choice(KANA) for _ in range(length))
+
+
+def build_catalog(size: int, seed: int = 0) -> list:
+    """(id, 商品名, ブランド名) の合成カタログを作る"""
+    rng = random.Random(seed)
+    brands = [_random_word(rng, rng.randint(3, 6)) for _ in range(max(50, size // 50))]
+    catalog = []
+    for i in range(size):
+        name = ' '.join([
+            _random_word(rng, rng.randint(2, 5)),
+            rng.choice(WORDS),
+            rng.choice(WORDS),
+            f"{rng.randint(1, 30):02d}",
+        ])
+        catalog.append((f"p{i}", name, rng.choice(brands)))
+    return catalog
+
+
+def build_queries(catalog: list, count: int, seed: int = 1) -> list:
+    """表記揺れ（1文字置換・空白・括弧）を加えた既存商品と、未知の商品を混ぜた問い合わせ"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        _, name, brand = rng.choice(catalog)
+        kind = rng.random()
+        if kind < 0.3:
+            queries.append((name.replace(' ', '　') + f"（{brand}）", brand))
+        elif kind < 0.7:
+            pos = rng.randrange(len(name))
+            queries.append((name[:pos] + rng.choice(KANA) + name[pos + 1:], brand))
+        else:
+            queries.append((_random_word(rng, 4) + ' ' + rng.choice(WORDS), brand))
+    return queries
+
+
+def linear_find(catalog: list, product_name: str, brand_name: str = None):
+    """従来の全件走査による名寄せ"""
+    normalized_new = normalize_name(product_name)
+    best_id, best_score = None, 0.0
+    for product_id, name, brand in catalog:
+        normalized_existing = normalize_name(name)
+        if normalized_new == normalized_existing:
+            return product_id
+        score = SequenceMatcher(None, normalized_new, normalized_existing).ratio()
+        if brand_name and brand:
+            brand_score = SequenceMatcher(None, normalize_name(brand_name), normalize_name(brand)).ratio()
+            if brand_score > BRAND_MATCH_THRESHOLD:
+                score += BRAND_BONUS
+        if score > best_score:
+            best_id, best_score = product_id, score
+    return best_id if best_score >= MATCH_THRESHOLD else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="名寄せ索引のベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=30, help="find_many に渡す1回分の件数")
+    parser.add_argument("--linear-max-size", type=int, default=10000,
+                        help="全件走査の比較を行う最大カタログサイズ")
+    args = parser.parse_args()
+
+    print(f"{'件数':>8} {'構築(s)':>9} {'索引(ms/件)':>12} {'一括(ms/件)':>12} {'全件走査(ms/件)':>16} {'一致率':>8}")
+    for size in args.sizes:
+        catalog = build_catalog(size)
+        queries = build_queries(catalog, args.queries)
+
+        t0 = time.perf_counter()
+        matcher = ProductMatcher()
+        for product_id, name, brand in catalog:
+            matcher.add(product_id, name, brand)
+        build_sec = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        indexed = []
+        for name, brand in queries:
+            match = matcher.find(name, brand)
+            indexed.append(match.product_id if match else None)
+        indexed_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+
+        t0 = time.perf_counter()
+        for start in range(0, len(queries), args.batch_size):
+            matcher.find_many(queries[start:start + args.batch_size])
+        batch_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+
+        linear_ms = agreement = None
+        if size <= args.linear_max_size:
+            t0 = time.perf_counter()
+            linear = [linear_find(catalog, name, brand) for name, brand in queries]
+            linear_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+            agreement = sum(a == b for a, b in zip(indexed, linear)) / len(queries)
+
+        print(
+            f"{size:>8} {build_sec:>9.2f} {indexed_ms:>12.3f} {batch_ms:>12.3f} "
+            f"{(f'{linear_ms:.3f}' if linear_ms is not None else '-'):>16} "
+            f"{(f'{agreement:.1%}' if agreement is not None else '-'):>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
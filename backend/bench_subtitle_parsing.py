@@ -0,0 +1,195 @@
+"""
+字幕ファイル解析（services/subtitle_parser.py）のベンチマーク。
+
+yt-dlp フォールバックで取得する数時間分の自動字幕について、従来の解析
+（レスポンス全文をデコード → splitlines → タイムスタンプ行ごとに後続行を走査）と、
+チャンクを受け取りながら1回だけ走査するストリーミング解析の処理時間・ピークメモリを比較し、
+VTT では結果が一致することを確認する。SRV3 / JSON3 はストリーミング解析のみ計測する。
+
+字幕は bench_fixtures/ に保存したものを使う（yt-dlp --write-auto-subs --sub-format vtt/srv3/json3 で取得）:
+  bench_fixtures/auto_captions.ja.vtt
+  bench_fixtures/auto_captions.ja.srv3
+  bench_fixtures/auto_captions.ja.json3
+保存されていない形式は、YouTube の自動字幕と同じ構造（<c> タグ・単語ごとのタイムスタンプ・
+10ms の繰り返しキュー）の合成ファイルで計測する。
+
+使い方:
+  python bench_subtitle_parsing.py
+  python bench_subtitle_parsing.py --hours 6 --repeat 5
+"""
+import argparse
+import json
+import os
+import random
+import re
+import time
+import tracemalloc
+from xml.sax.saxutils import escape
+
+from services.subtitle_parser import iter_segments
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_fixtures")
+CHUNK_BYTES = 64 * 1024
+
+WORDS = ['今日', 'は', 'この', 'ファンデ', 'を', '使って', 'みた', 'んです', 'けど', '発色', 'が', 'すごく',
+         '良くて', '保湿', '力', 'も', 'あって', '乾燥', 'しない', 'です', 'ね', 'テクスチャ', '軽い', '崩れ']
+
+
+def _ts(seconds: float) -> str:
+    h, rem = divmod(seconds, 3600)
+    m, s = divmod(rem, 60)
+    return f"{int(h):02d}:{int(m):02d}:{s:06.3f}"
+
+
+def _lines(rng: random.Random, hours: float):
+    """(開始秒, 終了秒, 単語リスト) の字幕行を返す"""
+    t = 0.0
+    while t < hours * 3600:
+        words = [rng.choice(WORDS) for _ in range(rng.randint(3, 9))]
+        length = rng.uniform(1.5, 4.0)
+        yield t, t + length, words
+        t += length
+
+
+def synth_vtt(rng: random.Random, hours: float) -> bytes:
+    """YouTube の自動字幕と同じ形: 単語ごとのタイムスタンプ付きキューと、確定行を繰り返す 10ms のキュー"""
+    out = ["WEBVTT\nKind: captions\nLanguage: ja\n\n"]
+    previous = ''
+    for start, end, words in _lines(rng, hours):
+        step = (end - start) / len(words)
+        timed = words[0] + ''.join(
+            f"<{_ts(start + step * i)}><c>{w}</c>" for i, w in enumerate(words[1:], 1)
+        )
+        out.append(f"{_ts(start)} --> {_ts(end - 0.01)} align:start position:0%\n{previous}\n{timed}\n\n")
+        previous = ''.join(words)
+        out.append(f"{_ts(end - 0.01)} --> {_ts(end)} align:start position:0%\n{previous}\n \n\n")
+    return ''.join(out).encode('utf-8')
+
+
+def synth_srv3(rng: random.Random, hours: float) -> bytes:
+    out = ['<?xml version="1.0" encoding="utf-8" ?><timedtext format="3"><body>']
+    for start, end, words in _lines(rng, hours):
+        step = int((end - start) * 1000 / len(words))
+        segs = ''.join(f'<s t="{i * step}" ac="0">{escape(w)}</s>' for i, w in enumerate(words))
+        out.append(f'<p t="{int(start * 1000)}" d="{int((end - start) * 1000)}" w="1">{segs}</p>\n')
+    out.append('</body></timedtext>')
+    return ''.join(out).encode('utf-8')
+
+
+def synth_json3(rng: random.Random, hours: float) -> bytes:
+    events = []
+    for start, end, words in _lines(rng, hours):
+        step = int((end - start) * 1000 / len(words))
+        events.append({
+            'tStartMs': int(start * 1000), 'dDurationMs': int((end - start) * 1000), 'wWinId': 1,
+            'segs': [{'utf8': w, 'tOffsetMs': i * step, 'acAsrConf': 0} for i, w in enumerate(words)],
+        })
+        events.append({'tStartMs': int(end * 1000), 'wWinId': 1, 'aAppend': 1, 'segs': [{'utf8': '\n'}]})
+    return json.dumps({'wireMagic': 'pb3', 'events': events}, ensure_ascii=False).encode('utf-8')
+
+
+def legacy_parse_vtt(content: bytes):
+    """YouTubeService._get_transcript_manual の従来の解析（res.text 相当のデコードを含む）"""
+    content = content.decode('utf-8')
+    transcript_data = []
+    time_pattern = re.compile(r'(\d{2}:\d{2}:\d{2}\.\d{3}) --> (\d{2}:\d{2}:\d{2}\.\d{3})')
+    lines = content.splitlines()
+    for i, line in enumerate(lines):
+        match = time_pattern.search(line)
+        if match:
+            start_str = match.group(1)
+            end_str = match.group(2)
+
+            def parse_time(t_str):
+                h, m, s = t_str.split(':')
+                return float(h) * 3600 + float(m) * 60 + float(s)
+
+            current_start = parse_time(start_str)
+            current_duration = parse_time(end_str) - current_start
+            text_parts = []
+            j = i + 1
+            while j < len(lines):
+                next_line = lines[j].strip()
+                if not next_line:
+                    break
+                if time_pattern.search(next_line):
+                    break
+                clean_line = re.sub(r'<[^>]+>', '', next_line)
+                if clean_line:
+                    text_parts.append(clean_line)
+                j += 1
+            if text_parts:
+                transcript_data.append({'text': " ".join(text_parts), 'start': current_start, 'duration': current_duration})
+    return transcript_data
+
+
+def _chunks(content: bytes):
+    for i in range(0, len(content), CHUNK_BYTES):
+        yield content[i:i + CHUNK_BYTES]
+
+
+def streaming_parse(fmt: str):
+    return lambda content: list(iter_segments(_chunks(content), fmt=fmt))
+
+
+def _normalized(segments):
+    return [(s['text'], round(s['start'], 3), round(s['duration'], 3)) for s in segments]
+
+
+def _measure(fn, content: bytes, repeat: int):
+    """1回あたりの処理時間(ms)と、解析中に確保したメモリのピーク(MB)"""
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(content)
+    elapsed = (time.perf_counter() - t0) * 1000 / repeat
+
+    tracemalloc.start()
+    fn(content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024, result
+
+
+FORMATS = [
+    ("vtt", "auto_captions.ja.vtt", synth_vtt),
+    ("srv3", "auto_captions.ja.srv3", synth_srv3),
+    ("json3", "auto_captions.ja.json3", synth_json3),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="字幕ファイル解析のベンチマーク")
+    parser.add_argument("--hours", type=float, default=3.0, help="合成する字幕の長さ（時間）")
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"{'形式':<6} {'字幕':<6} {'サイズ(MB)':>10} {'件数':>7} {'従来(ms)':>10} {'従来メモリ(MB)':>15} "
+          f"{'ストリーミング(ms)':>18} {'メモリ(MB)':>11} {'倍率':>7} {'結果一致':>8}")
+    for fmt, fixture, synth in FORMATS:
+        path = os.path.join(FIXTURE_DIR, fixture)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                content = f.read()
+            source = "保存"
+        else:
+            content = synth(rng, args.hours)
+            source = "合成"
+
+        stream_ms, stream_mb, segments = _measure(streaming_parse(fmt), content, args.repeat)
+        if fmt == 'vtt':
+            legacy_ms, legacy_mb, legacy = _measure(legacy_parse_vtt, content, args.repeat)
+            same = 'OK' if _normalized(legacy) == _normalized(segments) else 'NG'
+            print(
+                f"{fmt:<6} {source:<6} {len(content) / 1024 / 1024:>10.1f} {len(segments):>7} {legacy_ms:>10.1f} "
+                f"{legacy_mb:>15.1f} {stream_ms:>18.1f} {stream_mb:>11.1f} {legacy_ms / stream_ms:>6.1f}x {same:>8}"
+            )
+        else:
+            print(
+                f"{fmt:<6} {source:<6} {len(content) / 1024 / 1024:>10.1f} {len(segments):>7} {'-':>10} "
+                f"{'-':>15} {stream_ms:>18.1f} {stream_mb:>11.1f} {'-':>7} {'-':>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+字幕密度判定の語数え（services/term_matcher.py）のベンチマーク。
+
+従来の「語ごとに full_text.count(term)」のループと、TermMatcher の
+  - 語ごとの str.find（語数が少ないとき用。位置も集める）
+  - Aho-Corasick オートマトン（1回の走査）
+を、語彙の大きさ（COSME_TERMS + 合成したブランド名）を変えながら比較し、結果が一致することを確認する。
+AUTOMATON_MIN_TERMS（自動で切り替える語数）はこの結果から決めている。
+時間枠ごとの密度（window_density）の計測も行う。
+
+字幕は自動字幕を正規化した程度の長さ・語彙密度の合成テキストを使う
+（つなぎの言葉の間に、語彙の語が約6%の割合で混ざる）。
+
+使い方:
+  python bench_term_matcher.py
+  python bench_term_matcher.py --sizes 55 500 5000 --minutes 120 --repeat 5
+"""
+import argparse
+import random
+import time
+
+from services.term_matcher import AUTOMATON_MIN_TERMS, TermMatcher
+from services.transcript import CompactTranscript
+
+# batch_processor.COSME_TERMS と同じ語彙（batch_processor を import すると DB に接続するため複製している）
+COSME_TERMS = [
+    '発色', 'テクスチャ', '保湿', '乾燥', 'イエベ', 'ブルベ',
+    '毛穴', 'カバー力', '崩れ', '色味', 'パケ', '円',
+    '塗る', '仕上がり', 'ツヤ', 'マット', '下地', 'ラメ',
+    'パウダー', 'リキッド', 'ファンデ', 'リップ', 'アイシャドウ',
+    'チーク', 'マスカラ', 'アイライナー', 'コンシーラー',
+    'プライマー', 'ハイライト', 'シェーディング', 'ベース',
+    'スキンケア', '化粧水', '乳液', '美容液', 'クレンジング',
+    '日焼け止め', 'SPF', 'UV', 'くすみ', 'トーンアップ',
+    'フィット', 'ヨレ', 'テカリ', 'サラサラ', 'しっとり',
+    'ナチュラル', '透明感', '血色', 'ツヤ肌', 'マット肌',
+    'プチプラ', 'デパコス', 'コスメ', 'メイク',
+]
+
+FILLER = [
+    '今日', 'は', 'この', 'を', '使って', 'みた', 'んです', 'けど', 'すごく', '良くて', 'も', 'あって',
+    'しない', 'です', 'ね', '軽い', 'それで', 'ちょっと', '本当に', '感じ', 'なんですけど', 'めっちゃ',
+    'ちゃんと', '肌', '色', '私', '的に', '好き', 'かな', 'って', '思います', 'みなさん', 'こんにちは',
+    '動画', '買った', '最近', 'から', 'で', 'が', 'に', 'と', 'お気に入り', '春', '新作', '紹介',
+]
+KANA = 'アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモヤユヨラリルレロワン'
+
+# 話す速さ（正規化後の字幕の文字数 / 分）
+CHARS_PER_MINUTE = 300
+
+
+def build_vocabulary(size: int, rng: random.Random) -> list:
+    """COSME_TERMS に合成したブランド名（カタカナ3〜7文字）を足して size 語にする"""
+    terms = list(COSME_TERMS)
+    seen = set(terms)
+    while len(terms) < size:
+        name = ''.join(rng.choice(KANA) for _ in range(rng.randint(3, 7)))
+        if name not in seen:
+            seen.add(name)
+            terms.append(name)
+    return terms
+
+
+def build_transcript(terms: list, minutes: float, rng: random.Random) -> CompactTranscript:
+    """10秒ごとの区間に分かれた合成字幕"""
+    segments = []
+    per_segment = CHARS_PER_MINUTE // 6
+    for i in range(int(minutes * 6)):
+        words, length = [], 0
+        while length < per_segment:
+            word = rng.choice(terms) if rng.random() < 0.06 else rng.choice(FILLER)
+            words.append(word)
+            length += len(word)
+        segments.append({'text': ''.join(words), 'start': i * 10.0, 'duration': 10.0})
+    return CompactTranscript.from_segments(segments)
+
+
+def legacy_count(text: str, terms: list) -> int:
+    """filter_by_transcript_density の従来の数え方"""
+    hit_count = 0
+    for term in terms:
+        hit_count += text.count(term)
+    return hit_count
+
+
+def _measure(fn, repeat: int):
+    """1回あたりの処理時間(ms)と結果"""
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - t0) * 1000 / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="字幕密度判定の語数えのベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[len(COSME_TERMS), 256, 500, 2000, 10000],
+                        help="語彙の大きさ")
+    parser.add_argument("--minutes", type=float, default=60, help="合成する字幕の長さ（分）")
+    parser.add_argument("--repeat", type=int, default=5, help="計測回数")
+    parser.add_argument("--window-seconds", type=float, default=300, help="window_density の時間枠（秒）")
+    args = parser.parse_args()
+
+    print(f"自動切り替えの語数: {AUTOMATON_MIN_TERMS} 語以上でオートマトン")
+    print(f"{'語数':>6} {'文字数':>8} {'出現数':>7} {'従来(ms)':>10} {'find(ms)':>10} {'AC(ms)':>9} "
+          f"{'AC構築(ms)':>11} {'自動/従来':>9} {'枠密度(ms)':>11} {'結果一致':>8}")
+    for size in args.sizes:
+        rng = random.Random(size)
+        terms = build_vocabulary(size, rng)
+        transcript = build_transcript(terms, args.minutes, rng)
+        text = transcript.text
+
+        scan = TermMatcher(terms, min_automaton_terms=len(terms) + 1)
+        build_ms, automaton = _measure(lambda: TermMatcher(terms, min_automaton_terms=0), 1)
+        auto = TermMatcher(terms)
+
+        legacy_ms, expected = _measure(lambda: legacy_count(text, terms), args.repeat)
+        scan_ms, scan_matches = _measure(lambda: scan.matches(text), args.repeat)
+        automaton_ms, automaton_matches = _measure(lambda: automaton.matches(text), args.repeat)
+        auto_ms, auto_count = _measure(lambda: auto.count(text), args.repeat)
+        window_ms, windows = _measure(lambda: auto.window_density(transcript, args.window_seconds), args.repeat)
+
+        same = (
+            len(scan_matches) == len(automaton_matches) == auto_count == expected
+            and sorted(scan_matches) == sorted(automaton_matches)
+            and sum(w.hits for w in windows) == expected
+        )
+        print(
+            f"{len(terms):>6} {len(text):>8} {expected:>7} {legacy_ms:>10.2f} {scan_ms:>10.2f} {automaton_ms:>9.2f} "
+            f"{build_ms:>11.1f} {legacy_ms / auto_ms:>8.1f}x {window_ms:>11.2f} {'OK' if same else 'NG':>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ import logging
 import subprocess
 from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled, NoTranscriptFound
 import google.generativeai as genai
+from services.gemini import get_response_cache
 
 import argparse
 
@@ -54,8 +55,13 @@ def analyze_video_with_gemini(video_url, model_name=MODEL_NAME, api_key=API_KEY)
     try:
         # ツール指定が API のバージョン不整合でエラーになるため、一旦ツールなしで実行する。
         # Gemini 2.5 Flash の学習データに含まれている可能性に期待する。
-        response = model.generate_content(prompt)
-        content = response.text.strip()
+        response_cache = get_response_cache()
+        content = response_cache.get(MODEL_NAME, prompt)
+        from_cache = content is not None
+        if not from_cache:
+            response = model.generate_content(prompt)
+            content = response.text.strip()
+        raw_content = content
         
         # JSON部分の抽出
         if "```json" in content:
@@ -64,6 +70,8 @@ def analyze_video_with_gemini(video_url, model_name=MODEL_NAME, api_key=API_KEY)
             content = content.split("```")[1].split("```")[0].strip()
             
         data = json.loads(content)
+        if not from_cache:
+            response_cache.put(MODEL_NAME, prompt, raw_content)
         return data
     except Exception as e:
         logger.error(f"Gemini 解析エラー: {e}")
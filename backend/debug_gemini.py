@@ -3,6 +3,7 @@ from dotenv import load_dotenv
 load_dotenv()
 from services.youtube import YouTubeService
 from services.gemini import GeminiService
+from services.transcript import CompactTranscript
 import logging
 import json
 
@@ -23,14 +24,10 @@ def debug_video(video_id: str):
     transcript = yt.get_transcript(video_id)
     if not transcript:
         logger.warning("No transcript found, using dummy.")
-        transcript = [{"start": 0, "text": "（字幕なし）"}]
+        transcript = CompactTranscript.from_text("（字幕なし）")
         
     logger.info(f"Analyzing with Gemini...")
-    transcript_text = ""
-    for item in transcript:
-        start = int(item['start'])
-        text = item['text']
-        transcript_text += f"[{start}s] {text}\n"
+    transcript_text = transcript.timestamped()
 
     # Raw prompt test
     prompt = f"""以下のYouTube動画から、紹介されているコスメ商品を正確に抽出してください。
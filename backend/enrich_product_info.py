@@ -6,18 +6,27 @@ Geminiのコスメ知識を活用して商品説明・特徴・成分・使い
 
 使い方:
   python enrich_product_info.py
+  python enrich_product_info.py --batch-size 20   # 20商品ずつ1リクエストで生成（既定 GEMINI_ENRICH_BATCH_SIZE）
+  python enrich_product_info.py --batch-size 1    # 従来どおり1商品ずつ生成
 """
 import sys
 sys.stdout.reconfigure(encoding='utf-8')
 
 import os
 import json
+import argparse
 import time
 import logging
 import requests
-from bs4 import BeautifulSoup
 from database import SessionLocal
 from models import Product
+from services.gemini import ENRICH_BATCH_SIZE, GeminiService, get_response_cache
+from services import gemini_usage
+from services.gemini_usage import UsageRecord, get_usage_ledger, usage_tokens
+from services.token_estimator import estimate_tokens
+from services.amazon import search_amazon
+from services.html_extract import select_first
+from services.scraper import get_scraper
 import google.generativeai as genai
 from dotenv import load_dotenv
 
@@ -48,44 +57,26 @@ def get_next_model():
 
 # 初回初期化
 model = get_next_model()
+# 同じ商品の再処理ではAPIを呼ばずに前回の回答を使う
+response_cache = get_response_cache()
+# API を呼んだ分は GeminiService と同じ使用量台帳に記録する
+usage_ledger = get_usage_ledger()
 
-HEADERS = {
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-    'Accept-Language': 'ja,en-US;q=0.9,en;q=0.8',
-}
+# @cosme へのリクエスト間隔は共有クライアントがドメインごとに調整する
+scraper = get_scraper()
 
 
 def fetch_amazon_url_and_price(product_name: str, brand: str = None) -> dict:
-    """Amazon検索結果からURLと価格だけ取得（軽量版）"""
+    """Amazon検索結果からURL・価格・画像を取得（取り込み時の検索結果があれば再取得しない）"""
     info = {}
-    try:
-        query = f"{brand} {product_name}" if brand else product_name
-        url = f"https://www.amazon.co.jp/s?k={requests.utils.quote(query)}"
-        resp = requests.get(url, headers=HEADERS, timeout=10)
-        if resp.status_code != 200:
-            return info
-        
-        soup = BeautifulSoup(resp.text, 'html.parser')
-        first = soup.select_one('[data-component-type="s-search-result"]')
-        if not first:
-            return info
-        
-        link = first.select_one('h2 a')
-        if link:
-            href = link.get('href', '')
-            info['amazon_url'] = ('https://www.amazon.co.jp' + href).split('/ref=')[0]
-        
-        price_el = first.select_one('.a-price .a-offscreen')
-        if price_el:
-            info['price'] = price_el.get_text(strip=True)
-            
-        # 商品画像の取得
-        img_el = first.select_one('img.s-image')
-        if img_el:
-            info['image_url'] = img_el.get('src')
-        
-    except Exception as e:
-        logger.warning(f"    Amazon検索エラー: {e}")
+    amazon = search_amazon(product_name, brand)
+    if amazon:
+        if amazon.url:
+            info['amazon_url'] = amazon.url
+        if amazon.price:
+            info['price'] = amazon.price
+        if amazon.image_url:
+            info['image_url'] = amazon.image_url
     return info
 
 
@@ -95,12 +86,15 @@ def fetch_cosme_url(product_name: str, brand: str = None) -> dict:
     try:
         query = f"{brand} {product_name}" if brand else product_name
         url = f"https://www.cosme.net/search/products?word={requests.utils.quote(query)}"
-        resp = requests.get(url, headers=HEADERS, timeout=10)
-        if resp.status_code != 200:
+        page = scraper.get_page(url)
+        if not page:
             return info
         
-        soup = BeautifulSoup(resp.text, 'html.parser')
-        link = soup.select_one('a[href*="/product/"]') or soup.select_one('a[href*="/products/"]')
+        # 最初の商品リンクの周辺だけを解析する
+        link = (
+            select_first(page.content, 'a[href*="/product/"]', [b'/product/'], page.encoding)
+            or select_first(page.content, 'a[href*="/products/"]', [b'/products/'], page.encoding)
+        )
         if link:
             href = link.get('href', '')
             if not href.startswith('http'):
@@ -112,6 +106,41 @@ def fetch_cosme_url(product_name: str, brand: str = None) -> dict:
     return info
 
 
+def details_to_info(data: dict) -> dict:
+    """Gemini の回答を Product の列に合わせた辞書にする（値のない項目は含めない）"""
+    info = {}
+    if data.get('description'):
+        info['description'] = data['description']
+    if data.get('features') and isinstance(data['features'], list):
+        info['features'] = json.dumps(data['features'], ensure_ascii=False)
+    if data.get('ingredients'):
+        info['ingredients'] = data['ingredients']
+    if data.get('volume'):
+        info['volume'] = data['volume']
+    if data.get('how_to_use'):
+        info['how_to_use'] = data['how_to_use']
+    if data.get('price'):
+        info['price'] = data['price']
+    return info
+
+
+def record_usage(prompt: str, response, started: float, retries: int):
+    """使用量台帳に1行記録する（response が None ならエラー）。記録の失敗で生成を止めない"""
+    try:
+        usage_ledger.record(UsageRecord(
+            model=GEMINI_MODEL,
+            key_index=(current_key_index - 1) % len(API_KEYS),
+            prompt_type=gemini_usage.PROMPT_ENRICHMENT,
+            estimated_tokens=estimate_tokens(prompt),
+            latency_ms=(time.perf_counter() - started) * 1000,
+            retries=retries,
+            status=gemini_usage.STATUS_OK if response is not None else gemini_usage.STATUS_ERROR,
+            **usage_tokens(response),
+        ))
+    except Exception as e:
+        logger.warning(f"Gemini 使用量の記録に失敗: {e}")
+
+
 def generate_product_details(product_name: str, brand: str = None, category: str = None) -> dict:
     """Gemini AIを使って商品の詳細情報を生成する"""
     global model
@@ -143,8 +172,19 @@ def generate_product_details(product_name: str, brand: str = None, category: str
 
     for attempt in range(len(API_KEYS) + 1):
         try:
-            response = model.generate_content(prompt)
-            text = response.text.strip()
+            text = response_cache.get(GEMINI_MODEL, prompt)
+            from_cache = text is not None
+            if not from_cache:
+                started = time.perf_counter()
+                try:
+                    response = model.generate_content(prompt)
+                except Exception:
+                    # 429 などで失敗した呼び出しも記録する（キーを切り替えた再試行は retries に残る）
+                    record_usage(prompt, None, started, attempt)
+                    raise
+                record_usage(prompt, response, started, attempt)
+                text = response.text.strip()
+            raw_text = text
             
             # JSON部分を抽出
             if '```json' in text:
@@ -153,21 +193,10 @@ def generate_product_details(product_name: str, brand: str = None, category: str
                 text = text.split('```')[1].split('```')[0].strip()
             
             data = json.loads(text)
+            if not from_cache:
+                response_cache.put(GEMINI_MODEL, prompt, raw_text)
             
-            if data.get('description'):
-                info['description'] = data['description']
-            if data.get('features') and isinstance(data['features'], list):
-                info['features'] = json.dumps(data['features'], ensure_ascii=False)
-            if data.get('ingredients'):
-                info['ingredients'] = data['ingredients']
-            if data.get('volume'):
-                info['volume'] = data['volume']
-            if data.get('how_to_use'):
-                info['how_to_use'] = data['how_to_use']
-            if data.get('price'):
-                info['price'] = data['price']
-            
-            return info # 成功
+            return details_to_info(data) # 成功
 
         except Exception as e:
             if "429" in str(e) or "quota" in str(e).lower():
@@ -182,73 +211,132 @@ def generate_product_details(product_name: str, brand: str = None, category: str
     return info
 
 
-def enrich_product(product: Product, db) -> int:
-    """1商品の情報を充実させる"""
-    updated = 0
-    
-    # 1. Gemini AIで商品詳細を生成
-    logger.info(f"  Gemini AI で商品情報を生成中...")
-    ai_info = generate_product_details(product.name, product.brand, product.category)
-    
-    # 2. Amazon URLと価格を取得（軽量検索のみ）
+def fetch_store_info(product: Product) -> dict:
+    """Amazon / @cosme のURL・価格を取得する（既に登録済みのものは取りに行かない）"""
+    info = {}
+
+    # Amazon URLと価格を取得（軽量検索のみ）
     if not product.amazon_url:
         logger.info(f"  Amazon URL を取得中...")
         amazon_info = fetch_amazon_url_and_price(product.name, product.brand)
-        ai_info.update({k: v for k, v in amazon_info.items() if v})
-        time.sleep(1)
-    
-    # 3. @cosme URLを取得
+        info.update({k: v for k, v in amazon_info.items() if v})
+
+    # @cosme URLを取得
     if not product.cosme_url:
         logger.info(f"  @cosme URL を取得中...")
         cosme_info = fetch_cosme_url(product.name, product.brand)
-        ai_info.update({k: v for k, v in cosme_info.items() if v})
-        time.sleep(1)
-    
-    # 情報を更新（既存の値は上書きしない）
-    for field, value in ai_info.items():
+        info.update({k: v for k, v in cosme_info.items() if v})
+
+    return info
+
+
+def apply_info(product: Product, info: dict) -> int:
+    """情報を反映する（既存の値は上書きしない）。更新した項目数を返す"""
+    updated = 0
+    for field, value in info.items():
         if value and (not getattr(product, field, None)):
             setattr(product, field, value)
             display_val = str(value)[:80]
             logger.info(f"    ✓ {field}: {display_val}{'...' if len(str(value)) > 80 else ''}")
             updated += 1
-    
+    return updated
+
+
+def enrich_product(product: Product, db) -> int:
+    """1商品の情報を充実させる"""
+    # 1. Gemini AIで商品詳細を生成
+    logger.info(f"  Gemini AI で商品情報を生成中...")
+    ai_info = generate_product_details(product.name, product.brand, product.category)
+
+    # 2. Amazon / @cosme のURLを取得
+    ai_info.update(fetch_store_info(product))
+
+    updated = apply_info(product, ai_info)
     if updated:
         db.commit()
     
     return updated
 
 
+def enrich_batch(products: list, db, gemini_service: GeminiService) -> int:
+    """
+    複数商品の詳細を1リクエストでまとめて生成し、1回のコミットで保存する。
+    回答が揃わなかった商品は詳細なしのまま（URL・価格だけ反映する）。
+    """
+    logger.info(f"  Gemini AI で {len(products)} 商品の情報を一括生成中...")
+    details = gemini_service.enrich_products([
+        {'product_id': p.id, 'name': p.name, 'brand': p.brand, 'category': p.category}
+        for p in products
+    ], batch_size=len(products))
+
+    total_updated = 0
+    for product in products:
+        logger.info(f"  {product.name} ({product.brand})")
+        info = details_to_info(details.get(product.id) or {})
+        info.update(fetch_store_info(product))
+        fields_updated = apply_info(product, info)
+        total_updated += fields_updated
+        logger.info(f"  → {fields_updated}項目更新" if fields_updated else f"  → 新しい情報なし")
+
+    if total_updated:
+        db.commit()
+    return total_updated
+
+
+def needs_enrichment(product: Product) -> bool:
+    # スキップ判定の強化: 
+    # 成分(ingredients)または使い方(how_to_use)が空、もしくは説明(description)が短すぎる場合は補完対象とする
+    is_missing_details = not (product.ingredients and product.how_to_use)
+    is_short_description = len(product.description or "") < 50
+    return is_missing_details or is_short_description or not product.amazon_url or not product.image_url
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Gemini AIで商品の詳細情報を充実させる")
+    parser.add_argument("--batch-size", type=int, default=ENRICH_BATCH_SIZE,
+                        help="1リクエストにまとめる商品数（1 で1商品ずつ生成）")
+    args = parser.parse_args()
+
     db = SessionLocal()
     products = db.query(Product).all()
     
     logger.info(f"対象商品: {len(products)}件\n")
     
-    total_updated = 0
-    for i, product in enumerate(products, 1):
-        logger.info(f"[{i}/{len(products)}] {product.name} ({product.brand})")
-        
-        # スキップ判定の強化: 
-        # 成分(ingredients)または使い方(how_to_use)が空、もしくは説明(description)が短すぎる場合は補完対象とする
-        is_missing_details = not (product.ingredients and product.how_to_use)
-        is_short_description = len(product.description or "") < 50
-        
-        if not is_missing_details and not is_short_description and product.amazon_url and product.image_url:
-            logger.info(f"  → スキップ（詳細は既に充実、画像あり）")
-            continue
-        
-        fields_updated = enrich_product(product, db)
-        total_updated += fields_updated
-        
-        if fields_updated == 0:
-            logger.info(f"  → 新しい情報なし")
+    targets = []
+    for product in products:
+        if needs_enrichment(product):
+            targets.append(product)
         else:
-            logger.info(f"  → {fields_updated}項目更新")
-        
-        time.sleep(5)  # Gemini APIレート制限（Free Tier: 20req/min等）を確実に回避するため長めに待機
+            logger.info(f"{product.name} ({product.brand}) → スキップ（詳細は既に充実、画像あり）")
+    logger.info(f"補完対象: {len(targets)}件")
+
+    total_updated = 0
+    if args.batch_size > 1:
+        # レート制限は GeminiService のキーごとのリミッターに任せる。
+        # モデル・キーは1商品ずつの生成と同じものを使う（GEMINI_MODEL_NAME 未設定なら gemini-2.5-flash）
+        gemini_service = GeminiService(api_keys=API_KEYS, response_cache=response_cache, model_name=GEMINI_MODEL)
+        for start in range(0, len(targets), args.batch_size):
+            batch = targets[start:start + args.batch_size]
+            logger.info(f"[{start + 1}-{start + len(batch)}/{len(targets)}]")
+            total_updated += enrich_batch(batch, db, gemini_service)
+    else:
+        for i, product in enumerate(targets, 1):
+            logger.info(f"[{i}/{len(targets)}] {product.name} ({product.brand})")
+
+            fields_updated = enrich_product(product, db)
+            total_updated += fields_updated
+
+            if fields_updated == 0:
+                logger.info(f"  → 新しい情報なし")
+            else:
+                logger.info(f"  → {fields_updated}項目更新")
+
+            time.sleep(5)  # Gemini APIレート制限（Free Tier: 20req/min等）を確実に回避するため長めに待機
     
     db.close()
+    cache_stats = response_cache.stats()
     logger.info(f"\n=== 完了: {total_updated}フィールドを更新 ===")
+    logger.info(f"Geminiキャッシュ: ヒット {cache_stats['hits']} / ミス {cache_stats['misses']}")
 
 
 if __name__ == "__main__":
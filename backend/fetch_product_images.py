@@ -3,109 +3,152 @@
 
 使い方:
   python fetch_product_images.py
+  python fetch_product_images.py --workers 8      # 8商品を同時に処理
+  python fetch_product_images.py --sequential     # ソースを1つずつ順に試す
 """
 import sys
 sys.stdout.reconfigure(encoding='utf-8')
 
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
-from bs4 import BeautifulSoup
 from database import SessionLocal
 from models import Product
-import time
+from services.amazon import search_amazon
+from services.html_extract import select_first
+from services.scraper import RequestCancelled, get_scraper
 import re
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 logger = logging.getLogger(__name__)
 
-HEADERS = {
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-    'Accept-Language': 'ja,en-US;q=0.9,en;q=0.8',
-}
+# 各サイトへのリクエスト間隔は共有クライアントがドメインごとに調整する
+scraper = get_scraper()
+
+# 画像のセレクタと、一致する要素（または祖先）に必ず含まれる目印
+COSME_IMAGE_SELECTOR = 'img.p-cosme-product-list__image, .product-image img'
+COSME_IMAGE_MARKERS = [b'p-cosme-product-list__image', b'product-image']
+# 商品一覧の画像がない構成のページ用（遅延読み込みの画像ならどれでも一致するので最後に試す）
+COSME_FALLBACK_IMAGE_SELECTOR = 'img[data-src]'
+COSME_FALLBACK_IMAGE_MARKERS = [b'data-src']
+RAKUTEN_IMAGE_SELECTOR = '.dui-card__imageContainer img, .searchresultitem img'
+RAKUTEN_IMAGE_MARKERS = [b'dui-card__imageContainer', b'searchresultitem']
+
+def find_cosme_image(content: bytes, encoding: str = None):
+    """@cosme の検索結果ページから先頭の商品画像の要素を探す（商品一覧の画像を優先する）"""
+    return (
+        select_first(content, COSME_IMAGE_SELECTOR, COSME_IMAGE_MARKERS, encoding)
+        or select_first(content, COSME_FALLBACK_IMAGE_SELECTOR, COSME_FALLBACK_IMAGE_MARKERS, encoding)
+    )
 
-def search_cosme_image(product_name: str, brand: str = None) -> str | None:
+
+def search_cosme_image(product_name: str, brand: str = None, cancel_event: threading.Event = None) -> str | None:
     """@cosmeで商品画像を検索"""
     try:
         query = f"{brand} {product_name}" if brand else product_name
         # @cosme検索
         url = f"https://www.cosme.net/search/products?word={requests.utils.quote(query)}"
-        resp = requests.get(url, headers=HEADERS, timeout=10)
-        if resp.status_code != 200:
+        page = scraper.get_page(url, cancel_event=cancel_event)
+        if not page:
             return None
         
-        soup = BeautifulSoup(resp.text, 'html.parser')
-        # 商品画像を探す
-        img = soup.select_one('img.p-cosme-product-list__image, img[data-src], .product-image img')
+        # 商品画像を探す（最初の候補の周辺だけを解析）
+        img = find_cosme_image(page.content, page.encoding)
         if img:
             src = img.get('data-src') or img.get('src')
             if src and src.startswith('http'):
                 return src
+    except RequestCancelled:
+        pass
     except Exception as e:
         logger.warning(f"@cosme検索エラー: {e}")
     return None
 
 
-def search_amazon_image(product_name: str, brand: str = None) -> str | None:
-    """Amazon Japanで商品画像を検索"""
-    try:
-        query = f"{brand} {product_name}" if brand else product_name
-        url = f"https://www.amazon.co.jp/s?k={requests.utils.quote(query)}"
-        resp = requests.get(url, headers=HEADERS, timeout=10)
-        if resp.status_code != 200:
-            return None
-        
-        soup = BeautifulSoup(resp.text, 'html.parser')
-        # Amazon検索結果の最初の商品画像
-        img = soup.select_one('img.s-image')
-        if img:
-            src = img.get('src')
-            if src and src.startswith('http'):
-                return src
-    except Exception as e:
-        logger.warning(f"Amazon検索エラー: {e}")
-    return None
+def search_amazon_image(product_name: str, brand: str = None, cancel_event: threading.Event = None) -> str | None:
+    """Amazon Japanで商品画像を検索（取り込み時・詳細補完時の検索結果を再利用）"""
+    amazon = search_amazon(product_name, brand, cancel_event)
+    return amazon.image_url if amazon else None
 
 
-def search_rakuten_image(product_name: str, brand: str = None) -> str | None:
+def search_rakuten_image(product_name: str, brand: str = None, cancel_event: threading.Event = None) -> str | None:
     """楽天市場で商品画像を検索"""
     try:
         query = f"{brand} {product_name}" if brand else product_name
         url = f"https://search.rakuten.co.jp/search/mall/{requests.utils.quote(query)}/"
-        resp = requests.get(url, headers=HEADERS, timeout=10)
-        if resp.status_code != 200:
+        page = scraper.get_page(url, cancel_event=cancel_event)
+        if not page:
             return None
         
-        soup = BeautifulSoup(resp.text, 'html.parser')
-        # 楽天の商品画像
-        img = soup.select_one('.dui-card__imageContainer img, .searchresultitem img')
+        # 楽天の商品画像（最初の検索結果の周辺だけを解析）
+        img = select_first(page.content, RAKUTEN_IMAGE_SELECTOR, RAKUTEN_IMAGE_MARKERS, page.encoding)
         if img:
             src = img.get('src') or img.get('data-src')
             if src and src.startswith('http'):
                 # 楽天の画像URLをクリーンアップ（リサイズパラメータ除去など）
                 return src
+    except RequestCancelled:
+        pass
     except Exception as e:
         logger.warning(f"楽天検索エラー: {e}")
     return None
 
 
-def fetch_product_image(product_name: str, brand: str = None) -> str | None:
-    """複数のソースから商品画像を探す"""
-    # @cosme → Amazon → 楽天 の順で試行
-    for searcher, name in [
-        (search_cosme_image, "@cosme"),
-        (search_amazon_image, "Amazon"),
-        (search_rakuten_image, "楽天"),
-    ]:
-        logger.info(f"  {name}で検索中...")
-        img_url = searcher(product_name, brand)
-        if img_url:
-            logger.info(f"  ✓ {name}で画像取得成功")
-            return img_url
-        time.sleep(1)  # レート制限対策
-    return None
+# 優先順（先にあるソースの画像を採用する）
+IMAGE_SOURCES = [
+    (search_cosme_image, "@cosme"),
+    (search_amazon_image, "Amazon"),
+    (search_rakuten_image, "楽天"),
+]
+
+
+def fetch_product_image(product_name: str, brand: str = None, hedged: bool = True) -> str | None:
+    """
+    複数のソースから商品画像を探す。
+
+    hedged=True: 全ソースに同時に問い合わせ、優先順で最初に見つかった画像を採用する。
+                 採用が決まった時点で、まだ送信していない低優先のリクエストは取り消す
+                 （送信済みのものは結果を待たずに捨てる）。
+    hedged=False: @cosme → Amazon → 楽天 の順に1つずつ試す。
+    """
+    if not hedged:
+        for searcher, name in IMAGE_SOURCES:
+            logger.info(f"  {name}で検索中...")
+            img_url = searcher(product_name, brand)
+            if img_url:
+                logger.info(f"  ✓ {name}で画像取得成功")
+                return img_url
+        return None
+
+    cancel_event = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=len(IMAGE_SOURCES))
+    try:
+        futures = [
+            (executor.submit(searcher, product_name, brand, cancel_event), name)
+            for searcher, name in IMAGE_SOURCES
+        ]
+        for future, name in futures:
+            img_url = future.result()
+            if img_url:
+                logger.info(f"  ✓ {name}で画像取得成功")
+                return img_url
+        return None
+    finally:
+        cancel_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
 
 
 def main():
+    parser = argparse.ArgumentParser(description="画像未設定の商品の画像を検索して保存する")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="同時に処理する商品数（サイトごとの間隔・同時接続数は共有クライアントが制限する）")
+    parser.add_argument("--sequential", action="store_true",
+                        help="ソースを同時に問い合わせず @cosme → Amazon → 楽天 の順に試す")
+    args = parser.parse_args()
+
     db = SessionLocal()
     
     # 画像が未設定の商品を取得
@@ -115,23 +158,33 @@ def main():
     
     logger.info(f"画像未設定の商品: {len(products)}件")
     
+    # 検索はワーカースレッドで並列に行い、DB への保存はメインスレッドで行う
     updated = 0
-    for i, product in enumerate(products, 1):
-        logger.info(f"\n[{i}/{len(products)}] {product.name} ({product.brand})")
-        
-        img_url = fetch_product_image(product.name, product.brand)
-        if img_url:
-            product.image_url = img_url
-            db.commit()
-            updated += 1
-            logger.info(f"  → 画像URL保存完了")
-        else:
-            logger.info(f"  → 画像が見つかりませんでした")
-        
-        time.sleep(2)  # サイト負荷軽減
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = {
+            executor.submit(fetch_product_image, product.name, product.brand, not args.sequential): product
+            for product in products
+        }
+        for i, future in enumerate(as_completed(futures), 1):
+            product = futures[future]
+            logger.info(f"\n[{i}/{len(products)}] {product.name} ({product.brand})")
+            try:
+                img_url = future.result()
+            except Exception as e:
+                logger.warning(f"  画像検索エラー: {e}")
+                continue
+            if img_url:
+                product.image_url = img_url
+                db.commit()
+                updated += 1
+                logger.info(f"  → 画像URL保存完了")
+            else:
+                logger.info(f"  → 画像が見つかりませんでした")
     
     db.close()
     logger.info(f"\n=== 完了: {updated}/{len(products)}件の画像を更新 ===")
+    for host, stat in scraper.stats().items():
+        logger.info(f"  {host}: {stat['requests']}リクエスト（間隔調整の待機 {stat['waited_seconds']}秒）")
 
 
 if __name__ == "__main__":
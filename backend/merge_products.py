@@ -2,7 +2,8 @@
 既存の重複商品を名寄せ（マージ）するワンショットスクリプト。
 
 処理内容:
-1. 全商品の名前を正規化してグループ化
+1. 保存済みの正規化名（normalized_name）でグループ化
+   ※ 事前に backfill_normalized_names.py で既存レコードを埋めておくこと
 2. 重複グループ内の最古のレコードを「正規」として残す
 3. 重複レコードの Review を正規レコードに移動
 4. 不要な重複レコードを削除
@@ -12,22 +13,28 @@ sys.stdout.reconfigure(encoding='utf-8')
 
 from database import SessionLocal
 from models import Product, Review
-from batch_processor import normalize_name
+from sqlalchemy import func
 from collections import defaultdict
 
 def merge_products():
     db = SessionLocal()
     
-    # 全商品を取得
-    all_products = db.query(Product).all()
-    print(f"全商品数: {len(all_products)}")
-    
+    # 正規化名（保存済みカラム）が重複しているものだけを取得
+    dup_names = [
+        row[0] for row in db.query(Product.normalized_name)
+        .filter(Product.normalized_name.isnot(None))
+        .group_by(Product.normalized_name)
+        .having(func.count(Product.id) > 1)
+    ]
+    total_products = db.query(Product).count()
+    print(f"全商品数: {total_products}")
+
     # 正規化名でグループ化
     groups = defaultdict(list)
-    for product in all_products:
-        normalized = normalize_name(product.name)
-        groups[normalized].append(product)
-    
+    if dup_names:
+        for product in db.query(Product).filter(Product.normalized_name.in_(dup_names)):
+            groups[product.normalized_name].append(product)
+
     # 重複グループを特定
     duplicates = {k: v for k, v in groups.items() if len(v) > 1}
     print(f"重複グループ数: {len(duplicates)}")
@@ -64,7 +71,7 @@ def merge_products():
     db.close()
     
     # 結果表示
-    remaining = db.query(Product).count() if False else len(all_products) - merged_count
+    remaining = total_products - merged_count
     print(f"\n=== マージ完了 ===")
     print(f"削除された重複: {merged_count}")
     print(f"残り商品数: {remaining}")
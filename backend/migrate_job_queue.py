@@ -0,0 +1,105 @@
+"""
+ジョブキュー（jobs テーブル）と products.enrichment_status を追加するワンショットスクリプト。
+
+処理内容:
+1. jobs テーブルが無ければ作成し、既存の jobs テーブルにはリース・再試行用のカラム
+   （available_at / locked_by / lease_expires_at / heartbeat_at）を ALTER TABLE で追加
+   未完了ジョブの部分ユニーク索引（ux_jobs_active_type_key）も作る。既に重複している
+   未完了ジョブは、最も古い1件を残して failed にしてから作成する
+2. products.enrichment_status が無ければ ALTER TABLE で追加（SQLite / Postgres 共通）
+3. --enqueue-missing 指定時は、画像のない商品に公式情報の解決ジョブを、
+   説明文のない商品に詳細生成ジョブを積む（積んだ分は work-queue で処理される）
+
+使い方:
+  python migrate_job_queue.py
+  python migrate_job_queue.py --enqueue-missing
+"""
+import sys
+sys.stdout.reconfigure(encoding='utf-8')
+
+import argparse
+from sqlalchemy import inspect, text
+from database import SessionLocal, engine
+from models import ACTIVE_JOB_CONDITION, Job, Product
+from services import job_queue
+
+CHUNK_SIZE = 1000
+
+# 後から追加した jobs のカラム（名前 → 型）
+JOB_LEASE_COLUMNS = {
+    'available_at': 'TIMESTAMP',
+    'locked_by': 'VARCHAR',
+    'lease_expires_at': 'TIMESTAMP',
+    'heartbeat_at': 'TIMESTAMP',
+}
+
+
+def ensure_schema():
+    """jobs テーブルと enrichment_status カラムが無ければ作成する"""
+    Job.__table__.create(bind=engine, checkfirst=True)
+
+    job_columns = {c['name'] for c in inspect(engine).get_columns('jobs')}
+    with engine.begin() as conn:
+        for name, sql_type in JOB_LEASE_COLUMNS.items():
+            if name not in job_columns:
+                print(f"カラム追加: jobs.{name}")
+                conn.execute(text(f"ALTER TABLE jobs ADD COLUMN {name} {sql_type}"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_jobs_status_lease ON jobs (status, lease_expires_at)"))
+        deduplicated = conn.execute(text(
+            f"UPDATE jobs SET status = '{job_queue.STATUS_FAILED}', last_error = '重複ジョブ（ユニーク索引の追加時に整理）', "
+            "locked_by = NULL, lease_expires_at = NULL "
+            f"WHERE {ACTIVE_JOB_CONDITION} AND id NOT IN "
+            f"(SELECT MIN(id) FROM jobs WHERE {ACTIVE_JOB_CONDITION} GROUP BY job_type, \"key\")"
+        )).rowcount
+        if deduplicated:
+            print(f"重複していた未完了ジョブ {deduplicated} 件を failed にしました")
+        conn.execute(text(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS ux_jobs_active_type_key ON jobs (job_type, \"key\") WHERE {ACTIVE_JOB_CONDITION}"
+        ))
+
+    existing = {c['name'] for c in inspect(engine).get_columns('products')}
+    with engine.begin() as conn:
+        if 'enrichment_status' not in existing:
+            print("カラム追加: products.enrichment_status")
+            conn.execute(text("ALTER TABLE products ADD COLUMN enrichment_status VARCHAR"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_products_enrichment_status ON products (enrichment_status)"))
+
+
+def enqueue_missing():
+    """既存の商品のうち、画像・説明文が欠けているものをキューに積む"""
+    db = SessionLocal()
+    try:
+        resolved = enriched = 0
+        last_id = None
+        while True:
+            # キーセットページングで CHUNK_SIZE 件ずつ処理
+            query = db.query(Product).order_by(Product.id)
+            if last_id is not None:
+                query = query.filter(Product.id > last_id)
+            products = query.limit(CHUNK_SIZE).all()
+            if not products:
+                break
+
+            for product in products:
+                if not product.image_url and job_queue.enqueue(db, job_queue.JOB_RESOLVE_PRODUCT, product.id):
+                    resolved += 1
+                if not product.description and job_queue.enqueue(db, job_queue.JOB_ENRICH_PRODUCT, product.id):
+                    product.enrichment_status = job_queue.STATUS_PENDING
+                    enriched += 1
+            db.commit()
+            last_id = products[-1].id
+
+        print(f"公式情報の解決ジョブ: {resolved}件、詳細生成ジョブ: {enriched}件を追加")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ジョブキューのテーブル・カラムを追加する")
+    parser.add_argument("--enqueue-missing", action="store_true",
+                        help="画像・説明文が欠けている既存商品のジョブを積む")
+    args = parser.parse_args()
+
+    ensure_schema()
+    if args.enqueue_missing:
+        enqueue_missing()
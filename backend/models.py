@@ -1,9 +1,10 @@
-from sqlalchemy import Column, String, Integer, Text, ForeignKey, DateTime, Float
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, String, Integer, Text, ForeignKey, DateTime, Float, Index, text
+from sqlalchemy.orm import relationship, validates
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
 import datetime
 from database import Base
+from services.product_matcher import normalize_name
 
 def generate_uuid():
     return str(uuid.uuid4())
@@ -14,6 +15,8 @@ class Product(Base):
     id = Column(String, primary_key=True, default=generate_uuid)
     name = Column(String, index=True)
     brand = Column(String, index=True)
+    normalized_name = Column(String, index=True)    # 名寄せ用の正規化商品名（name から自動設定）
+    normalized_brand = Column(String, index=True)   # 名寄せ用の正規化ブランド名（brand から自動設定）
     category = Column(String, index=True)
     image_url = Column(String)
     description = Column(Text, nullable=True)
@@ -25,10 +28,21 @@ class Product(Base):
     amazon_url = Column(String, nullable=True)      # Amazon商品ページURL
     cosme_url = Column(String, nullable=True)       # @cosme商品ページURL
     cosme_rating = Column(Float, nullable=True)     # @cosmeの評価スコア
+    enrichment_status = Column(String, index=True, nullable=True)  # 詳細生成の状態: pending / done / failed（None は対象外）
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
     reviews = relationship("Review", back_populates="product")
 
+    @validates('name')
+    def _sync_normalized_name(self, key, value):
+        self.normalized_name = normalize_name(value) if value else None
+        return value
+
+    @validates('brand')
+    def _sync_normalized_brand(self, key, value):
+        self.normalized_brand = normalize_name(value) if value else None
+        return value
+
 class Video(Base):
     __tablename__ = "videos"
 
@@ -53,3 +67,59 @@ class Review(Base):
 
     product = relationship("Product", back_populates="reviews")
     video = relationship("Video", back_populates="reviews")
+
+
+# 未完了のジョブの条件（部分ユニーク索引・job_queue.enqueue の ON CONFLICT・移行スクリプトで共通）
+ACTIVE_JOB_CONDITION = "status IN ('pending', 'running')"
+
+
+class Job(Base):
+    """
+    パイプラインの各段階のジョブキュー（字幕取得・AI分類・商品抽出・公式情報解決・詳細生成）。
+    ワーカー（work-queue コマンド）はリース付きでジョブを取り出し、処理中はハートビートで
+    リースを延長する。リースが切れたジョブは別のワーカーが取り直す。
+    """
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_type = Column(String, nullable=False)       # fetch_transcript / classify / extract / resolve_product / enrich_product
+    key = Column(String, nullable=False)            # 処理対象のID（動画ID・商品IDなど）
+    payload = Column(Text, nullable=True)           # 追加パラメータ（JSON文字列）
+    status = Column(String, nullable=False, default='pending')  # pending / running / done / failed
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    available_at = Column(DateTime, nullable=True, default=datetime.datetime.utcnow)  # これ以降に取り出せる（再試行の待ち）
+    locked_by = Column(String, nullable=True)       # 処理中のワーカーID
+    lease_expires_at = Column(DateTime, nullable=True)  # リースの期限（過ぎたら他のワーカーが取り直せる）
+    heartbeat_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_jobs_type_status', 'job_type', 'status', 'id'),
+        Index('ix_jobs_type_key', 'job_type', 'key'),
+        Index('ix_jobs_status_lease', 'status', 'lease_expires_at'),
+        # 未完了のジョブは同じ種類・同じ対象で1件だけ（job_queue.enqueue は ON CONFLICT DO NOTHING で積む）
+        Index(
+            'ux_jobs_active_type_key', 'job_type', 'key', unique=True,
+            sqlite_where=text(ACTIVE_JOB_CONDITION),
+            postgresql_where=text(ACTIVE_JOB_CONDITION),
+        ),
+    )
+
+
+class ChannelSyncState(Base):
+    """
+    チャンネルごとの同期状態（sync-channel コマンド）。
+    前回までに取り込んだ最新の動画を記録しておき、次回はそれより新しい動画だけを取得する。
+    """
+    __tablename__ = "channel_sync_states"
+
+    channel_id = Column(String, primary_key=True)           # UCxxxxxxx
+    channel_input = Column(String, nullable=True, index=True)  # 登録時に指定した URL / @ハンドル（ID 解決を省くため）
+    channel_name = Column(String, nullable=True)
+    uploads_playlist_id = Column(String, nullable=False)
+    newest_video_id = Column(String, nullable=True)         # 取り込み済みの最新動画
+    newest_published_at = Column(String, nullable=True)     # その公開日時（API の publishedAt をそのまま保存）
+    last_synced_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -0,0 +1,161 @@
+"""
+Amazon 検索結果の取得と永続キャッシュ。
+
+1商品につき Amazon の検索ページを1回だけ取得し、先頭の検索結果から
+商品URL・ASIN・価格・画像URLをまとめて取り出す。結果は正規化した検索語をキーに
+SQLite（backend/.cache/amazon_search.db）へ保存し、取り込み時（resolve_official_product_info）、
+詳細補完時（enrich_product_info）、画像取得時（fetch_product_images）の各段階で共有する。
+
+設定（環境変数）:
+  AMAZON_CACHE_TTL_HOURS       検索結果の有効期間（既定 168 = 7日）
+  AMAZON_CACHE_MISS_TTL_HOURS  「該当なし」を再検索するまでの時間（既定 24）
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import NamedTuple, Optional, Union
+from urllib.parse import quote
+
+from services.html_extract import select_first
+from services.product_matcher import normalize_name
+from services.scraper import RequestCancelled, get_scraper
+from services.sqlite_store import SqliteStore, cache_path
+
+logger = logging.getLogger(__name__)
+
+AMAZON_BASE_URL = "https://www.amazon.co.jp"
+AMAZON_CACHE_TTL_HOURS = float(os.getenv("AMAZON_CACHE_TTL_HOURS", "168"))
+AMAZON_CACHE_MISS_TTL_HOURS = float(os.getenv("AMAZON_CACHE_MISS_TTL_HOURS", "24"))
+
+
+class AmazonSearchResult(NamedTuple):
+    url: Optional[str]          # 商品ページURL（/ref= 以降は除去）
+    asin: Optional[str]
+    price: Optional[str]        # 表示価格（例: "￥1,650"）
+    image_url: Optional[str]
+
+
+def build_query(product_name: str, brand: str = None) -> str:
+    return f"{brand} {product_name}" if brand else product_name
+
+
+def parse_search_page(content: Union[bytes, str], encoding: str = None) -> Optional[AmazonSearchResult]:
+    """検索結果ページの先頭の商品から全項目を取り出す（結果がなければ None）"""
+    # 先頭の結果カードだけを切り出して解析する
+    first = select_first(content, '[data-component-type="s-search-result"]', [b's-search-result'], encoding)
+    if not first:
+        return None
+
+    asin = first.get('data-asin') or None
+
+    url = None
+    link = first.select_one('h2 a')
+    if link and link.get('href'):
+        url = (AMAZON_BASE_URL + link['href']).split('/ref=')[0]
+    elif asin:
+        url = f"{AMAZON_BASE_URL}/dp/{asin}"
+
+    price = None
+    price_el = first.select_one('.a-price .a-offscreen')
+    if price_el:
+        price = price_el.get_text(strip=True)
+
+    image_url = None
+    img_el = first.select_one('img.s-image')
+    if img_el:
+        src = img_el.get('src', '')
+        if src.startswith('http'):
+            image_url = src
+
+    return AmazonSearchResult(url, asin, price, image_url)
+
+
+class AmazonSearchCache(SqliteStore):
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS amazon_search (
+        query_key  TEXT PRIMARY KEY,  -- normalize_name(検索語)
+        query      TEXT NOT NULL,
+        result     TEXT,              -- JSON。NULL は検索結果なし
+        fetched_at REAL NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        ttl_hours: float = AMAZON_CACHE_TTL_HOURS,
+        miss_ttl_hours: float = AMAZON_CACHE_MISS_TTL_HOURS,
+    ):
+        super().__init__(path or cache_path("amazon_search.db"))
+        self.ttl_seconds = ttl_hours * 3600
+        self.miss_ttl_seconds = miss_ttl_hours * 3600
+
+    def get(self, query: str):
+        """
+        Returns:
+            (True, 結果 or None) … 有効なキャッシュあり（None は「該当なし」として記録済み）
+            (False, None)         … 未登録または期限切れ
+        """
+        rows = self.execute(
+            "SELECT result, expires_at FROM amazon_search WHERE query_key = ?",
+            (normalize_name(query),),
+        )
+        if not rows or rows[0][1] <= time.time():
+            return False, None
+        result_json = rows[0][0]
+        return True, AmazonSearchResult(**json.loads(result_json)) if result_json is not None else None
+
+    def put(self, query: str, result: Optional[AmazonSearchResult]):
+        now = time.time()
+        ttl = self.ttl_seconds if result is not None else self.miss_ttl_seconds
+        self.execute(
+            "INSERT OR REPLACE INTO amazon_search (query_key, query, result, fetched_at, expires_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (
+                normalize_name(query), query,
+                json.dumps(result._asdict(), ensure_ascii=False) if result is not None else None,
+                now, now + ttl,
+            ),
+        )
+
+
+_shared_cache: Optional[AmazonSearchCache] = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_amazon_cache() -> AmazonSearchCache:
+    """プロセス内で共有する AmazonSearchCache を返す"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = AmazonSearchCache()
+        return _shared_cache
+
+
+def search_amazon(product_name: str, brand: str = None, cancel_event: threading.Event = None) -> Optional[AmazonSearchResult]:
+    """
+    Amazon で商品を検索し、先頭の結果を返す（キャッシュがあれば取得しない）。
+    通信エラーや 200 以外の応答、送信前のキャンセルはキャッシュせず None を返す。
+    """
+    query = build_query(product_name, brand)
+    cache = get_amazon_cache()
+    found, cached = cache.get(query)
+    if found:
+        return cached
+
+    try:
+        page = get_scraper().get_page(f"{AMAZON_BASE_URL}/s?k={quote(query)}", cancel_event=cancel_event)
+    except RequestCancelled:
+        return None
+    except Exception as e:
+        logger.warning(f"Amazon検索エラー ({product_name}): {e}")
+        return None
+    if page is None:
+        return None
+
+    result = parse_search_page(page.content, page.encoding)
+    cache.put(query, result)
+    return result
@@ -1,16 +1,59 @@
 import google.generativeai as genai
+import google.ai.generativelanguage as glm
+import asyncio
 import os
 import json
 import logging
 import time
 import re
-from typing import List, Dict, Any, Optional
+import hashlib
+import threading
+from typing import Callable, List, Dict, Any, Optional, Tuple
+
+from services.rate_limiter import KeyRateLimiter, parse_retry_delay
+from services.sqlite_store import SqliteStore, cache_path
+from services.transcript import CompactTranscript
+from services import video_analysis
+from services import gemini_usage
+from services.gemini_usage import GeminiUsageLedger, UsageRecord, get_usage_ledger, usage_tokens
+from services.token_estimator import estimate_tokens, truncate_to_tokens
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-flash-latest")
 
+# キーごとのレート上限（無料枠の値に合わせて設定する）
+GEMINI_RPM_PER_KEY = float(os.getenv("GEMINI_RPM_PER_KEY", "10"))
+GEMINI_TPM_PER_KEY = float(os.getenv("GEMINI_TPM_PER_KEY", "250000"))
+# 非同期API（*_async）でキー1本あたりに同時に投げるリクエスト数
+GEMINI_CONCURRENCY_PER_KEY = int(os.getenv("GEMINI_CONCURRENCY_PER_KEY", "4"))
+
+# 商品詳細の一括生成で1リクエストにまとめる商品数と、欠けた商品を再要求する回数の上限
+ENRICH_BATCH_SIZE = int(os.getenv("GEMINI_ENRICH_BATCH_SIZE", "10"))
+ENRICH_BATCH_MAX_ATTEMPTS = int(os.getenv("GEMINI_ENRICH_BATCH_MAX_ATTEMPTS", "3"))
+
+# 商品詳細の項目と、値として許す型（null はどの項目でも可）
+ENRICHMENT_FIELDS = {
+    'description': str,
+    'features': list,
+    'ingredients': str,
+    'volume': str,
+    'how_to_use': str,
+    'price': str,
+}
+
+# プロンプトに入れる概要欄の推定トークン数の上限（商品リスト抽出用 / 字幕区間の抽出で商品リストがない場合）
+# 以前は同じ数の文字数で切っていた。見積もりは文字数を超えないので、それより短い概要欄のプロンプトは
+# 以前と同じ文字列になるが、長い概要欄は切る位置が変わるため、レスポンスキャッシュが一度外れる。
+ANALYSIS_DESCRIPTION_TOKENS = 5000
+WINDOW_DESCRIPTION_TOKENS = 2000
+
+# レスポンスキャッシュの最大件数（超えたら最終利用が古いものから削除）
+GEMINI_CACHE_MAX_ENTRIES = int(os.getenv("GEMINI_CACHE_MAX_ENTRIES", "50000"))
+# 1 にするとキャッシュを読まずに必ずAPIを呼ぶ（結果はキャッシュに上書き保存）
+GEMINI_CACHE_BYPASS = os.getenv("GEMINI_CACHE_BYPASS", "0") == "1"
+
 
 def _load_api_keys() -> List[str]:
     """
@@ -39,20 +82,446 @@ def _load_api_keys() -> List[str]:
 _API_KEYS = _load_api_keys()
 
 
+class GeminiResponseCache(SqliteStore):
+    """
+    Gemini のレスポンスを (モデル名, プロンプトのハッシュ) で保存する永続キャッシュ。
+
+    プロンプトは決定的に組み立てているため、同じ動画・商品を再処理したときは
+    API を呼ばずに前回の回答を返せる。保存先は backend/.cache/gemini_responses.db。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS responses (
+        model_name   TEXT NOT NULL,
+        prompt_hash  TEXT NOT NULL,
+        response     TEXT NOT NULL,
+        created_at   REAL NOT NULL,
+        last_used_at REAL NOT NULL,
+        PRIMARY KEY (model_name, prompt_hash)
+    );
+    CREATE INDEX IF NOT EXISTS ix_responses_last_used_at ON responses (last_used_at);
+    """
+
+    def __init__(self, path: str = None, max_entries: int = GEMINI_CACHE_MAX_ENTRIES, bypass: bool = GEMINI_CACHE_BYPASS):
+        super().__init__(path or cache_path("gemini_responses.db"))
+        self.max_entries = max_entries
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+
+    @staticmethod
+    def _hash(prompt: str) -> str:
+        return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+    def _count(self, hit: bool):
+        with self._counter_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, model_name: str, prompt: str) -> Optional[str]:
+        """キャッシュ済みのレスポンスを返す（なければ None）"""
+        if self.bypass:
+            self._count(False)
+            return None
+        prompt_hash = self._hash(prompt)
+        rows = self.execute(
+            "SELECT response FROM responses WHERE model_name = ? AND prompt_hash = ?",
+            (model_name, prompt_hash),
+        )
+        if not rows:
+            self._count(False)
+            return None
+        self.execute(
+            "UPDATE responses SET last_used_at = ? WHERE model_name = ? AND prompt_hash = ?",
+            (time.time(), model_name, prompt_hash),
+        )
+        self._count(True)
+        return rows[0][0]
+
+    def put(self, model_name: str, prompt: str, response: str):
+        """レスポンスを保存し、上限を超えていれば古いものから削除する"""
+        now = time.time()
+        self.execute(
+            "INSERT OR REPLACE INTO responses (model_name, prompt_hash, response, created_at, last_used_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (model_name, self._hash(prompt), response, now, now),
+        )
+        overflow = self.execute("SELECT COUNT(*) FROM responses")[0][0] - self.max_entries
+        if overflow > 0:
+            self.execute(
+                "DELETE FROM responses WHERE rowid IN "
+                "(SELECT rowid FROM responses ORDER BY last_used_at ASC LIMIT ?)",
+                (overflow,),
+            )
+
+    def invalidate(self, model_name: str, prompt: str):
+        """壊れた回答（JSON として解釈できない等）をキャッシュから外す"""
+        self.execute(
+            "DELETE FROM responses WHERE model_name = ? AND prompt_hash = ?",
+            (model_name, self._hash(prompt)),
+        )
+
+    def get_or_generate(self, model_name: str, prompt: str, generate: Callable[[], str]) -> str:
+        """キャッシュを引き、なければ generate() を呼んで結果を保存する"""
+        cached = self.get(model_name, prompt)
+        if cached is not None:
+            return cached
+        response = generate()
+        self.put(model_name, prompt, response)
+        return response
+
+    def stats(self) -> Dict[str, int]:
+        with self._counter_lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+_response_cache: Optional[GeminiResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> GeminiResponseCache:
+    """プロセス内で共有する GeminiResponseCache を返す"""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = GeminiResponseCache()
+        return _response_cache
+
+
+_rate_limiters: Dict[tuple, KeyRateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(api_keys: List[str]) -> KeyRateLimiter:
+    """同じキープールを使う GeminiService 同士で共有するレートリミッターを返す"""
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(tuple(api_keys))
+        if limiter is None:
+            limiter = KeyRateLimiter(len(api_keys), GEMINI_RPM_PER_KEY, GEMINI_TPM_PER_KEY)
+            _rate_limiters[tuple(api_keys)] = limiter
+        return limiter
+
+
+class VideoAnalysisError(Exception):
+    """analyze_video の Gemini 呼び出しが失敗した（商品が見つからなかったのとは別）"""
+
+
+def _raise_window_errors(errors: List[Exception], total: int):
+    if errors:
+        raise VideoAnalysisError(f"字幕区間 {len(errors)}/{total} 件の抽出に失敗: {errors[0]}") from errors[0]
+
+
+# キー専用のクライアントは、GenerativeModel の非公開属性 _client / _async_client に差し込んで持たせている。
+# google-generativeai（サポート終了済み）の内部実装に依存するので、動作を確認した 0.8.6 に固定している
+# （requirements.txt）。更新する場合は tests/test_gemini_clients.py で差し込みが効くことを確認すること。
+def _build_model(api_key: str, model_name: str = GEMINI_MODEL_NAME) -> genai.GenerativeModel:
+    """
+    キー専用のクライアントを持つモデルを作る。
+    genai.configure（プロセス全体の設定）を使わないので、複数キーを同時に使える。
+    """
+    model = genai.GenerativeModel(model_name)
+    model._client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+    return model
+
+
+def _build_async_model(api_key: str, model_name: str = GEMINI_MODEL_NAME) -> genai.GenerativeModel:
+    """キー専用の非同期クライアントを持つモデルを作る（generate_content_async 用）"""
+    model = genai.GenerativeModel(model_name)
+    model._async_client = glm.GenerativeServiceAsyncClient(client_options={"api_key": api_key})
+    return model
+
+
+def _build_analysis_prompt(description: str = "", title: str = "") -> str:
+    """
+    動画の概要欄から商品リストを抽出させるプロンプト（字幕は入れない）。
+    字幕での言及時刻・評価は区間ごとの抽出（_build_window_prompt）で求めて統合する。
+    """
+    return f"""あなたはプロのコスメレビュー分析AIです。
+以下のYouTube動画のタイトルと概要欄から、動画で紹介されているコスメ商品を**正確に**抽出してください。
+
+━━━━━━━━━━━━━━━━━━━
+【最重要ルール】
+━━━━━━━━━━━━━━━━━━━
+
+1. **概要欄に記載されている商品名は、その正式名称をそのまま使用すること。**
+   概要欄の商品名が最も信頼性が高い情報源です。
+
+2. **動画で紹介されている商品だけを抽出する。**
+   チャンネルの宣伝、撮影機材、過去動画のリンク、PR の定型文などに出てくる商品は含めない。
+   推測や不確かな商品名は絶対に出力しないこと。
+
+3. **商品名は短い正式名称のみ。** 宣伝文句や機能説明は含めない。
+   ✅ 良い例: 「エアリーチェンジリキッド」「UV イデア XL プロテクション トーンアップ」
+   ❌ 悪い例: 「エアリーチェンジリキッド 01 やや明るめの肌 サラサラ極軽肌 毛穴凹凸カバー テカリ防止...」
+   色番号までは含めてOK（例: 「エアリーチェンジリキッド 01」）
+
+━━━━━━━━━━━━━━━━━━━
+【動画タイトル】
+{title}
+
+【概要欄（商品リストが含まれている可能性が高い）】
+{truncate_to_tokens(description, ANALYSIS_DESCRIPTION_TOKENS) if description else "（概要欄なし）"}
+━━━━━━━━━━━━━━━━━━━
+
+【出力フォーマット】
+以下のJSON形式の配列のみを出力してください。Markdownのコードブロックは不要です。
+商品が見つからなければ [] を出力してください。
+
+[
+    {{
+        "product_name": "短い正式商品名（色番号まで。宣伝文句は不要）",
+        "brand_name": "ブランド名",
+        "category": "カテゴリ（ファンデーション、リップ、アイシャドウなど）",
+        "timestamp_seconds": 概要欄の目次（例: 「3:15 リップ」）にその商品があればその秒数、なければ 0（整数）,
+        "sentiment": "概要欄に評価が書かれていれば positive / negative、なければ neutral",
+        "summary": "概要欄に書かれている評価・特徴（50文字程度。なければ空文字）"
+    }}
+]"""
+
+
+def _build_window_prompt(title: str, products: Optional[str], description: str, transcript_text: str) -> str:
+    """字幕の1区間で言及されている商品を、タイムスタンプ・評価つきで抽出させるプロンプト"""
+    if products:
+        known = f"""【概要欄に記載された商品（名前はこの表記を使うこと）】
+{products}"""
+    else:
+        known = f"""【概要欄】
+{truncate_to_tokens(description, WINDOW_DESCRIPTION_TOKENS) if description else "（概要欄なし）"}"""
+
+    return f"""あなたはプロのコスメレビュー分析AIです。
+以下はYouTube動画の字幕の一部（タイムスタンプ付き）です。この区間で言及されているコスメ商品を抽出してください。
+
+【動画タイトル】
+{title}
+
+{known}
+
+【字幕（この区間のみ）】
+{transcript_text}
+
+【ルール】
+- 概要欄の商品に当たる言及は、概要欄の商品名・ブランド名をそのまま使うこと（字幕の音声認識ミスに注意）
+- 概要欄にない商品は、字幕で商品名とブランド名が明確に言及されている場合のみ抽出する
+- この区間で言及されていない商品は出力しない。該当がなければ [] を出力する
+
+【出力フォーマット】
+以下のJSON形式の配列のみを出力してください。Markdownのコードブロックは不要です。
+
+[
+    {{
+        "product_name": "短い正式商品名（色番号まで）",
+        "brand_name": "ブランド名",
+        "category": "カテゴリ",
+        "timestamp_seconds": この区間で最初に言及された秒数（字幕の [秒s] の値、整数）,
+        "sentiment": "positive" or "negative" or "neutral",
+        "summary": "どのような評価が語られているか（50文字程度）"
+    }}
+]"""
+
+
+def _build_classification_prompt(title: str, description: str, transcript_sample: str) -> str:
+    """「コスメレビュー/紹介か？」を Yes/No で答えさせるプロンプト"""
+    return f"""以下のYouTube動画は「コスメ（化粧品）のレビューまたは紹介動画」ですか？
+Yes か No のいずれか1単語のみで回答してください。
+
+【タイトル】
+{title}
+
+【概要欄（冒頭）】
+{description[:1000] if description else '（なし）'}
+
+【字幕（冒頭）】
+{transcript_sample[:1500]}
+"""
+
+
+def _build_enrichment_prompt(name: str, brand: str = None, category: str = None) -> str:
+    """商品の説明・特徴・成分などを生成させるプロンプト"""
+    return f"""以下のコスメ商品について、正確な情報を提供してください。
+
+商品名: {name}
+ブランド: {brand or '不明'}
+カテゴリ: {category or '不明'}
+
+以下のJSON形式で回答。確信がない情報は null にしてください。嘘は絶対に入れないこと。
+
+{{
+  "description": "商品の簡潔な説明文（100〜200文字程度）",
+  "features": ["特徴1", "特徴2", "特徴3"],
+  "ingredients": "主な成分（わかる場合のみ）",
+  "volume": "容量（例: 30ml, 12g）",
+  "how_to_use": "基本的な使い方（50〜100文字程度）"
+}}
+
+JSON以外の文字を含めないこと。"""
+
+
+def _build_enrichment_batch_prompt(products: List[Dict[str, Any]]) -> str:
+    """
+    複数商品の詳細をまとめて生成させるプロンプト。
+    products: [{'product_id', 'name', 'brand', 'category'}, ...]
+    """
+    blocks = []
+    for p in products:
+        blocks.append(f"""### product_id: {p['product_id']}
+商品名: {p['name']}
+ブランド: {p.get('brand') or '不明'}
+カテゴリ: {p.get('category') or '不明'}
+""")
+
+    return f"""あなたはコスメの専門家です。以下の {len(products)} 件のコスメ商品それぞれについて、正確な情報を提供してください。
+
+{chr(10).join(blocks)}
+【出力フォーマット】
+以下のJSON配列のみを出力してください。Markdownのコードブロックは不要です。
+全ての product_id について1件ずつ、product_id をそのまま書き写して回答すること。
+知らない情報や確信がない情報は null にしてください。嘘や推測の情報は絶対に入れないこと。
+日本語で回答すること。
+
+[
+    {{
+        "product_id": "上記の product_id",
+        "description": "商品の簡潔な説明文（100〜200文字程度）",
+        "features": ["特徴1", "特徴2", "特徴3"],
+        "ingredients": "主な成分（わかる場合のみ）",
+        "volume": "容量（例: 30ml, 12g）",
+        "how_to_use": "基本的な使い方（50〜100文字程度）",
+        "price": "定価（税込）※わかる場合のみ"
+    }}
+]"""
+
+
+def _validate_enrichment(entry: Any) -> Optional[Dict[str, Any]]:
+    """
+    商品詳細1件分の回答を検証する。
+    型の合わない項目が1つでもあれば None（その商品は再要求する）。
+    全項目 null は「情報なし」という正当な回答として扱う。
+    """
+    if not isinstance(entry, dict):
+        return None
+    details = {}
+    for field, expected in ENRICHMENT_FIELDS.items():
+        value = entry.get(field)
+        if value is None:
+            details[field] = None
+        elif not isinstance(value, expected):
+            return None
+        elif expected is list:
+            if not all(isinstance(v, str) for v in value):
+                return None
+            details[field] = value
+        else:
+            details[field] = value.strip() or None
+    return details
+
+
+def _collect_enrichment_batch(items: Any, requested: set) -> Dict[str, Dict[str, Any]]:
+    """一括生成の回答から、依頼した product_id の検証済みエントリだけを取り出す"""
+    collected = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        product_id = str(item.get('product_id'))
+        if product_id not in requested or product_id in collected:
+            continue
+        details = _validate_enrichment(item)
+        if details is not None:
+            collected[product_id] = details
+    return collected
+
+
+def _parse_json_response(text: str) -> Any:
+    """Markdown のコードブロックで囲まれていれば外して JSON として解釈する"""
+    if '```json' in text:
+        text = text.split('```json')[1].split('```')[0]
+    elif '```' in text:
+        text = text.split('```')[1].split('```')[0]
+    return json.loads(text.strip())
+
+
+def _is_yes(answer: str) -> bool:
+    answer = answer.lower()
+    return answer.startswith('yes') or 'yes' in answer
+
+
+class _AsyncKeyPool:
+    """
+    非同期API用のキープール（イベントループごとに1つ作る）。
+
+    キーごとに独立した非同期クライアントを持ち、同時実行数を concurrency_per_key 本に制限する。
+    RPM / TPM は同期版と共有の KeyRateLimiter で管理するため、
+    スレッド版と非同期版を同時に使ってもキーごとの上限は守られる。
+    """
+
+    def __init__(self, api_keys: List[str], rate_limiter: KeyRateLimiter, concurrency_per_key: int, model_name: str):
+        self.loop = asyncio.get_running_loop()
+        self.api_keys = api_keys
+        self.model_name = model_name
+        self.rate_limiter = rate_limiter
+        self.concurrency_per_key = max(1, concurrency_per_key)
+        self._models: Dict[int, genai.GenerativeModel] = {}
+        self._in_flight = [0] * len(api_keys)
+        self._cond = asyncio.Condition()
+
+    def model_for(self, index: int) -> genai.GenerativeModel:
+        model = self._models.get(index)
+        if model is None:
+            model = _build_async_model(self.api_keys[index], self.model_name)
+            self._models[index] = model
+        return model
+
+    async def acquire(self, estimated_tokens: float) -> int:
+        """
+        同時実行枠とレート上限の両方に空きのあるキーを確保する。
+        空きがなければ、枠の返却か最も早く空くキーの空き時刻まで待つ。
+        """
+        async with self._cond:
+            while True:
+                busy = {i for i, n in enumerate(self._in_flight) if n >= self.concurrency_per_key}
+                index, wait = self.rate_limiter.try_acquire(estimated_tokens, exclude=busy)
+                if index is not None:
+                    self._in_flight[index] += 1
+                    return index
+                try:
+                    await asyncio.wait_for(self._cond.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, index: int):
+        async with self._cond:
+            self._in_flight[index] -= 1
+            self._cond.notify_all()
+
+
 class GeminiService:
     """
     複数APIキーのローテーション対応 GeminiService.
     
-    429レート制限エラー時、待機せずに次のキーに即座に切り替えてリトライする。
-    全キーが使い切られた場合のみ待機する。
+    キーごとの RPM / TPM をレートリミッターで事前に追跡し、空きのあるキーで送信する。
+    429 を受けたキーは推奨待機時間（なければ1分）だけ払い出し対象から外す。
+    全キーが埋まっている場合は、最も早く空くキーの空き時刻までだけ待機する。
+
+    *_async メソッドは asyncio から使う非同期版。キーごとに独立したクライアントを持ち、
+    キー1本あたり concurrency_per_key 本まで同時に投げる（レート上限は同期版と共有）。
     """
     
-    # クラス変数: 全インスタンスで共有するキーのインデックス
-    _current_key_index = 0
-    _exhausted_keys = set()  # レート制限に引っかかったキーのインデックス
-    
-    def __init__(self, api_keys: List[str] = None):
+    def __init__(
+        self,
+        api_keys: List[str] = None,
+        response_cache: GeminiResponseCache = None,
+        concurrency_per_key: int = None,
+        usage_ledger: GeminiUsageLedger = None,
+        model_name: str = None,
+    ):
         self.api_keys = api_keys or _API_KEYS
+        self.model_name = model_name or GEMINI_MODEL_NAME
+        self.response_cache = response_cache or get_response_cache()
+        self.usage_ledger = usage_ledger or get_usage_ledger()
+        self.concurrency_per_key = concurrency_per_key or GEMINI_CONCURRENCY_PER_KEY
+        self._async_pool: Optional[_AsyncKeyPool] = None
         if not self.api_keys:
             logger.warning("APIキーが設定されていません。AI機能は動作しません。")
             self.model = None
@@ -62,152 +531,347 @@ class GeminiService:
         for i, key in enumerate(self.api_keys):
             logger.info(f"  キー{i+1}: ...{key[-6:]}")
         
-        # 最初のキーで初期化
-        self._switch_to_key(GeminiService._current_key_index % len(self.api_keys))
+        self.rate_limiter = get_rate_limiter(self.api_keys)
+        self._models: Dict[int, genai.GenerativeModel] = {}
+        self._models_lock = threading.Lock()
+        self.model = self._model_for(0)
     
-    def _switch_to_key(self, index: int):
-        """指定インデックスのキーに切り替え"""
-        key = self.api_keys[index]
-        genai.configure(api_key=key)
-        self.model = genai.GenerativeModel(GEMINI_MODEL_NAME)
-        GeminiService._current_key_index = index
-        logger.info(f"  🔑 キー{index+1}に切替 (...{key[-6:]})")
+    def _model_for(self, index: int) -> genai.GenerativeModel:
+        """キーごとのモデル（初回のみ作成）"""
+        with self._models_lock:
+            model = self._models.get(index)
+            if model is None:
+                model = _build_model(self.api_keys[index], self.model_name)
+                self._models[index] = model
+            return model
     
-    def _next_key(self) -> bool:
+    def _generate_with_retry(self, prompt: str, prompt_type: str = gemini_usage.PROMPT_OTHER) -> str:
         """
-        次のキーに切り替える。
-        全キーが使い切られた場合は False を返す。
-        """
-        GeminiService._exhausted_keys.add(GeminiService._current_key_index)
-        
-        # 未使用のキーを探す
-        for i in range(len(self.api_keys)):
-            next_idx = (GeminiService._current_key_index + 1 + i) % len(self.api_keys)
-            if next_idx not in GeminiService._exhausted_keys:
-                self._switch_to_key(next_idx)
-                return True
-        
-        return False
-    
-    def _generate_with_retry(self, prompt: str) -> str:
-        """
-        APIコールをキーローテーション付きでリトライする。
-        429エラー → 次のキーに即切替（待機なし）
-        全キー使い切り → 60秒待機してリセット
+        レートリミッターから空きのあるキーを受け取って APIコールする。
+        429エラー → そのキーを一定時間外し、別のキー（または空き待ち）でリトライ
+        呼び出しごとに使用量台帳へ記録する。
         """
         attempts = 0
         max_attempts = len(self.api_keys) * 2  # 全キー x 2周
+        estimated_tokens = estimate_tokens(prompt)
         
         while attempts < max_attempts:
+            key_index = self.rate_limiter.acquire(estimated_tokens)
+            started = time.perf_counter()
             try:
-                # 成功: 使い切りリストから現在のキーを除外
-                response = self.model.generate_content(prompt)
-                GeminiService._exhausted_keys.discard(GeminiService._current_key_index)
-                return response.text.strip()
+                response = self._model_for(key_index).generate_content(prompt)
             except Exception as e:
                 error_str = str(e)
-                logger.warning(f"  ⚠️ Gemini API エラー: {error_str}")
+                logger.warning(f"  ⚠️ Gemini API エラー (キー{key_index+1}): {error_str}")
                 if '429' in error_str:
                     attempts += 1
-                    # 429エラー時は待機時間を増やす
-                    wait_time = 15 * attempts
-                    logger.info(f"  ⏳ 429レート制限。{wait_time}秒待機してリトライします (試行 {attempts})")
-                    time.sleep(wait_time)
-                    
-                    has_next = self._next_key()
-                    if not has_next:
-                        # 全キー使い切り → 60秒待機してリセット
-                        logger.warning(f"全 {len(self.api_keys)} 個のキーがレート制限中。60秒待機してリセット...")
-                        time.sleep(60)
-                        GeminiService._exhausted_keys.clear()
-                        self._switch_to_key(0)
+                    retry_after = parse_retry_delay(error_str)
+                    logger.info(f"  ⏳ 429レート制限。キー{key_index+1}を{retry_after or self.rate_limiter.cooldown_seconds:.0f}秒休止してリトライします (試行 {attempts})")
+                    self.rate_limiter.penalize(key_index, retry_after)
                     continue
-                else:
-                    raise e
+                self._record_usage(key_index, prompt_type, estimated_tokens, None, started, attempts)
+                raise e
+
+            return self._finish_response(response, key_index, prompt_type, estimated_tokens, started, attempts)
         
+        self._record_usage(key_index, prompt_type, estimated_tokens, None, started, attempts)
         raise Exception(f"全キーで {max_attempts} 回リトライしましたが成功しませんでした")
 
-    def analyze_video(self, transcript: List[Dict[str, Any]], description: str = "", title: str = "") -> List[Dict[str, Any]]:
+    def _finish_response(self, response, key_index: int, prompt_type: str, estimated_tokens: int, started: float, retries: int) -> str:
+        """実際の消費量をレートリミッターと使用量台帳に反映して本文を返す"""
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is not None and getattr(usage, 'total_token_count', None):
+            self.rate_limiter.record_usage(key_index, usage.total_token_count, estimated_tokens)
+        self._record_usage(key_index, prompt_type, estimated_tokens, response, started, retries)
+        return response.text.strip()
+
+    def _record_usage(self, key_index: int, prompt_type: str, estimated_tokens: int, response, started: float, retries: int):
+        """使用量台帳に1行記録する（response が None ならエラー）。記録の失敗で生成を止めない"""
+        try:
+            self.usage_ledger.record(UsageRecord(
+                model=self.model_name,
+                key_index=key_index,
+                prompt_type=prompt_type,
+                estimated_tokens=estimated_tokens,
+                latency_ms=(time.perf_counter() - started) * 1000,
+                retries=retries,
+                status=gemini_usage.STATUS_OK if response is not None else gemini_usage.STATUS_ERROR,
+                **usage_tokens(response),
+            ))
+        except Exception as e:
+            logger.warning(f"Gemini 使用量の記録に失敗: {e}")
+
+    def _get_async_pool(self) -> _AsyncKeyPool:
+        """実行中のイベントループ用のキープール（ループが変わったら作り直す）"""
+        loop = asyncio.get_running_loop()
+        if self._async_pool is None or self._async_pool.loop is not loop:
+            self._async_pool = _AsyncKeyPool(self.api_keys, self.rate_limiter, self.concurrency_per_key, self.model_name)
+        return self._async_pool
+
+    async def _generate_with_retry_async(self, prompt: str, prompt_type: str = gemini_usage.PROMPT_OTHER) -> str:
+        """_generate_with_retry の非同期版"""
+        pool = self._get_async_pool()
+        attempts = 0
+        max_attempts = len(self.api_keys) * 2
+        estimated_tokens = estimate_tokens(prompt)
+
+        while attempts < max_attempts:
+            key_index = await pool.acquire(estimated_tokens)
+            started = time.perf_counter()
+            try:
+                response = await pool.model_for(key_index).generate_content_async(prompt)
+            except Exception as e:
+                error_str = str(e)
+                logger.warning(f"  ⚠️ Gemini API エラー (キー{key_index+1}): {error_str}")
+                if '429' in error_str:
+                    attempts += 1
+                    retry_after = parse_retry_delay(error_str)
+                    logger.info(f"  ⏳ 429レート制限。キー{key_index+1}を{retry_after or self.rate_limiter.cooldown_seconds:.0f}秒休止してリトライします (試行 {attempts})")
+                    self.rate_limiter.penalize(key_index, retry_after)
+                    continue
+                self._record_usage(key_index, prompt_type, estimated_tokens, None, started, attempts)
+                raise e
+            finally:
+                await pool.release(key_index)
+
+            return self._finish_response(response, key_index, prompt_type, estimated_tokens, started, attempts)
+
+        self._record_usage(key_index, prompt_type, estimated_tokens, None, started, attempts)
+        raise Exception(f"全キーで {max_attempts} 回リトライしましたが成功しませんでした")
+
+    def key_utilization(self) -> List[Dict[str, float]]:
+        """キーごとの現在の RPM/TPM 使用率（キー本数のチューニング用）"""
+        return self.rate_limiter.utilization() if self.api_keys else []
+
+    def generate(self, prompt: str, prompt_type: str = gemini_usage.PROMPT_OTHER) -> str:
+        """
+        プロンプトを送信してテキストを返す。全ての生成呼び出しはここを通す。
+        同じ (モデル, プロンプト) の回答はレスポンスキャッシュから返す。
+        prompt_type は使用量台帳での集計単位（gemini_usage.PROMPT_*）。
+        """
+        return self.response_cache.get_or_generate(
+            self.model_name, prompt, lambda: self._generate_with_retry(prompt, prompt_type)
+        )
+
+    async def generate_async(self, prompt: str, prompt_type: str = gemini_usage.PROMPT_OTHER) -> str:
+        """generate の非同期版（レスポンスキャッシュも共有する）"""
+        cached = self.response_cache.get(self.model_name, prompt)
+        if cached is not None:
+            return cached
+        response = await self._generate_with_retry_async(prompt, prompt_type)
+        self.response_cache.put(self.model_name, prompt, response)
+        return response
+
+    def _generate_json(self, prompt: str, prompt_type: str = gemini_usage.PROMPT_OTHER) -> Any:
+        """JSON で回答させる。解釈できなければキャッシュから外して例外を投げる"""
+        try:
+            return _parse_json_response(self.generate(prompt, prompt_type))
+        except json.JSONDecodeError:
+            self.invalidate_cached(prompt)
+            raise
+
+    async def _generate_json_async(self, prompt: str, prompt_type: str = gemini_usage.PROMPT_OTHER) -> Any:
+        try:
+            return _parse_json_response(await self.generate_async(prompt, prompt_type))
+        except json.JSONDecodeError:
+            self.invalidate_cached(prompt)
+            raise
+
+    def invalidate_cached(self, prompt: str):
+        """解析できなかった回答をキャッシュから外す（次回は再生成させる）"""
+        self.response_cache.invalidate(self.model_name, prompt)
+
+    def cache_stats(self) -> Dict[str, int]:
+        return self.response_cache.stats()
+
+    def analyze_video(self, transcript: Optional[CompactTranscript], description: str = "", title: str = "") -> List[Dict[str, Any]]:
         """
         動画の概要欄 + 字幕から商品レビューを正確に抽出する。
+        概要欄から商品リストを作り、字幕はトークン予算ごとの区間に分けて区間ごとに抽出してから統合する
+        （services/video_analysis.py。1動画あたりの区間数・トークン数には上限がある）。
+
+        Gemini の呼び出しが1回でも失敗したら VideoAnalysisError を投げる（商品なしの [] と区別する）。
+        成功した呼び出しの回答はレスポンスキャッシュに残るので、再試行では失敗した分だけが API を呼ぶ。
         """
         if not transcript and not description:
             return []
 
-        # 字幕テキスト（タイムスタンプ付き）
-        # レート制限回避のため、字幕解析を完全にスキップする（最終手段）
-        transcript_text = "（字幕解析スキップ）"
+        base = []
+        if description:
+            try:
+                base = self._generate_json(_build_analysis_prompt(description, title), gemini_usage.PROMPT_ANALYSIS)
+            except Exception as e:
+                logger.error(f"Error analyzing video with Gemini: {e}")
+                raise VideoAnalysisError(f"概要欄の解析に失敗: {e}") from e
 
-        prompt = f"""あなたはプロのコスメレビュー分析AIです。
-以下のYouTube動画から、紹介されているコスメ商品を**正確に**抽出してください。
+        windows, prompts = self._plan_analysis(transcript, base, description, title)
+        window_results, errors = [], []
+        for prompt in prompts:
+            try:
+                window_results.append(self._generate_json(prompt, gemini_usage.PROMPT_ANALYSIS_WINDOW))
+            except Exception as e:
+                logger.warning(f"字幕区間の抽出エラー: {e}")
+                errors.append(e)
+        _raise_window_errors(errors, len(prompts))
+        return self._finish_analysis(base, transcript, windows, window_results)
 
-━━━━━━━━━━━━━━━━━━━
-【最重要ルール】
-━━━━━━━━━━━━━━━━━━━
+    async def analyze_video_async(self, transcript: Optional[CompactTranscript], description: str = "", title: str = "") -> List[Dict[str, Any]]:
+        """analyze_video の非同期版（区間同士は同時に投げる）"""
+        if not transcript and not description:
+            return []
 
-1. **概要欄に商品名が記載されている場合、必ずその正式名称をそのまま使用すること。**
-   概要欄の商品名が最も信頼性が高い情報源です。
+        base = []
+        if description:
+            try:
+                base = await self._generate_json_async(_build_analysis_prompt(description, title), gemini_usage.PROMPT_ANALYSIS)
+            except Exception as e:
+                logger.error(f"Error analyzing video with Gemini: {e}")
+                raise VideoAnalysisError(f"概要欄の解析に失敗: {e}") from e
 
-2. **字幕の音声認識ミスに注意。** 自動生成字幕はブランド名を誤認識しやすい。
-   例: 「ルナソル」→「ルナ粗」、「セザンヌ」→「せざぬ」など
+        windows, prompts = self._plan_analysis(transcript, base, description, title)
+        window_results = await asyncio.gather(
+            *(self._generate_json_async(prompt, gemini_usage.PROMPT_ANALYSIS_WINDOW) for prompt in prompts),
+            return_exceptions=True,
+        )
+        errors = [result for result in window_results if isinstance(result, Exception)]
+        for error in errors:
+            logger.warning(f"字幕区間の抽出エラー: {error}")
+        _raise_window_errors(errors, len(prompts))
+        return self._finish_analysis(base, transcript, windows, window_results)
 
-3. **概要欄に記載がない商品は、字幕から確信度が非常に高い場合のみ抽出する。**
-   推測や不確かな商品名は絶対に出力しないこと。
+    def _plan_analysis(
+        self, transcript: Optional[CompactTranscript], base: Any, description: str, title: str
+    ) -> Tuple[List[video_analysis.AnalysisWindow], List[str]]:
+        """字幕を区間に分け、上限内で送る区間とそのプロンプトを返す"""
+        if not transcript or video_analysis.ANALYSIS_MODE != 'chunked':
+            return [], []
+        products = video_analysis.describe_products(base if isinstance(base, list) else [])
+        hints = video_analysis.mention_hints(base if isinstance(base, list) else [])
+        windows = video_analysis.plan_windows(transcript, hints)
+        overhead = estimate_tokens(_build_window_prompt(title, products, description, ""))
+        windows = video_analysis.select_windows(windows, overhead)
+        prompts = [
+            _build_window_prompt(title, products, description, video_analysis.window_text(transcript, w))
+            for w in windows
+        ]
+        if windows:
+            logger.info(
+                f"  字幕を {len(windows)} 区間に分けて抽出 "
+                f"(推定 {sum(w.tokens for w in windows) + overhead * len(windows)} トークン)"
+            )
+        return windows, prompts
 
-4. **商品名は短い正式名称のみ。** 宣伝文句や機能説明は含めない。
-   ✅ 良い例: 「エアリーチェンジリキッド」「UV イデア XL プロテクション トーンアップ」
-   ❌ 悪い例: 「エアリーチェンジリキッド 01 やや明るめの肌 サラサラ極軽肌 毛穴凹凸カバー テカリ防止...」
-   色番号までは含めてOK（例: 「エアリーチェンジリキッド 01」）
+    def _finish_analysis(self, base: Any, transcript: Optional[CompactTranscript], windows, window_results) -> List[Dict[str, Any]]:
+        if windows:
+            results = video_analysis.merge_window_results(base, transcript, windows, window_results)
+        else:
+            # 字幕を解析しない場合は概要欄の結果をそのまま返す（従来どおり）
+            results = base if isinstance(base, list) else []
+        logger.info(f"Geminiから {len(results)} 件の商品を抽出")
+        return results
 
-━━━━━━━━━━━━━━━━━━━
-【動画タイトル】
-{title}
+    def classify_video(self, title: str, description: str, transcript_sample: str) -> bool:
+        """
+        「コスメレビュー/紹介動画か？」を Yes/No 判定する。
+        API エラーは呼び出し側で扱えるようにそのまま投げる。
+        """
+        return _is_yes(self.generate(
+            _build_classification_prompt(title, description, transcript_sample), gemini_usage.PROMPT_CLASSIFICATION
+        ))
 
-【概要欄（商品リストが含まれている可能性が高い）】
-{description[:5000] if description else "（概要欄なし）"}
+    async def classify_async(self, title: str, description: str, transcript_sample: str) -> bool:
+        """classify_video の非同期版"""
+        return _is_yes(await self.generate_async(
+            _build_classification_prompt(title, description, transcript_sample), gemini_usage.PROMPT_CLASSIFICATION
+        ))
 
-【字幕データ（タイムスタンプ付き）】
-{transcript_text[:25000]}
-━━━━━━━━━━━━━━━━━━━
+    def enrich_product(self, name: str, brand: str = None, category: str = None) -> Dict[str, Any]:
+        """
+        商品の説明・特徴・成分・容量・使い方を生成する。
+        確信のない項目は null で返る。JSON として解釈できなければ例外を投げる。
+        """
+        return self._generate_json(_build_enrichment_prompt(name, brand, category), gemini_usage.PROMPT_ENRICHMENT)
 
-【出力フォーマット】
-以下のJSON形式の配列のみを出力してください。Markdownのコードブロックは不要です。
+    async def enrich_async(self, name: str, brand: str = None, category: str = None) -> Dict[str, Any]:
+        """enrich_product の非同期版"""
+        return await self._generate_json_async(_build_enrichment_prompt(name, brand, category), gemini_usage.PROMPT_ENRICHMENT)
 
-[
-    {{
-        "product_name": "短い正式商品名（色番号まで。宣伝文句は不要）",
-        "brand_name": "ブランド名",
-        "category": "カテゴリ（ファンデーション、リップ、アイシャドウなど）",
-        "timestamp_seconds": 字幕で最初に言及された秒数（整数）,
-        "sentiment": "positive" or "negative" or "neutral",
-        "summary": "どのような評価が語られているか（50文字程度）"
-    }}
-]
+    def enrich_products(self, products: List[Dict[str, Any]], batch_size: int = None) -> Dict[str, Dict[str, Any]]:
+        """
+        複数商品の詳細を batch_size 件ずつ1リクエストにまとめて生成する。
 
-【抽出の手順】
-1. まず概要欄から商品リストを特定する
-2. 各商品が字幕のどの部分で言及されているかタイムスタンプを特定する
-3. その時間帯の字幕からsentimentとsummaryを判断する
-4. 概要欄にない商品は、字幕で明確に商品名とブランド名が言及されている場合のみ追加する"""
+        Args:
+            products: [{'product_id', 'name', 'brand', 'category'}, ...]
 
-        try:
-            text = self._generate_with_retry(prompt)
-            # JSON部分を抽出
-            if text.startswith("```json"):
-                text = text[7:]
-            if text.startswith("```"):
-                text = text[3:]
-            if text.endswith("```"):
-                text = text[:-3]
-            
-            results = json.loads(text.strip())
-            logger.info(f"Geminiから {len(results)} 件の商品を抽出")
-            return results
-        except Exception as e:
-            logger.error(f"Error analyzing video with Gemini: {e}")
-            return []
+        Returns:
+            {product_id: 詳細}。回答が欠けた・型が不正だった商品だけを再要求し、
+            ENRICH_BATCH_MAX_ATTEMPTS 回で揃わなかった商品は含まれない。
+        """
+        batch_size = batch_size or ENRICH_BATCH_SIZE
+        results = {}
+        for start in range(0, len(products), batch_size):
+            results.update(self._enrich_batch(products[start:start + batch_size]))
+        return results
+
+    async def enrich_products_async(self, products: List[Dict[str, Any]], batch_size: int = None) -> Dict[str, Dict[str, Any]]:
+        """enrich_products の非同期版（バッチ同士は同時に投げる）"""
+        batch_size = batch_size or ENRICH_BATCH_SIZE
+        batches = await asyncio.gather(*(
+            self._enrich_batch_async(products[start:start + batch_size])
+            for start in range(0, len(products), batch_size)
+        ))
+        results = {}
+        for batch in batches:
+            results.update(batch)
+        return results
+
+    def _enrich_batch(self, products: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        results = {}
+        pending = list(products)
+        for attempt in range(ENRICH_BATCH_MAX_ATTEMPTS):
+            prompt = _build_enrichment_batch_prompt(pending)
+            try:
+                items = self._generate_json(prompt, gemini_usage.PROMPT_ENRICHMENT_BATCH)
+            except Exception as e:
+                logger.warning(f"商品詳細（一括）の生成エラー: {e}")
+                items = []
+            pending = self._merge_enrichment_batch(prompt, items, pending, results)
+            if not pending:
+                break
+        if pending:
+            logger.warning(f"商品詳細（一括）: {len(pending)} 件は回答が揃いませんでした")
+        return results
+
+    async def _enrich_batch_async(self, products: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        results = {}
+        pending = list(products)
+        for attempt in range(ENRICH_BATCH_MAX_ATTEMPTS):
+            prompt = _build_enrichment_batch_prompt(pending)
+            try:
+                items = await self._generate_json_async(prompt, gemini_usage.PROMPT_ENRICHMENT_BATCH)
+            except Exception as e:
+                logger.warning(f"商品詳細（一括）の生成エラー: {e}")
+                items = []
+            pending = self._merge_enrichment_batch(prompt, items, pending, results)
+            if not pending:
+                break
+        if pending:
+            logger.warning(f"商品詳細（一括）: {len(pending)} 件は回答が揃いませんでした")
+        return results
+
+    def _merge_enrichment_batch(self, prompt: str, items: Any, pending: List[Dict[str, Any]], results: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """回答を results に取り込み、まだ揃っていない商品を返す"""
+        collected = _collect_enrichment_batch(items, {str(p['product_id']) for p in pending})
+        results.update(collected)
+        remaining = [p for p in pending if str(p['product_id']) not in collected]
+        if remaining and len(remaining) == len(pending):
+            # 1件も使えなかった回答は、同じプロンプトで再要求したときに再生成させる
+            self.invalidate_cached(prompt)
+        if remaining:
+            logger.info(f"  商品詳細（一括）: {len(remaining)}/{len(pending)} 件の回答が欠けていました")
+        return remaining
 
     # 後方互換性のため残す
-    def analyze_transcript(self, transcript: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def analyze_transcript(self, transcript: Optional[CompactTranscript]) -> List[Dict[str, Any]]:
         """旧API（概要欄なし版）— analyze_video を推奨"""
         return self.analyze_video(transcript)
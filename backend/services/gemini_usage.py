@@ -0,0 +1,159 @@
+"""
+Gemini API の呼び出しごとの使用量台帳。
+
+API を呼ぶたびに、モデル・キー番号・プロンプトの種類・入出力トークン数（レスポンスの
+usage_metadata）・送信前の見積もり・レイテンシ・429 によるリトライ回数を1行記録する。
+レスポンスキャッシュから返した分は API を呼んでいないので記録しない。
+保存先は backend/.cache/gemini_usage.db。プロセスごとに実行ID（run_id）を振るので、
+batch_processor.py gemini-usage で実行単位・プロンプトの種類ごとに集計できる。
+
+設定（環境変数）:
+  GEMINI_USAGE_RUN_ID           実行ID（既定は 起動時刻-プロセスID）
+  GEMINI_USAGE_RETENTION_DAYS   記録を残す日数（既定 30）
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from services.sqlite_store import SqliteStore, cache_path
+
+RUN_ID = os.getenv("GEMINI_USAGE_RUN_ID") or f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+GEMINI_USAGE_RETENTION_DAYS = float(os.getenv("GEMINI_USAGE_RETENTION_DAYS", "30"))
+
+# プロンプトの種類
+PROMPT_ANALYSIS = 'analysis'                        # 概要欄からの商品リスト
+PROMPT_ANALYSIS_WINDOW = 'analysis_window'          # 字幕区間ごとの商品抽出
+PROMPT_CLASSIFICATION = 'classification'            # ③AI分類（1本）
+PROMPT_CLASSIFICATION_BATCH = 'classification_batch'
+PROMPT_ENRICHMENT = 'enrichment'                    # 商品詳細（1商品）
+PROMPT_ENRICHMENT_BATCH = 'enrichment_batch'
+PROMPT_OTHER = 'other'
+
+STATUS_OK = 'ok'
+STATUS_ERROR = 'error'
+
+
+class UsageRecord(NamedTuple):
+    model: str
+    key_index: int
+    prompt_type: str
+    estimated_tokens: int
+    input_tokens: Optional[int]
+    output_tokens: Optional[int]
+    total_tokens: Optional[int]
+    latency_ms: float
+    retries: int
+    status: str = STATUS_OK
+
+
+def usage_tokens(response: Any) -> Dict[str, Optional[int]]:
+    """レスポンスの usage_metadata から入出力トークン数を取り出す（思考トークンは出力に含める）"""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return {'input_tokens': None, 'output_tokens': None, 'total_tokens': None}
+    output = getattr(usage, 'candidates_token_count', None)
+    thoughts = getattr(usage, 'thoughts_token_count', None)
+    if thoughts:
+        output = (output or 0) + thoughts
+    return {
+        'input_tokens': getattr(usage, 'prompt_token_count', None),
+        'output_tokens': output,
+        'total_tokens': getattr(usage, 'total_token_count', None) or None,
+    }
+
+
+class GeminiUsageLedger(SqliteStore):
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS gemini_usage (
+        id               INTEGER PRIMARY KEY AUTOINCREMENT,
+        run_id           TEXT NOT NULL,
+        created_at       REAL NOT NULL,
+        model            TEXT NOT NULL,
+        key_index        INTEGER NOT NULL,
+        prompt_type      TEXT NOT NULL,
+        estimated_tokens INTEGER NOT NULL,
+        input_tokens     INTEGER,            -- usage_metadata がない・エラー時は NULL
+        output_tokens    INTEGER,
+        total_tokens     INTEGER,
+        latency_ms       REAL NOT NULL,
+        retries          INTEGER NOT NULL,   -- 429 で別のキー・空き待ちに回した回数
+        status           TEXT NOT NULL       -- ok / error
+    );
+    CREATE INDEX IF NOT EXISTS ix_gemini_usage_run_id ON gemini_usage (run_id);
+    CREATE INDEX IF NOT EXISTS ix_gemini_usage_created_at ON gemini_usage (created_at);
+    """
+
+    def __init__(self, path: str = None, run_id: str = RUN_ID, retention_days: float = GEMINI_USAGE_RETENTION_DAYS):
+        super().__init__(path or cache_path("gemini_usage.db"))
+        self.run_id = run_id
+        if retention_days > 0:
+            self.execute("DELETE FROM gemini_usage WHERE created_at < ?", (time.time() - retention_days * 86400,))
+
+    def record(self, entry: UsageRecord):
+        self.execute(
+            "INSERT INTO gemini_usage (run_id, created_at, model, key_index, prompt_type, estimated_tokens, "
+            "input_tokens, output_tokens, total_tokens, latency_ms, retries, status) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (self.run_id, time.time()) + tuple(entry),
+        )
+
+    def runs(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """新しい順の実行ごとの集計"""
+        rows = self.execute(
+            "SELECT run_id, MIN(created_at), MAX(created_at), COUNT(*), "
+            "COALESCE(SUM(input_tokens), 0), COALESCE(SUM(output_tokens), 0) "
+            "FROM gemini_usage GROUP BY run_id ORDER BY MAX(created_at) DESC LIMIT ?",
+            (limit,),
+        )
+        return [
+            {'run_id': r[0], 'started_at': r[1], 'finished_at': r[2], 'calls': r[3], 'input_tokens': r[4], 'output_tokens': r[5]}
+            for r in rows
+        ]
+
+    def summary(self, run_id: str = None, since: float = None, group_by: str = 'prompt_type') -> List[Dict[str, Any]]:
+        """
+        run_id（または since 以降の全実行）の使用量を group_by（prompt_type / key_index / model）ごとに集計する。
+        estimate_ratio は見積もり / 実際の入力トークン数（usage_metadata のある呼び出しのみ）。
+        """
+        if group_by not in ('prompt_type', 'key_index', 'model'):
+            raise ValueError(f"group_by は prompt_type / key_index / model のいずれか: {group_by}")
+        conditions, params = [], []
+        if run_id:
+            conditions.append("run_id = ?")
+            params.append(run_id)
+        if since is not None:
+            conditions.append("created_at >= ?")
+            params.append(since)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self.execute(
+            f"SELECT {group_by}, COUNT(*), SUM(status = '{STATUS_ERROR}'), SUM(retries), "
+            "COALESCE(SUM(input_tokens), 0), COALESCE(SUM(output_tokens), 0), "
+            "AVG(latency_ms), MAX(latency_ms), "
+            "SUM(CASE WHEN input_tokens IS NOT NULL THEN estimated_tokens END), "
+            "SUM(CASE WHEN input_tokens IS NOT NULL THEN input_tokens END) "
+            f"FROM gemini_usage {where} GROUP BY {group_by} ORDER BY SUM(input_tokens) DESC",
+            tuple(params),
+        )
+        return [
+            {
+                group_by: r[0], 'calls': r[1], 'errors': r[2], 'retries': r[3],
+                'input_tokens': r[4], 'output_tokens': r[5],
+                'avg_latency_ms': r[6] or 0.0, 'max_latency_ms': r[7] or 0.0,
+                'estimate_ratio': (r[8] / r[9]) if r[9] else None,
+            }
+            for r in rows
+        ]
+
+
+_shared_ledger: Optional[GeminiUsageLedger] = None
+_shared_ledger_lock = threading.Lock()
+
+
+def get_usage_ledger() -> GeminiUsageLedger:
+    """プロセス内で共有する GeminiUsageLedger を返す"""
+    global _shared_ledger
+    with _shared_ledger_lock:
+        if _shared_ledger is None:
+            _shared_ledger = GeminiUsageLedger()
+        return _shared_ledger
@@ -0,0 +1,121 @@
+"""
+検索結果ページの部分解析。
+
+スクレイパーが必要とするのは、検索結果ページ（数百KB）のうち先頭の商品1件分だけ。
+ページ全体を html.parser で解析する代わりに、
+  1. 目印の文字列（クラス名・属性値など）をバイト列のまま検索し、
+  2. 最初に現れた位置を含む要素の先頭から、次の結果の手前まで（最大 PARTIAL_PARSE_BYTES）を切り出し、
+  3. その断片だけをデコードして C 実装のパーサー（lxml）で解析する。
+断片内でセレクタに一致しなかった場合のみ、ページ全体を解析し直す（結果は全体解析と同じ）。
+目印がページに含まれなければセレクタは一致しえないので、解析自体を行わない。
+目印はそのページの結果カードに固有のもの（data-src のような汎用の属性名ではなく）にする。
+ページ中のどこにでも現れる目印だと、無関係な位置から切り出すことになり、結局全体を解析し直す。
+
+文字コードは、レスポンスヘッダの charset（ScraperClient.get_page が解決して渡す）→
+ページ先頭の <meta charset> → UTF-8 の順に決める（Shift_JIS・EUC-JP のページもそのまま扱える）。
+目印や '<' は ASCII なので、バイト列のままの検索はどの文字コードでも同じ位置に当たる。
+
+lxml が入っていない環境では html.parser で同じ処理を行う。
+"""
+import codecs
+import os
+import re
+from typing import Optional, Sequence, Union
+
+from bs4 import BeautifulSoup
+from bs4.element import Tag
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+# 先頭の検索結果1件を切り出す長さの上限（Amazon の結果カードは 1件 10〜30KB 程度）
+PARTIAL_PARSE_BYTES = int(os.getenv("PARTIAL_PARSE_BYTES", str(64 * 1024)))
+
+# <meta charset> を探す範囲（HTML の仕様では先頭 1024 バイト以内に置くことになっている）
+META_CHARSET_BYTES = 4096
+_META_CHARSET = re.compile(rb'<meta[^>]*?charset\s*=\s*["\']?\s*([A-Za-z0-9_.:-]+)', re.I)
+
+# Shift_JIS と宣言したページの多くは実際には機種依存文字を含む Windows-31J
+_ENCODING_ALIASES = {'shift_jis': 'cp932', 'ms932': 'cp932'}
+
+
+def normalize_encoding(name: Optional[str]) -> Optional[str]:
+    """文字コード名を Python のコーデック名にする（不明なら None）"""
+    if not name:
+        return None
+    try:
+        codec = codecs.lookup(name.strip()).name
+    except LookupError:
+        return None
+    return _ENCODING_ALIASES.get(codec, codec)
+
+
+def sniff_encoding(content: bytes) -> Optional[str]:
+    """ページ先頭の <meta charset> / <meta http-equiv="Content-Type"> の文字コード（なければ None）"""
+    match = _META_CHARSET.search(content, 0, META_CHARSET_BYTES)
+    return normalize_encoding(match.group(1).decode('ascii')) if match else None
+
+
+def _resolve(content: Union[bytes, str], encoding: Optional[str]):
+    """(バイト列, 文字コード)。str は UTF-8 にエンコードする"""
+    if isinstance(content, str):
+        return content.encode('utf-8'), 'utf-8'
+    return content, normalize_encoding(encoding) or sniff_encoding(content) or 'utf-8'
+
+
+def parse_html(content: Union[bytes, str], encoding: str = None) -> BeautifulSoup:
+    """ページ全体を解析する（encoding を省略したら <meta charset>、なければ UTF-8）"""
+    if isinstance(content, bytes):
+        content, encoding = _resolve(content, encoding)
+        content = content.decode(encoding, errors='replace')
+    return BeautifulSoup(content, HTML_PARSER)
+
+
+def slice_fragment(content: bytes, markers: Sequence[bytes], size: int = PARTIAL_PARSE_BYTES) -> Optional[bytes]:
+    """
+    markers のうち最も早く現れるものを含む要素の先頭（直前の '<'）から、
+    同じ目印が次に現れる要素の手前まで（最大 size バイト）を返す。
+    検索結果の一覧なら、これで先頭の1件分だけが切り出される。
+    どの目印も含まれなければ None。
+    """
+    found = [(pos, m) for pos, m in ((content.find(m), m) for m in markers) if pos >= 0]
+    if not found:
+        return None
+    first, marker = min(found)
+    start = content.rfind(b'<', 0, first)
+    start = start if start >= 0 else 0
+    end = start + size
+    following = content.find(marker, first + len(marker), end)
+    if following >= 0:
+        end = max(content.rfind(b'<', first, following), first + len(marker))
+    return content[start:end]
+
+
+def select_first(
+    content: Union[bytes, str],
+    selector: str,
+    markers: Sequence[Union[bytes, str]],
+    encoding: str = None,
+    size: int = PARTIAL_PARSE_BYTES,
+) -> Optional[Tag]:
+    """
+    ページ内で selector に最初に一致する要素を返す。
+
+    Args:
+        markers: selector に一致する要素（またはその祖先）に必ず含まれる文字列。
+                 クラス名や属性値など、HTML 上にそのまま現れるものを指定する。
+        encoding: レスポンスの文字コード（省略したら <meta charset>、なければ UTF-8）
+    """
+    content, encoding = _resolve(content, encoding)
+    fragment = slice_fragment(content, [m.encode(encoding) if isinstance(m, str) else m for m in markers], size)
+    if fragment is None:
+        return None
+
+    # 断片の末尾で多バイト文字が切れても無視してよい
+    found = BeautifulSoup(fragment.decode(encoding, errors='ignore'), HTML_PARSER).select_one(selector)
+    if found is not None or len(fragment) == len(content):
+        return found
+    return parse_html(content, encoding).select_one(selector)
@@ -0,0 +1,333 @@
+"""
+DB（jobs テーブル）を使った永続ジョブキュー。
+
+パイプラインの各段階（字幕取得 → AI分類 → 商品抽出 → 公式情報解決・詳細生成）をジョブとして積み、
+ワーカー（batch_processor.py work-queue）が種類ごとにまとめて取り出して処理する。
+ワーカーは1台のマシンで何プロセス起動しても、複数のマシンから同じ DB に繋いでもよい。
+
+取り出し（claim）:
+  ジョブは「リース」付きで取り出す。取り出したワーカーの ID と期限（JOB_LEASE_SECONDS 後）を
+  記録し、処理中はハートビート（Heartbeat）で期限を延長し続ける。ワーカーが落ちて期限が
+  切れたジョブは、他のワーカーが取り直す。
+  - Postgres: SELECT ... FOR UPDATE SKIP LOCKED で、他のワーカーがロック中の行を飛ばして確保する
+  - SQLite（開発用）: 1件ずつ「まだ取り出せる状態なら更新」する条件付き UPDATE で確保する
+
+完了・失敗の記録も「自分がリースを持っているなら更新」する条件付き UPDATE なので、
+リースが切れて他のワーカーに取られたジョブの結果で上書きすることはない。
+
+重複の防止:
+  未完了（pending / running）のジョブには (job_type, key) の部分ユニーク索引
+  （ux_jobs_active_type_key）があり、登録は INSERT ... ON CONFLICT DO NOTHING で行う。
+  複数のプロセスが同時に同じジョブを積んでも、未完了のものは1件しかできない。
+
+再試行:
+  失敗したジョブは JOB_MAX_ATTEMPTS 回まで、指数バックオフ（JOB_RETRY_BASE_SECONDS × 2^(n-1)、
+  上限 JOB_RETRY_MAX_SECONDS、ジッター付き）の後に取り出せるよう pending に戻す。
+  使い切ったものは failed として残す。
+
+設定（環境変数）:
+  JOB_MAX_ATTEMPTS        1ジョブの最大試行回数（既定 3）
+  JOB_LEASE_SECONDS       リースの長さ（既定 300）
+  JOB_RETRY_BASE_SECONDS  再試行までの待ち時間の基準（既定 30）
+  JOB_RETRY_MAX_SECONDS   再試行までの待ち時間の上限（既定 3600）
+"""
+import datetime
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import and_, func, or_, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from models import ACTIVE_JOB_CONDITION, Job
+
+logger = logging.getLogger(__name__)
+
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "30"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "3600"))
+
+# ジョブの種類（key はいずれも処理対象のID）
+JOB_FETCH_TRANSCRIPT = 'fetch_transcript'   # 動画: 字幕を取得して②字幕密度を判定
+JOB_CLASSIFY = 'classify'                   # 動画: ③AI分類
+JOB_EXTRACT = 'extract'                     # 動画: Gemini で商品を抽出して保存
+JOB_RESOLVE_PRODUCT = 'resolve_product'     # 商品: Amazon から画像・価格を取得
+JOB_ENRICH_PRODUCT = 'enrich_product'       # 商品: Gemini で説明・特徴・成分などを生成
+
+# パイプラインの順（ワーカーはこの順に取り出す）
+JOB_TYPES = [JOB_FETCH_TRANSCRIPT, JOB_CLASSIFY, JOB_EXTRACT, JOB_RESOLVE_PRODUCT, JOB_ENRICH_PRODUCT]
+
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+# 同じ種類・同じ対象で1件しか存在できない状態（models.Job の部分ユニーク索引と同じ条件）
+ACTIVE_STATUSES = (STATUS_PENDING, STATUS_RUNNING)
+
+
+def new_worker_id() -> str:
+    """ワーカーを識別するID（ホスト名:プロセスID:ランダム）"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def enqueue(db: Session, job_type: str, key: str, payload: Dict[str, Any] = None) -> Optional[int]:
+    """
+    ジョブを積み、その ID を返す（コミットは呼び出し側で行う）。
+    同じ種類・同じ対象の未完了ジョブがあれば積まずに None を返す。
+    """
+    now = datetime.datetime.utcnow()
+    values = {
+        'job_type': job_type,
+        'key': key,
+        'payload': json.dumps(payload, ensure_ascii=False) if payload is not None else None,
+        'status': STATUS_PENDING,
+        'attempts': 0,
+        'available_at': now,
+        'created_at': now,
+        'updated_at': now,
+    }
+
+    dialect = {'postgresql': postgresql, 'sqlite': sqlite}.get(db.get_bind().dialect.name)
+    if dialect is None:
+        # 部分ユニーク索引の使えない DB では、確認してから積む（同時実行時の重複は防げない）
+        exists = db.query(Job.id).filter(
+            Job.job_type == job_type, Job.key == key, Job.status.in_(ACTIVE_STATUSES),
+        ).first()
+        if exists:
+            return None
+        job = Job(**values)
+        db.add(job)
+        db.flush()
+        return job.id
+
+    statement = (
+        dialect.insert(Job)
+        .values(**values)
+        .on_conflict_do_nothing(index_elements=[Job.job_type, Job.key], index_where=text(ACTIVE_JOB_CONDITION))
+        .returning(Job.id)
+    )
+    return db.execute(statement).scalar()
+
+
+def _claimable(now: datetime.datetime):
+    """取り出せるジョブの条件: 待ち時間の過ぎた pending、またはリースの切れた running"""
+    return or_(
+        and_(Job.status == STATUS_PENDING, or_(Job.available_at.is_(None), Job.available_at <= now)),
+        and_(Job.status == STATUS_RUNNING, Job.lease_expires_at < now),
+    )
+
+
+def _expire_exhausted(db: Session, job_type: str, now: datetime.datetime):
+    """試行回数を使い切ったままリースが切れたジョブは、取り直さずに failed にする"""
+    db.query(Job).filter(
+        Job.job_type == job_type,
+        Job.status == STATUS_RUNNING,
+        Job.lease_expires_at < now,
+        Job.attempts >= JOB_MAX_ATTEMPTS,
+    ).update(
+        {
+            Job.status: STATUS_FAILED,
+            Job.last_error: "リース切れ（ワーカーが応答しません）",
+            Job.locked_by: None,
+            Job.lease_expires_at: None,
+            Job.updated_at: now,
+        },
+        synchronize_session=False,
+    )
+
+
+def claim(
+    db: Session,
+    job_type: str,
+    limit: int,
+    worker_id: str,
+    lease_seconds: float = JOB_LEASE_SECONDS,
+) -> List[Job]:
+    """
+    取り出せるジョブを古い順に最大 limit 件、worker_id のリース付きで running にして返す。
+    複数のワーカーが同時に取り出しても、同じジョブを二重に渡さない。
+    """
+    now = datetime.datetime.utcnow()
+    _expire_exhausted(db, job_type, now)
+
+    values = {
+        Job.status: STATUS_RUNNING,
+        Job.attempts: Job.attempts + 1,
+        Job.locked_by: worker_id,
+        Job.lease_expires_at: now + datetime.timedelta(seconds=lease_seconds),
+        Job.heartbeat_at: now,
+        Job.updated_at: now,
+    }
+    candidates = (
+        db.query(Job.id)
+        .filter(Job.job_type == job_type, _claimable(now))
+        .order_by(Job.id)
+        .limit(limit)
+    )
+
+    if db.get_bind().dialect.name == 'postgresql':
+        # 他のワーカーが確保中の行は待たずに飛ばす
+        claimed_ids = [row.id for row in candidates.with_for_update(skip_locked=True)]
+        if claimed_ids:
+            db.query(Job).filter(Job.id.in_(claimed_ids)).update(values, synchronize_session=False)
+    else:
+        claimed_ids = []
+        for (job_id,) in candidates.all():
+            updated = db.query(Job).filter(Job.id == job_id, _claimable(now)).update(
+                values, synchronize_session=False
+            )
+            if updated:
+                claimed_ids.append(job_id)
+    db.commit()
+
+    if not claimed_ids:
+        return []
+    return db.query(Job).filter(Job.id.in_(claimed_ids)).order_by(Job.id).all()
+
+
+def _owned(db: Session, job: Job, worker_id: str):
+    return db.query(Job).filter(Job.id == job.id, Job.status == STATUS_RUNNING, Job.locked_by == worker_id)
+
+
+def extend_leases(
+    db: Session,
+    job_ids: Iterable[int],
+    worker_id: str,
+    lease_seconds: float = JOB_LEASE_SECONDS,
+) -> int:
+    """worker_id がリースを持っているジョブの期限を延長してコミットする。延長できた件数を返す"""
+    job_ids = list(job_ids)
+    if not job_ids:
+        return 0
+    now = datetime.datetime.utcnow()
+    extended = db.query(Job).filter(
+        Job.id.in_(job_ids), Job.status == STATUS_RUNNING, Job.locked_by == worker_id,
+    ).update(
+        {Job.lease_expires_at: now + datetime.timedelta(seconds=lease_seconds), Job.heartbeat_at: now},
+        synchronize_session=False,
+    )
+    db.commit()
+    return extended
+
+
+class Heartbeat:
+    """
+    取り出したジョブのリースを、処理が終わるまで別スレッドで定期的に延長する。
+
+        with job_queue.Heartbeat(SessionLocal, jobs, worker_id):
+            ...  # 時間のかかる処理
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        jobs: Iterable[Job],
+        worker_id: str,
+        lease_seconds: float = JOB_LEASE_SECONDS,
+    ):
+        self.session_factory = session_factory
+        self.job_ids = [job.id for job in jobs]
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.interval = max(1.0, lease_seconds / 3)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="job-heartbeat", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            db = self.session_factory()
+            try:
+                extended = extend_leases(db, self.job_ids, self.worker_id, self.lease_seconds)
+                if extended < len(self.job_ids):
+                    logger.warning(f"リースを失ったジョブがあります: {len(self.job_ids) - extended}/{len(self.job_ids)} 件")
+            except Exception as e:
+                logger.warning(f"ハートビートの送信に失敗: {e}")
+                db.rollback()
+            finally:
+                db.close()
+
+    def __enter__(self):
+        if self.job_ids:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        return False
+
+
+def payload_of(job: Job) -> Dict[str, Any]:
+    return json.loads(job.payload) if job.payload else {}
+
+
+def retry_delay(attempts: int) -> float:
+    """attempts 回目の失敗後、再試行まで待つ秒数（指数バックオフ + ジッター）"""
+    delay = min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def complete(db: Session, job: Job, worker_id: str) -> bool:
+    """
+    ジョブを完了にする（コミットは呼び出し側で行う）。
+    リースが切れて他のワーカーに取られていた場合は何もせず False を返す。
+    """
+    updated = _owned(db, job, worker_id).update(
+        {
+            Job.status: STATUS_DONE,
+            Job.last_error: None,
+            Job.locked_by: None,
+            Job.lease_expires_at: None,
+            Job.updated_at: datetime.datetime.utcnow(),
+        },
+        synchronize_session=False,
+    )
+    if not updated:
+        logger.warning(f"リース切れのため完了を記録できません: {job.job_type} {job.key}")
+    return bool(updated)
+
+
+def fail(db: Session, job: Job, worker_id: str, error: str) -> bool:
+    """
+    ジョブの失敗を記録する（コミットは呼び出し側で行う）。
+    試行回数が残っていればバックオフ後に取り出せるよう pending に戻して True、
+    使い切ったら failed にして False を返す。
+    リースが切れて他のワーカーに取られていた場合は何もせず True を返す（そのワーカーが続きを処理する）。
+    """
+    now = datetime.datetime.utcnow()
+    retrying = job.attempts < JOB_MAX_ATTEMPTS
+    values = {
+        Job.last_error: error,
+        Job.locked_by: None,
+        Job.lease_expires_at: None,
+        Job.updated_at: now,
+    }
+    if retrying:
+        values[Job.status] = STATUS_PENDING
+        values[Job.available_at] = now + datetime.timedelta(seconds=retry_delay(job.attempts))
+    else:
+        values[Job.status] = STATUS_FAILED
+
+    if not _owned(db, job, worker_id).update(values, synchronize_session=False):
+        logger.warning(f"リース切れのため失敗を記録できません: {job.job_type} {job.key}")
+        return True
+    if not retrying:
+        logger.warning(f"ジョブ失敗（{job.attempts}回試行）: {job.job_type} {job.key}: {error}")
+    return retrying
+
+
+def counts(db: Session) -> Dict[str, Dict[str, int]]:
+    """種類・状態ごとのジョブ数"""
+    result: Dict[str, Dict[str, int]] = {}
+    for job_type, status, count in db.query(Job.job_type, Job.status, func.count(Job.id)).group_by(Job.job_type, Job.status):
+        result.setdefault(job_type, {})[status] = count
+    return result
@@ -0,0 +1,285 @@
+"""
+商品名の名寄せ用インメモリ索引。
+
+正規化済みの商品名を文字 n-gram の転置インデックスに載せ、
+SequenceMatcher による高コストな類似度計算の前に候補を少数に絞り込む。
+ブランド名も同様に索引化し、ブランド一致ボーナスの判定に使う。
+
+スコアリングの意味は従来の全件走査と同じ:
+  - 正規化後の完全一致があればそれを返す
+  - 類似度 + ブランド一致ボーナス(0.1) が 0.85 以上の最良候補を返す
+
+1本の動画から抽出された複数商品は find_many でまとめて照合できる
+（ポスティングの走査と類似度計算を一括で行い、バッチ内の重複も解決する）。
+"""
+import re
+import unicodedata
+from collections import defaultdict
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+# 同一商品と判定する閾値
+MATCH_THRESHOLD = 0.85
+# ブランド名の類似度がこれを超えればボーナスを加算
+BRAND_MATCH_THRESHOLD = 0.7
+BRAND_BONUS = 0.1
+
+# n-gram のサイズ（日本語の商品名はバイグラムが最もバランスが良い）
+NGRAM_SIZE = 2
+# SequenceMatcher で精査する候補数の上限
+MAX_CANDIDATES = 64
+# 候補生成時にこれより長いポスティングを持つ「ありふれた n-gram」は無視する
+# （例: 「リキ」「クリ」など多くの商品名に含まれるもの）
+MAX_POSTING_LENGTH = 2000
+
+
+@lru_cache(maxsize=65536)
+def normalize_name(name: str) -> str:
+    """商品名を正規化する（スペース除去、全角半角統一、カッコ内除去）"""
+    if not name:
+        return ""
+    # NFKC正規化（全角→半角、濁点統一など）
+    name = unicodedata.normalize('NFKC', name)
+    # 括弧とその中身を除去（例: (Medicube) → 空）
+    name = re.sub(r'[\(（][^)）]*[\)）]', '', name)
+    # 空白を全て除去
+    name = re.sub(r'\s+', '', name)
+    # 小文字化（英字の表記揺れ対応）
+    name = name.lower()
+    return name.strip()
+
+
+def _ngrams(text: str) -> Set[str]:
+    """文字 n-gram の集合を返す（n より短い文字列はそれ自体を1グラムとする）"""
+    if len(text) <= NGRAM_SIZE:
+        return {text} if text else set()
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+class MatchResult(NamedTuple):
+    product_id: str
+    score: float
+    exact: bool
+
+
+class BatchMatch(NamedTuple):
+    # 既存商品との一致（なければ None）
+    match: Optional[MatchResult]
+    # 既存商品に一致せず、バッチ内の先行要素と同一商品と判定された場合はその添字
+    duplicate_of: Optional[int]
+
+
+class ProductMatcher:
+    """
+    商品名・ブランド名の n-gram 転置インデックス。
+
+    商品は登録順のスロット番号で管理する。同点の場合は先に登録された商品を優先し、
+    DB の全件走査（先勝ち）と同じ結果になるようにしている。
+    """
+
+    def __init__(self):
+        # スロット番号 → 商品情報（削除済みは None）
+        self._ids: List[Optional[str]] = []
+        self._names: List[str] = []
+        self._brands: List[str] = []
+        self._slot_by_id: Dict[str, int] = {}
+        # 正規化名 → 最初に登録されたスロット（完全一致用）
+        self._exact: Dict[str, List[int]] = defaultdict(list)
+        # 商品名 n-gram → スロット番号のリスト
+        self._name_postings: Dict[str, List[int]] = defaultdict(list)
+        # ブランド名 n-gram → 正規化ブランド名の集合
+        self._brand_postings: Dict[str, Set[str]] = defaultdict(set)
+        self._known_brands: Set[str] = set()
+        # 問い合わせブランド → 類似ブランド集合のキャッシュ
+        self._similar_brand_cache: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._slot_by_id)
+
+    def add(self, product_id: str, name: str, brand: str = None):
+        """商品を索引に追加する（同じIDが既にあれば置き換える）"""
+        self.add_normalized(
+            product_id,
+            normalize_name(name),
+            normalize_name(brand) if brand else None,
+        )
+
+    def add_normalized(self, product_id: str, normalized: str, normalized_brand: str = None):
+        """正規化済みの商品名・ブランド名で索引に追加する（ブランドなしは None）"""
+        if product_id in self._slot_by_id:
+            self.remove(product_id)
+
+        normalized = normalized or ""
+        has_brand = normalized_brand is not None
+        normalized_brand = normalized_brand or ""
+
+        slot = len(self._ids)
+        self._ids.append(product_id)
+        self._names.append(normalized)
+        self._brands.append(normalized_brand)
+        self._slot_by_id[product_id] = slot
+
+        if normalized:
+            self._exact[normalized].append(slot)
+            for gram in _ngrams(normalized):
+                self._name_postings[gram].append(slot)
+
+        if has_brand and normalized_brand not in self._known_brands:
+            self._known_brands.add(normalized_brand)
+            for gram in _ngrams(normalized_brand):
+                self._brand_postings[gram].add(normalized_brand)
+            # 新しいブランドが増えたので類似ブランドのキャッシュを破棄
+            self._similar_brand_cache.clear()
+
+    def remove(self, product_id: str):
+        """商品を索引から外す（ポスティングは遅延的に読み飛ばす）"""
+        slot = self._slot_by_id.pop(product_id, None)
+        if slot is None:
+            return
+        self._ids[slot] = None
+        slots = self._exact.get(self._names[slot])
+        if slots and slot in slots:
+            slots.remove(slot)
+
+    def _similar_brands(self, normalized_brand: str) -> Set[str]:
+        """問い合わせブランドと類似度が閾値を超える既知ブランドの集合"""
+        cached = self._similar_brand_cache.get(normalized_brand)
+        if cached is not None:
+            return cached
+
+        candidates = set()
+        for gram in _ngrams(normalized_brand):
+            candidates |= self._brand_postings.get(gram, set())
+        similar = {
+            b for b in candidates
+            if SequenceMatcher(None, normalized_brand, b).ratio() > BRAND_MATCH_THRESHOLD
+        }
+        self._similar_brand_cache[normalized_brand] = similar
+        return similar
+
+    def _rank_candidates(self, counts: Dict[int, int], skipped: List[List[int]]) -> List[int]:
+        """n-gram の共有数が多い順に候補スロットを返す"""
+        # すべてありふれた n-gram だった場合は最も短いポスティングだけ使う
+        if not counts and skipped:
+            counts = defaultdict(int)
+            for slot in min(skipped, key=len)[:MAX_POSTING_LENGTH]:
+                counts[slot] += 1
+
+        live = [(n, slot) for slot, n in counts.items() if self._ids[slot] is not None]
+        live.sort(key=lambda x: (-x[0], x[1]))
+        return [slot for _, slot in live[:MAX_CANDIDATES]]
+
+    def _fuzzy_match(self, queries: Sequence[Tuple[str, Optional[str]]]) -> List[Optional[MatchResult]]:
+        """
+        正規化済みの (商品名, ブランド名) 群をまとめてあいまい照合する。
+
+        ポスティングは問い合わせ全体で n-gram ごとに1回だけ走査し、
+        類似度計算は候補商品ごとにまとめて SequenceMatcher を使い回す
+        （候補側の前処理を共有できる）。
+        """
+        # n-gram → それを含む問い合わせの添字
+        gram_queries: Dict[str, List[int]] = defaultdict(list)
+        for i, (normalized, _) in enumerate(queries):
+            for gram in _ngrams(normalized):
+                gram_queries[gram].append(i)
+
+        counts: List[Dict[int, int]] = [defaultdict(int) for _ in queries]
+        skipped: List[List[List[int]]] = [[] for _ in queries]
+        for gram, query_indexes in gram_queries.items():
+            postings = self._name_postings.get(gram)
+            if not postings:
+                continue
+            if len(postings) > MAX_POSTING_LENGTH:
+                for i in query_indexes:
+                    skipped[i].append(postings)
+                continue
+            for slot in postings:
+                for i in query_indexes:
+                    counts[i][slot] += 1
+
+        # 候補商品 → それを候補に持つ問い合わせの添字
+        slot_queries: Dict[int, List[int]] = defaultdict(list)
+        for i in range(len(queries)):
+            for slot in self._rank_candidates(counts[i], skipped[i]):
+                slot_queries[slot].append(i)
+
+        similar_brands = [
+            self._similar_brands(normalized_brand) if normalized_brand else set()
+            for _, normalized_brand in queries
+        ]
+
+        best_slot: List[Optional[int]] = [None] * len(queries)
+        best_score: List[float] = [0.0] * len(queries)
+        matcher = SequenceMatcher(None)
+        # 登録順に評価し、同点なら先勝ちにする
+        for slot in sorted(slot_queries):
+            matcher.set_seq2(self._names[slot])
+            for i in slot_queries[slot]:
+                matcher.set_seq1(queries[i][0])
+                bonus = 0.0
+                if similar_brands[i] and self._brands[slot] in similar_brands[i]:
+                    bonus = BRAND_BONUS  # ブランド一致ボーナス
+                # 上界で閾値に届かない候補は最良にもなり得ないので精査を省く
+                if matcher.real_quick_ratio() + bonus < MATCH_THRESHOLD:
+                    continue
+                if matcher.quick_ratio() + bonus < MATCH_THRESHOLD:
+                    continue
+                score = matcher.ratio() + bonus
+                if score > best_score[i]:
+                    best_score[i] = score
+                    best_slot[i] = slot
+
+        return [
+            MatchResult(self._ids[slot], score, False)
+            if slot is not None and score >= MATCH_THRESHOLD else None
+            for slot, score in zip(best_slot, best_score)
+        ]
+
+    def _lookup(self, items: Sequence[Tuple[str, Optional[str]]]) -> List[Optional[MatchResult]]:
+        """完全一致を優先し、残りをまとめてあいまい照合する"""
+        results: List[Optional[MatchResult]] = [None] * len(items)
+        pending = []
+        for i, (product_name, brand_name) in enumerate(items):
+            normalized_new = normalize_name(product_name)
+            if not normalized_new:
+                continue
+            # 完全一致（正規化後）
+            exact_slots = self._exact.get(normalized_new)
+            if exact_slots:
+                results[i] = MatchResult(self._ids[exact_slots[0]], 1.0, True)
+            else:
+                pending.append((i, normalized_new, normalize_name(brand_name) if brand_name else None))
+
+        if pending:
+            fuzzy = self._fuzzy_match([(n, b) for _, n, b in pending])
+            for (i, _, _), match in zip(pending, fuzzy):
+                results[i] = match
+        return results
+
+    def find(self, product_name: str, brand_name: str = None) -> Optional[MatchResult]:
+        """名寄せで一致する商品を探す。見つからなければ None"""
+        return self._lookup([(product_name, brand_name)])[0]
+
+    def find_many(self, items: Sequence[Tuple[str, Optional[str]]]) -> List[BatchMatch]:
+        """
+        1本の動画から抽出された (商品名, ブランド名) のリストをまとめて名寄せする。
+
+        既存商品に一致しなかった要素同士も同じ基準で照合し、
+        同一商品が複数回挙げられている場合は先に現れた要素の添字を duplicate_of に入れる。
+        """
+        matches = self._lookup(items)
+
+        # バッチ内の重複判定: 未一致の要素を順に一時索引へ登録しながら照合する
+        batch_index = ProductMatcher()
+        results = []
+        for i, ((product_name, brand_name), match) in enumerate(zip(items, matches)):
+            duplicate_of = None
+            if match is None and normalize_name(product_name):
+                earlier = batch_index.find(product_name, brand_name)
+                if earlier:
+                    duplicate_of = int(earlier.product_id)
+                else:
+                    batch_index.add(str(i), product_name, brand_name)
+            results.append(BatchMatch(match, duplicate_of))
+        return results
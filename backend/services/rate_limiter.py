@@ -0,0 +1,164 @@
+"""
+APIキーごとのトークンバケット型レートリミッター。
+
+Gemini の無料枠はキーごとに RPM（1分あたりリクエスト数）と TPM（1分あたりトークン数）の
+上限がある。429 を受けてから待つのではなく、各キーの残り容量を事前に追跡し、
+空きのあるキーを払い出す。全キーが埋まっている場合は、最も早く空くキーの
+空き時刻までだけ待機する。
+
+スレッドセーフ。process_channel --workers などの並列実行から共有して使う。
+"""
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+
+class TokenBucket:
+    """
+    1分あたり capacity だけ連続的に補充されるトークンバケット。
+    呼び出し側でロックを取ること（KeyRateLimiter が一括で管理する）。
+    """
+
+    def __init__(self, capacity: float, period_seconds: float = 60.0):
+        self.capacity = float(capacity)
+        self.refill_per_second = self.capacity / period_seconds
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_per_second)
+            self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """amount を消費できるようになるまでの秒数（今すぐ可能なら 0）"""
+        self._refill(now)
+        amount = min(amount, self.capacity)  # 容量を超える要求は満タンになれば通す
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_second
+
+    def consume(self, amount: float, now: float):
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, delta: float, now: float):
+        """見積もりと実績の差分を反映する（delta > 0 で追加消費）"""
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+    def drain(self, now: float):
+        """バケットを空にする（429 を受けた場合など）"""
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0)
+
+    def utilization(self, now: float) -> float:
+        """直近1分の使用率（0.0〜1.0）"""
+        self._refill(now)
+        return max(0.0, min(1.0, 1.0 - self.tokens / self.capacity))
+
+
+def parse_retry_delay(error_message: str) -> Optional[float]:
+    """429 エラーのメッセージから推奨待機秒数を取り出す（見つからなければ None）"""
+    match = re.search(r'retry in ([\d.]+)\s*s', error_message, re.IGNORECASE)
+    if not match:
+        match = re.search(r'retry_delay\s*\{\s*seconds:\s*(\d+)', error_message)
+    return float(match.group(1)) if match else None
+
+
+class KeyRateLimiter:
+    """
+    複数APIキーの RPM / TPM をトークンバケットで管理し、空きのあるキーを払い出す。
+    """
+
+    def __init__(self, num_keys: int, rpm: float, tpm: float, cooldown_seconds: float = 60.0):
+        self.num_keys = num_keys
+        self.cooldown_seconds = cooldown_seconds
+        self._rpm = [TokenBucket(rpm) for _ in range(num_keys)]
+        self._tpm = [TokenBucket(tpm) for _ in range(num_keys)]
+        # 429 を受けたキーはこの時刻まで払い出さない
+        self._blocked_until = [0.0] * num_keys
+        self._requests = [0] * num_keys
+        self._throttled = [0] * num_keys
+        self._cursor = 0
+        self._cond = threading.Condition()
+
+    def _key_wait(self, index: int, tokens: float, now: float) -> float:
+        return max(
+            self._blocked_until[index] - now,
+            self._rpm[index].wait_time(1, now),
+            self._tpm[index].wait_time(tokens, now),
+        )
+
+    def try_acquire(self, estimated_tokens: float = 0, exclude: Set[int] = frozenset()) -> Tuple[Optional[int], Optional[float]]:
+        """
+        待たずに容量の確保を試みる。
+
+        Returns:
+            (キーのインデックス, None) … 確保できた場合
+            (None, 待機秒数)           … 最も早く空くキーまでの秒数（exclude で全キー除外時は None）
+        """
+        with self._cond:
+            now = time.monotonic()
+            shortest = None
+            # 前回払い出したキーの次から順に見て、負荷を分散する
+            for offset in range(self.num_keys):
+                index = (self._cursor + offset) % self.num_keys
+                if index in exclude:
+                    continue
+                wait = self._key_wait(index, estimated_tokens, now)
+                if wait <= 0:
+                    self._rpm[index].consume(1, now)
+                    self._tpm[index].consume(estimated_tokens, now)
+                    self._requests[index] += 1
+                    self._cursor = (index + 1) % self.num_keys
+                    return index, None
+                if shortest is None or wait < shortest:
+                    shortest = wait
+            return None, shortest
+
+    def acquire(self, estimated_tokens: float = 0) -> int:
+        """
+        リクエスト1回分（+ 見積もりトークン）の容量を確保し、使うキーのインデックスを返す。
+        空きがなければ、最も早く空くキーの空き時刻まで待つ。
+        """
+        with self._cond:
+            while True:
+                index, wait = self.try_acquire(estimated_tokens)
+                if index is not None:
+                    return index
+                # 他スレッドが record_usage / penalize で状況を変えた場合も起きて再評価する
+                self._cond.wait(timeout=wait)
+
+    def record_usage(self, index: int, actual_tokens: float, estimated_tokens: float):
+        """実際の消費トークン数で TPM バケットを補正する"""
+        with self._cond:
+            self._tpm[index].adjust(actual_tokens - estimated_tokens, time.monotonic())
+            self._cond.notify_all()
+
+    def penalize(self, index: int, retry_after: float = None):
+        """429 を受けたキーを retry_after 秒（既定は1分）払い出さない"""
+        with self._cond:
+            now = time.monotonic()
+            self._rpm[index].drain(now)
+            self._blocked_until[index] = now + (retry_after if retry_after is not None else self.cooldown_seconds)
+            self._throttled[index] += 1
+            self._cond.notify_all()
+
+    def utilization(self) -> List[Dict[str, float]]:
+        """キーごとの現在の使用率（RPM/TPM）と累計リクエスト数・429 回数"""
+        with self._cond:
+            now = time.monotonic()
+            return [
+                {
+                    'key_index': i,
+                    'rpm_utilization': round(self._rpm[i].utilization(now), 3),
+                    'tpm_utilization': round(self._tpm[i].utilization(now), 3),
+                    'blocked_seconds': round(max(0.0, self._blocked_until[i] - now), 1),
+                    'requests': self._requests[i],
+                    'throttled': self._throttled[i],
+                }
+                for i in range(self.num_keys)
+            ]
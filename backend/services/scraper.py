@@ -0,0 +1,215 @@
+"""
+スクレイピング用の共有 HTTP クライアント。
+
+Amazon / @cosme / 楽天 などの検索ページ取得は全てここを通す。
+  - 1つの requests.Session を共有し、ホストごとに keep-alive のコネクションプールを持つ
+    （毎回 TLS 接続を張り直さない）
+  - ドメインごとに最小リクエスト間隔を守る。前回から十分に時間が空いていれば待たない
+    （呼び出し側で固定の time.sleep を入れる必要はない）
+  - ドメインごとの同時リクエスト数を制限する（並列実行時もサイトに負荷をかけすぎない）
+
+設定（環境変数）:
+  SCRAPER_TIMEOUT_SECONDS           1リクエストのタイムアウト（既定 10）
+  SCRAPER_MIN_INTERVAL_SECONDS      同一ドメインへのリクエスト間隔の既定値（既定 1.0）
+  SCRAPER_HOST_INTERVALS            ドメイン別の間隔（例: "amazon.co.jp=2,cosme.net=1"）
+  SCRAPER_MAX_CONCURRENCY_PER_HOST  同一ドメインへの同時リクエスト数（既定 2）
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, NamedTuple, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from services.html_extract import normalize_encoding, sniff_encoding
+
+logger = logging.getLogger(__name__)
+
+SCRAPER_TIMEOUT_SECONDS = float(os.getenv("SCRAPER_TIMEOUT_SECONDS", "10"))
+SCRAPER_MIN_INTERVAL_SECONDS = float(os.getenv("SCRAPER_MIN_INTERVAL_SECONDS", "1.0"))
+SCRAPER_MAX_CONCURRENCY_PER_HOST = int(os.getenv("SCRAPER_MAX_CONCURRENCY_PER_HOST", "2"))
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept-Language': 'ja,en-US;q=0.9,en;q=0.8',
+}
+
+
+def _parse_host_intervals(value: str) -> Dict[str, float]:
+    """"amazon.co.jp=2,cosme.net=1" 形式の設定を辞書にする"""
+    intervals = {}
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+        domain, seconds = item.split('=', 1)
+        try:
+            intervals[domain.strip().lower()] = float(seconds)
+        except ValueError:
+            logger.warning(f"SCRAPER_HOST_INTERVALS の値を解釈できません: {item}")
+    return intervals
+
+
+SCRAPER_HOST_INTERVALS = _parse_host_intervals(os.getenv("SCRAPER_HOST_INTERVALS", ""))
+
+
+class RequestCancelled(Exception):
+    """送信前（同時実行枠・間隔調整の待ち中）にキャンセルされた"""
+
+
+class Page(NamedTuple):
+    content: bytes      # デコードしていない本文
+    encoding: str       # 本文の文字コード（Python のコーデック名）
+
+
+class HostScheduler:
+    """
+    ドメインごとの最小リクエスト間隔と同時実行数を管理する。
+
+    リクエストのたびに「次に送ってよい時刻」を予約していくので、
+    複数スレッドから同時に呼ばれても間隔は守られ、間隔が空いていれば待たない。
+    """
+
+    def __init__(self, min_interval: float, max_concurrency: int, host_intervals: Dict[str, float] = None):
+        self.min_interval = min_interval
+        self.max_concurrency = max(1, max_concurrency)
+        self.host_intervals = host_intervals or {}
+        self._next_at: Dict[str, float] = {}
+        self._slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        self.requests: Dict[str, int] = {}
+        self.waited_seconds: Dict[str, float] = {}
+
+    def interval_for(self, host: str) -> float:
+        """ホスト名に一致する（サブドメインを含む）設定があればその間隔を使う"""
+        for domain, seconds in self.host_intervals.items():
+            if host == domain or host.endswith('.' + domain):
+                return seconds
+        return self.min_interval
+
+    def _slot(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            slot = self._slots.get(host)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.max_concurrency)
+                self._slots[host] = slot
+            return slot
+
+    def _reserve(self, host: str) -> float:
+        """送信時刻を予約し、それまでの待ち秒数を返す"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_at.get(host, 0.0))
+            self._next_at[host] = start + self.interval_for(host)
+            self.requests[host] = self.requests.get(host, 0) + 1
+            wait = start - now
+            self.waited_seconds[host] = self.waited_seconds.get(host, 0.0) + wait
+            return wait
+
+    @contextmanager
+    def slot(self, host: str, cancel_event: threading.Event = None):
+        """
+        同時実行枠を確保し、予約した送信時刻まで待ってから中の処理を実行する。
+        cancel_event がセットされたら、送信前であれば RequestCancelled を投げて諦める。
+        """
+        slot = self._slot(host)
+        if cancel_event is None:
+            slot.acquire()
+        else:
+            while not slot.acquire(timeout=0.1):
+                if cancel_event.is_set():
+                    raise RequestCancelled(host)
+        try:
+            wait = self._reserve(host)
+            if cancel_event is None:
+                if wait > 0:
+                    time.sleep(wait)
+            else:
+                cancelled = cancel_event.wait(wait) if wait > 0 else cancel_event.is_set()
+                if cancelled:
+                    raise RequestCancelled(host)
+            yield
+        finally:
+            slot.release()
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                host: {'requests': count, 'waited_seconds': round(self.waited_seconds.get(host, 0.0), 1)}
+                for host, count in self.requests.items()
+            }
+
+
+class ScraperClient:
+    """keep-alive のセッションとホスト別スケジューラを組み合わせた HTTP クライアント"""
+
+    def __init__(
+        self,
+        timeout: float = SCRAPER_TIMEOUT_SECONDS,
+        min_interval: float = SCRAPER_MIN_INTERVAL_SECONDS,
+        max_concurrency_per_host: int = SCRAPER_MAX_CONCURRENCY_PER_HOST,
+        host_intervals: Dict[str, float] = None,
+        headers: Dict[str, str] = None,
+    ):
+        self.timeout = timeout
+        self.scheduler = HostScheduler(
+            min_interval, max_concurrency_per_host,
+            SCRAPER_HOST_INTERVALS if host_intervals is None else host_intervals,
+        )
+        self.session = requests.Session()
+        self.session.headers.update(headers or DEFAULT_HEADERS)
+        # ホストごとのプールに、同時実行数と同じ本数の接続を保持する
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=max(1, max_concurrency_per_host))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, url: str, cancel_event: threading.Event = None, **kwargs) -> requests.Response:
+        """
+        ドメインごとの間隔・同時実行数を守って GET する。
+        cancel_event を渡すと、送信前の待ち時間中にキャンセルできる（RequestCancelled）。
+        """
+        host = (urlparse(url).hostname or '').lower()
+        kwargs.setdefault('timeout', self.timeout)
+        with self.scheduler.slot(host, cancel_event):
+            return self.session.get(url, **kwargs)
+
+    def get_text(self, url: str, **kwargs) -> Optional[str]:
+        """GET して 200 のときだけ本文を返す（それ以外は None）"""
+        resp = self.get(url, **kwargs)
+        if resp.status_code != 200:
+            return None
+        return resp.text
+
+    def get_page(self, url: str, **kwargs) -> Optional[Page]:
+        """
+        GET して 200 のときだけ本文をデコードせずに、文字コードと一緒に返す（部分解析用。それ以外は None）。
+        文字コードはヘッダの charset → <meta charset> → 本文からの推定（apparent_encoding）の順に決める。
+        """
+        resp = self.get(url, **kwargs)
+        if resp.status_code != 200:
+            return None
+        content = resp.content
+        # charset のない text/html に requests が補う ISO-8859-1 は使わない
+        declared = resp.encoding if 'charset' in resp.headers.get('Content-Type', '').lower() else None
+        encoding = normalize_encoding(declared) or sniff_encoding(content) or normalize_encoding(resp.apparent_encoding)
+        return Page(content, encoding or 'utf-8')
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """ホストごとのリクエスト数と、間隔調整で待った合計秒数"""
+        return self.scheduler.stats()
+
+
+_shared_client: Optional[ScraperClient] = None
+_shared_client_lock = threading.Lock()
+
+
+def get_scraper() -> ScraperClient:
+    """プロセス内で共有する ScraperClient を返す"""
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = ScraperClient()
+        return _shared_client
@@ -0,0 +1,57 @@
+"""
+ローカル SQLite ファイルを使った永続キャッシュの共通基盤。
+
+字幕・API レスポンスなど「消えても再取得できるが、取り直すと高い」データを
+backend/.cache/ 以下の SQLite に保存する。メインDB（Supabase）とは独立しており、
+同じマシン上の複数プロセス・複数スレッドから共有できる（WAL モード）。
+"""
+import os
+import sqlite3
+import threading
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(BASE_DIR, ".cache"))
+
+
+def cache_path(filename: str) -> str:
+    """キャッシュディレクトリ内のファイルパスを返す（ディレクトリは自動作成）"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return os.path.join(CACHE_DIR, filename)
+
+
+class SqliteStore:
+    """
+    1ファイル = 1接続の薄いラッパー。
+
+    サブクラスは SCHEMA にテーブル定義を書く。接続はスレッド間で共有し、
+    ロックで直列化する（キャッシュ用途なのでクエリは軽いものに限る）。
+    """
+
+    SCHEMA = ""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        if self.SCHEMA:
+            self._conn.executescript(self.SCHEMA)
+            self._conn.commit()
+
+    def execute(self, sql: str, params: tuple = ()) -> list:
+        """SQL を実行して結果の全行を返す（書き込みは即コミット）"""
+        with self._lock:
+            cur = self._conn.execute(sql, params)
+            rows = cur.fetchall()
+            self._conn.commit()
+            return rows
+
+    def executemany(self, sql: str, seq_of_params) -> None:
+        with self._lock:
+            self._conn.executemany(sql, seq_of_params)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,227 @@
+"""
+字幕ファイル（yt-dlp フォールバックで取得するもの）のストリーミング解析。
+
+HTTP レスポンスを全文読み込んでから分割する代わりに、受信したチャンクを順に1回だけ走査し、
+字幕セグメント {'text', 'start', 'duration'} を確定したものから順に yield する。
+数時間分の自動字幕でも、メモリに載るのは受信中のチャンクと解析中の1セグメント分だけ。
+
+対応形式（YouTube が返すもの）:
+  vtt    WebVTT（自動字幕の <c> タグ・単語ごとのタイムスタンプは除去し、実体参照を展開）
+  srv3   <timedtext><body><p t="ミリ秒" d="ミリ秒">…</p>（srv1/srv2 の <text start="秒" dur="秒"> も可）
+  json3  {"events": [{"tStartMs", "dDurationMs", "segs": [{"utf8"}]}]}（実体参照を展開）
+XML（srv）の実体参照はパーサーが展開するので、ここでは展開しない。
+
+使い方:
+    for segment in iter_segments(resp.iter_content(65536), fmt='vtt'):
+        ...
+"""
+import codecs
+import html
+import json
+import re
+import xml.etree.ElementTree as ET
+from typing import Iterable, Iterator, Optional
+
+SUBTITLE_FORMATS = ('vtt', 'srv3', 'json3')
+
+# 00:00:00.000 --> 00:00:01.500（時間は省略可: 00:00.000）
+_VTT_TIMING = re.compile(
+    r'(?:(\d+):)?(\d{2}):(\d{2})[.,](\d{3})\s+-->\s+(?:(\d+):)?(\d{2}):(\d{2})[.,](\d{3})'
+)
+# <c>…</c>, <c.colorE5E5E5>, <00:00:01.234> などのインラインタグ
+_VTT_TAG = re.compile(r'<[^>]*>')
+
+
+def _segment(text: str, start: float, duration: float) -> dict:
+    return {'text': text, 'start': start, 'duration': duration}
+
+
+def _seconds(h: Optional[str], m: str, s: str, ms: str) -> float:
+    return (int(h) * 3600 if h else 0) + int(m) * 60 + int(s) + int(ms) / 1000
+
+
+def _iter_lines(chunks: Iterable[bytes], encoding: str = 'utf-8') -> Iterator[str]:
+    """バイト列のチャンクを行単位の文字列にする（チャンク境界で切れた行・多バイト文字はつなぐ）"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    pending = ''
+    for chunk in chunks:
+        if not chunk:
+            continue
+        pending += decoder.decode(chunk)
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def iter_vtt_segments(lines: Iterable[str]) -> Iterator[dict]:
+    """WebVTT の行から字幕セグメントを順に返す（1行ずつ1回だけ見る）"""
+    start = duration = 0.0
+    text_parts = None   # None = キューの外（ヘッダー・NOTE・キュー番号など）
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            if text_parts:
+                yield _segment(' '.join(text_parts), start, duration)
+            text_parts = None
+            continue
+
+        if '-->' in line:
+            match = _VTT_TIMING.search(line)
+            if match:
+                if text_parts:
+                    yield _segment(' '.join(text_parts), start, duration)
+                start = _seconds(*match.group(1, 2, 3, 4))
+                duration = round(_seconds(*match.group(5, 6, 7, 8)) - start, 3)
+                text_parts = []
+                continue
+
+        if text_parts is not None:
+            if '<' in line:
+                line = _VTT_TAG.sub('', line)
+            if '&' in line:
+                line = html.unescape(line)
+            if line:
+                text_parts.append(line)
+
+    if text_parts:
+        yield _segment(' '.join(text_parts), start, duration)
+
+
+def iter_srv_segments(chunks: Iterable[bytes]) -> Iterator[dict]:
+    """srv3（<p t d>、ミリ秒）/ srv1・srv2（<text start dur>、秒）の XML から字幕セグメントを順に返す"""
+    parser = ET.XMLPullParser(events=('end',))
+
+    def drain() -> Iterator[dict]:
+        for _, elem in parser.read_events():
+            if elem.tag == 'p':
+                start = int(elem.get('t', 0)) / 1000
+                duration = int(elem.get('d', 0)) / 1000
+            elif elem.tag == 'text':
+                start = float(elem.get('start', 0))
+                duration = float(elem.get('dur', 0))
+            else:
+                continue
+            # 実体参照は ElementTree が展開済み（もう一度 unescape すると字幕中の "&amp;" が "&" になる）
+            text = ' '.join(''.join(elem.itertext()).split())
+            # 処理済みの要素は捨てて、メモリに溜めない
+            elem.clear()
+            if text:
+                yield _segment(text, start, duration)
+
+    for chunk in chunks:
+        if chunk:
+            parser.feed(chunk)
+            yield from drain()
+    parser.close()
+    yield from drain()
+
+
+def iter_json3_segments(chunks: Iterable[bytes], encoding: str = 'utf-8') -> Iterator[dict]:
+    """
+    json3 から字幕セグメントを順に返す。
+    "events" 配列の要素を1件ずつ JSONDecoder.raw_decode で取り出すので、全体を読み込まない。
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    chunks = iter(chunks)
+    buffer = ''
+    pos = 0             # buffer 内の次に読む位置
+    exhausted = False
+
+    def more() -> bool:
+        """次のチャンクを読み足す（読み終えた部分はここで捨てる）"""
+        nonlocal buffer, pos, exhausted
+        if pos:
+            buffer = buffer[pos:]
+            pos = 0
+        for chunk in chunks:
+            if chunk:
+                buffer += text_decoder.decode(chunk)
+                return True
+        if not exhausted:
+            buffer += text_decoder.decode(b'', final=True)
+            exhausted = True
+            return True
+        return False
+
+    # "events": [ の直後まで読み進める
+    while True:
+        key = buffer.find('"events"')
+        bracket = buffer.find('[', key) if key >= 0 else -1
+        if bracket >= 0:
+            pos = bracket + 1
+            break
+        if not more():
+            return
+
+    while True:
+        # 要素間の空白・カンマを飛ばす
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buffer) or not more():
+                break
+        if pos >= len(buffer) or buffer[pos] == ']':
+            return
+
+        try:
+            event, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # 要素の途中でチャンクが切れている
+            if not more():
+                raise
+            continue
+
+        segs = event.get('segs') if isinstance(event, dict) else None
+        if not segs:
+            continue
+        text = html.unescape(''.join(seg.get('utf8', '') for seg in segs)).replace('\n', ' ').strip()
+        if text:
+            yield _segment(text, event.get('tStartMs', 0) / 1000, event.get('dDurationMs', 0) / 1000)
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """先頭のバイト列から形式を推定する"""
+    head = head.lstrip(b'\xef\xbb\xbf \t\r\n')
+    if head.startswith(b'WEBVTT'):
+        return 'vtt'
+    if head.startswith(b'<'):
+        return 'srv3'
+    if head.startswith(b'{'):
+        return 'json3'
+    return None
+
+
+def iter_segments(chunks: Iterable[bytes], fmt: str = None) -> Iterator[dict]:
+    """
+    字幕ファイルのチャンク列から字幕セグメントを順に返す。
+    fmt（yt-dlp の ext: vtt / srv1〜3 / json3）が不明なら先頭のチャンクから推定する。
+    """
+    chunks = iter(chunks)
+    if fmt not in SUBTITLE_FORMATS and not (fmt or '').startswith('srv'):
+        # 判定に足りるだけ先頭を読む
+        head = b''
+        for chunk in chunks:
+            head += chunk
+            if len(head.lstrip(b'\xef\xbb\xbf \t\r\n')) >= len(b'WEBVTT'):
+                break
+        fmt = sniff_format(head)
+        if fmt is None:
+            raise ValueError("字幕の形式を判定できません")
+        chunks = _prepend(head, chunks)
+
+    if fmt == 'vtt':
+        return iter_vtt_segments(_iter_lines(chunks))
+    if fmt == 'json3':
+        return iter_json3_segments(chunks)
+    return iter_srv_segments(chunks)
+
+
+def _prepend(first: bytes, rest: Iterator[bytes]) -> Iterator[bytes]:
+    yield first
+    yield from rest
@@ -0,0 +1,165 @@
+"""
+字幕密度判定用の複数語マッチャー。
+
+COSME_TERMS のような語彙について、各語の出現位置を字幕の全文から1回の走査で求める
+（Aho-Corasick オートマトン。失敗遷移を畳み込んだ DFA にしてあるので、1文字あたり辞書引き1〜2回）。
+数え方は語ごとの str.count の合計と同じ（同じ語の出現は重ならないものだけ数え、
+「ツヤ」と「ツヤ肌」のように別の語同士の重なりはそれぞれ数える）。
+
+語数が少ないうちは、語ごとの str.find（C 実装）で位置を集める方が速いので、
+AUTOMATON_MIN_TERMS 語未満では自動的にそちらを使う（結果は同じ）。
+ブランド名などで語彙が増えても、走査は1回のまま。bench_term_matcher.py で比較できる。
+
+出現位置が分かるので、全体の密度だけでなく、時間枠ごとの密度（長い動画のうち
+コスメを紹介している区間）も求められる。密度の分母はどちらも、区間を区切りの空白でつないだ
+字幕の文字数（全体なら CompactTranscript.text の長さ）で、term_density で計算する。
+"""
+from bisect import bisect_right
+from collections import deque
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+from services.transcript import CompactTranscript
+
+# これ以上の語数ならオートマトンで走査する（bench_term_matcher.py で計測した分岐点）
+AUTOMATON_MIN_TERMS = 256
+
+
+class WindowDensity(NamedTuple):
+    start: float        # 時間枠の開始（秒）
+    end: float          # 時間枠の終了（秒）
+    hits: int           # 語の出現数
+    chars: int          # 時間枠内の字幕の文字数（区間の間の区切りを含む。全体の密度と同じ数え方）
+    density: float      # hits / chars * 100（%）
+
+
+def term_density(hits: int, chars: int) -> float:
+    """出現数 / 文字数 * 100（%）。字幕全体の密度と時間枠ごとの密度で共通"""
+    return hits / chars * 100 if chars else 0.0
+
+
+class TermMatcher:
+    """語彙を事前にコンパイルしたマッチャー（スレッドセーフ。作成後は読み取りのみ）"""
+
+    def __init__(self, terms: Sequence[str], min_automaton_terms: int = AUTOMATON_MIN_TERMS):
+        self.terms: List[str] = list(dict.fromkeys(t for t in terms if t))
+        self._lengths = [len(t) for t in self.terms]
+        self.use_automaton = len(self.terms) >= min_automaton_terms
+        if self.use_automaton:
+            self._root, self._delta, self._outputs = self._compile(self.terms)
+
+    @staticmethod
+    def _compile(terms: List[str]) -> Tuple[Dict[str, int], List[Dict[str, int]], List[Tuple[int, ...]]]:
+        """
+        語のトライに失敗遷移を張り、失敗遷移をたどった先の遷移まで展開した DFA を作る。
+        状態 0（根）の遷移は全状態に共通なので各状態には持たせず、
+        状態ごとの表に文字がなければ根の表を引く（1文字あたり辞書引き1〜2回）。
+        """
+        goto: List[Dict[str, int]] = [{}]
+        outputs: List[Tuple[int, ...]] = [()]
+        for index, term in enumerate(terms):
+            state = 0
+            for ch in term:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    goto.append({})
+                    outputs.append(())
+                    nxt = len(goto) - 1
+                    goto[state][ch] = nxt
+                state = nxt
+            outputs[state] += (index,)
+
+        # 幅優先で失敗遷移を求めながら遷移を展開する（失敗先は必ず浅いので展開済み）
+        root = goto[0]
+        delta: List[Dict[str, int]] = [{} for _ in goto]
+        fail = [0] * len(goto)
+        queue = deque(root.values())
+        while queue:
+            state = queue.popleft()
+            delta[state] = dict(delta[fail[state]])
+            delta[state].update(goto[state])
+            outputs[state] += outputs[fail[state]]
+            for ch, nxt in goto[state].items():
+                fail[nxt] = delta[fail[state]].get(ch) or root.get(ch, 0)
+                queue.append(nxt)
+        return root, delta, outputs
+
+    def matches(self, text: str) -> List[Tuple[int, int]]:
+        """(開始位置, 語の番号) の一覧（並び順は不定。同じ語の重なる出現は str.count と同じく先のものだけ）"""
+        if not self.use_automaton:
+            return self._scan(text)
+
+        root_get, delta, outputs, lengths = self._root.get, self._delta, self._outputs, self._lengths
+        last_end = [0] * len(self.terms)
+        found = []
+        state = 0
+        for end, ch in enumerate(text, 1):
+            state = delta[state].get(ch) or root_get(ch, 0)
+            if outputs[state]:
+                for index in outputs[state]:
+                    start = end - lengths[index]
+                    if start >= last_end[index]:
+                        last_end[index] = end
+                        found.append((start, index))
+        return found
+
+    def _scan(self, text: str) -> List[Tuple[int, int]]:
+        """語ごとに str.find で位置を集める（語数が少ないとき用。開始位置順に並べて返す）"""
+        found = []
+        for index, term in enumerate(self.terms):
+            pos = text.find(term)
+            while pos >= 0:
+                found.append((pos, index))
+                pos = text.find(term, pos + len(term))
+        found.sort()
+        return found
+
+    def count(self, text: str) -> int:
+        """全語の出現数の合計（sum(text.count(t) for t in terms) と同じ）"""
+        if not self.use_automaton:
+            return sum(text.count(term) for term in self.terms)
+        return len(self.matches(text))
+
+    def counts(self, text: str) -> Dict[str, int]:
+        """語ごとの出現数（出現したものだけ）"""
+        result: Dict[str, int] = {}
+        for _, index in self.matches(text):
+            term = self.terms[index]
+            result[term] = result.get(term, 0) + 1
+        return result
+
+    def window_density(self, transcript: CompactTranscript, window_seconds: float) -> List[WindowDensity]:
+        """
+        字幕を window_seconds 秒ごとの時間枠に分け、枠ごとの出現数と密度を返す（字幕のない枠は含めない）。
+        区間（CompactTranscript の1区間）は開始時刻の属する枠に数える。
+        """
+        if not transcript or window_seconds <= 0:
+            return []
+
+        offsets = transcript.offsets
+        buckets: Dict[int, List[int]] = {}     # 枠番号 → [出現数, 文字数, 最初の区間, 最後の区間]
+        segment_bucket = []
+        for i in range(len(transcript)):
+            bucket = int(transcript.starts[i] // window_seconds)
+            segment_bucket.append(bucket)
+            entry = buckets.setdefault(bucket, [0, 0, i, i])
+            # 区間の本文 + 後ろの区切り1文字（枠の最後の区切りは後で引く）
+            entry[1] += offsets[i + 1] - offsets[i]
+            entry[3] = i
+
+        for start, _ in self.matches(transcript.text):
+            segment = bisect_right(offsets, start) - 1
+            if 0 <= segment < len(segment_bucket):
+                buckets[segment_bucket[segment]][0] += 1
+
+        windows = []
+        for bucket in sorted(buckets):
+            hits, chars, first, last = buckets[bucket]
+            chars -= 1
+            windows.append(WindowDensity(
+                start=transcript.starts[first],
+                end=transcript.starts[last] + transcript.durations[last],
+                hits=hits,
+                chars=chars,
+                density=term_density(hits, chars),
+            ))
+        return windows
@@ -0,0 +1,64 @@
+"""
+Gemini に送る前のプロンプトのトークン数見積もり。
+
+レートリミッター（TPM）の事前予約と、字幕区間・概要欄の切り詰めに使う。
+文字数をそのままトークン数とみなすと、英数字（URL・型番・英語の概要欄）の多いプロンプトを
+数倍に見積もってしまうため、文字種ごとに換算する:
+  - ひらがな・カタカナ・漢字: 1文字 GEMINI_TOKENS_PER_CJK_CHAR トークン（既定 1.0 = 安全側）
+  - 英数字の連続: 4文字で1トークン
+  - 記号・絵文字など: 1文字1トークン
+  - 空白・改行: 数えない
+実際の消費量は使用量台帳（services/gemini_usage.py）に見積もりと並べて記録されるので、
+gemini-usage の「見積/実績」を見て GEMINI_TOKENS_PER_CJK_CHAR を調整する。
+"""
+import math
+import os
+import re
+
+TOKENS_PER_CJK_CHAR = float(os.getenv("GEMINI_TOKENS_PER_CJK_CHAR", "1.0"))
+CHARS_PER_ASCII_TOKEN = 4
+
+_RUN = re.compile(
+    r'(?P<ascii>[A-Za-z0-9]+)'
+    r'|(?P<space>\s+)'
+    r'|(?P<cjk>[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff66-\uff9f]+)'  # かな・漢字・半角カナ
+    r'|(?P<other>.)',
+    re.S,
+)
+
+
+def _run_tokens(kind: str, length: int) -> float:
+    if kind == 'ascii':
+        return length / CHARS_PER_ASCII_TOKEN
+    if kind == 'cjk':
+        return length * TOKENS_PER_CJK_CHAR
+    if kind == 'space':
+        return 0.0
+    return float(length)
+
+
+def estimate_tokens(text: str) -> int:
+    """text のトークン数の見積もり"""
+    if not text:
+        return 0
+    total = 0.0
+    for match in _RUN.finditer(text):
+        total += _run_tokens(match.lastgroup, match.end() - match.start())
+    return math.ceil(total)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """見積もりが max_tokens に収まるように text の末尾を切る（収まっていればそのまま返す）"""
+    if not text:
+        return text
+    total = 0.0
+    for match in _RUN.finditer(text):
+        kind = match.lastgroup
+        length = match.end() - match.start()
+        tokens = _run_tokens(kind, length)
+        if total + tokens > max_tokens:
+            # この連続の途中で切る
+            per_char = tokens / length
+            return text[:match.start() + int((max_tokens - total) / per_char)]
+        total += tokens
+    return text
@@ -0,0 +1,218 @@
+"""
+字幕の正規化とコンパクトな保持形式。
+
+YouTube の自動字幕は、前のキューの行を次のキューでも繰り返す「ロールアップ」形式なので、
+取得した字幕をそのまま並べると実際の発話の 2〜3 倍の長さになる。ここでは
+  1. ロールアップ形式の字幕（自動字幕、またはキューの表示時間が次のキューと重なっているもの）に限り、
+     直前のキューと重なる行（前のキューの末尾と一致する先頭の行）を取り除き、
+  2. 残ったキューを TRANSCRIPT_WINDOW_SECONDS 秒ごとの時間枠にまとめて、
+  3. 開始・長さの並列配列と、全テキストを1本につないだ文字列 + 各区間の開始位置 として保持する。
+字幕密度判定は text をそのまま数え、AI 分類のサンプルやプロンプトは text の切り出しで作るので、
+使うたびに ' '.join(...) で文字列を作り直さない。
+
+設定（環境変数）:
+  TRANSCRIPT_WINDOW_SECONDS  キューをまとめる時間枠の長さ（既定 10）
+"""
+import json
+import os
+from array import array
+from bisect import bisect_right
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+TRANSCRIPT_WINDOW_SECONDS = float(os.getenv("TRANSCRIPT_WINDOW_SECONDS", "10"))
+
+# AI 分類に渡すサンプルの長さ（文字数）
+TRANSCRIPT_SAMPLE_CHARS = 1500
+
+# 区間同士の区切り文字（text 内で各区間の間に1文字入る）
+_SEPARATOR = ' '
+
+# 表示時間が次のキューと重なっているキューがこの割合以上なら、ロールアップ形式とみなす
+ROLLING_OVERLAP_RATIO = 0.5
+
+
+class TranscriptSegment(NamedTuple):
+    start: float
+    duration: float
+    text: str
+
+
+def _overlap(previous: str, current: str) -> int:
+    """
+    previous の末尾と current の先頭が重なる長さ（行＝空白区切りの単位でのみ一致とみなす）。
+    ロールアップ字幕では、前のキューの最終行が次のキューの先頭行として繰り返される。
+    """
+    for k in range(min(len(previous), len(current)), 0, -1):
+        if k < len(current) and current[k] != _SEPARATOR:
+            continue
+        if k < len(previous) and previous[-k - 1] != _SEPARATOR:
+            continue
+        if previous.endswith(current[:k]):
+            return k
+    return 0
+
+
+def is_rolling(segments: List[Dict[str, Any]]) -> bool:
+    """
+    ロールアップ形式の字幕かどうか（キューの表示時間が次のキューの開始と重なっているものが多い）。
+    手動字幕のキューは順に切り替わるので重ならない。
+    """
+    overlapping = pairs = 0
+    for previous, current in zip(segments, segments[1:]):
+        pairs += 1
+        end = float(previous.get('start', 0)) + float(previous.get('duration', 0))
+        if float(current.get('start', 0)) < end - 0.05:
+            overlapping += 1
+    return pairs > 0 and overlapping >= pairs * ROLLING_OVERLAP_RATIO
+
+
+def collapse_rolling(segments: Iterable[Dict[str, Any]], rolling: bool = True) -> Iterator[TranscriptSegment]:
+    """
+    空白を正規化したキューを順に返す。
+    rolling なら、ロールアップで繰り返された行を取り除く（新しく話された部分だけ）。
+    そうでなければ、本文に同じ語が続いていてもそのまま残す。
+    """
+    previous = ''
+    for segment in segments:
+        text = ' '.join((segment.get('text') or '').split())
+        if not text:
+            continue
+        if rolling:
+            k = _overlap(previous, text)
+            previous = text
+            text = text[k:].strip()
+        if text:
+            yield TranscriptSegment(float(segment.get('start', 0)), float(segment.get('duration', 0)), text)
+
+
+class CompactTranscript:
+    """
+    正規化済みの字幕。
+
+    区間 i は starts[i] 秒から durations[i] 秒の間で、本文は text[offsets[i]:offsets[i + 1] - 1]
+    （区間同士の間には区切りの空白が1文字入る）。
+    """
+
+    __slots__ = ('starts', 'durations', 'offsets', 'text')
+
+    def __init__(self, starts: array, durations: array, offsets: array, text: str):
+        self.starts = starts
+        self.durations = durations
+        self.offsets = offsets      # len(starts) + 1 個。最後は len(text) + 1
+        self.text = text
+
+    @classmethod
+    def from_segments(
+        cls,
+        segments: Iterable[Dict[str, Any]],
+        window_seconds: float = TRANSCRIPT_WINDOW_SECONDS,
+        rolling: Optional[bool] = None,
+    ) -> "CompactTranscript":
+        """
+        {'text', 'start', 'duration'} のキュー列を時間枠ごとにまとめる。
+        rolling（ロールアップ形式の自動字幕か）が True ならキュー間で繰り返された行を除き、False なら除かない。
+        None なら is_rolling で判定する（判定のためにキュー列を一度リストにする。
+        ストリーミングで渡すときは、字幕の種類から True / False を指定する）。
+        """
+        if rolling is None:
+            segments = list(segments)
+            rolling = is_rolling(segments)
+        starts, durations, offsets = array('d'), array('d'), array('I')
+        parts: List[str] = []
+        length = 0
+
+        window = None       # 現在の時間枠の番号
+        window_start = window_end = 0.0
+        window_parts: List[str] = []
+
+        def flush():
+            nonlocal length
+            text = _SEPARATOR.join(window_parts)
+            starts.append(round(window_start, 3))
+            durations.append(round(max(0.0, window_end - window_start), 3))
+            offsets.append(length)
+            parts.append(text)
+            length += len(text) + len(_SEPARATOR)
+
+        for n, segment in enumerate(collapse_rolling(segments, rolling)):
+            # window_seconds <= 0 ならまとめずにキューごとに1区間
+            current = int(segment.start // window_seconds) if window_seconds > 0 else n
+            if window_parts and current != window:
+                flush()
+                window_parts = []
+            if not window_parts:
+                window = current
+                window_start = segment.start
+                window_end = segment.start
+            window_parts.append(segment.text)
+            window_end = max(window_end, segment.start + segment.duration)
+        if window_parts:
+            flush()
+
+        offsets.append(length)
+        return cls(starts, durations, offsets, _SEPARATOR.join(parts))
+
+    @classmethod
+    def from_text(cls, text: str) -> "CompactTranscript":
+        """時刻のない1区間だけの字幕（字幕がないときの代わりの文言など）"""
+        return cls(array('d', [0.0]), array('d', [0.0]), array('I', [0, len(text) + 1]), text)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __bool__(self) -> bool:
+        return len(self.starts) > 0
+
+    def segment_text(self, i: int) -> str:
+        return self.text[self.offsets[i]:self.offsets[i + 1] - 1]
+
+    def __getitem__(self, i: int) -> TranscriptSegment:
+        return TranscriptSegment(self.starts[i], self.durations[i], self.segment_text(i))
+
+    def __iter__(self) -> Iterator[TranscriptSegment]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def end_index(self, max_chars: int, start: int = 0) -> int:
+        """start 番目の区間から、本文が max_chars 文字に収まる最後の区間の次の番号"""
+        limit = self.offsets[start] + max_chars + 1
+        end = start
+        while end < len(self) and self.offsets[end + 1] <= limit:
+            end += 1
+        return end
+
+    def sample(self, max_chars: int = TRANSCRIPT_SAMPLE_CHARS, start: int = 0) -> str:
+        """
+        start 番目の区間から max_chars 文字まで（既定は冒頭から）。
+        区間の途中では切らない（最初の区間が長すぎる場合だけ途中で切る）。
+        """
+        begin = self.offsets[start]
+        end = self.end_index(max_chars, start)
+        if end == start:
+            return self.text[begin:begin + max_chars]
+        return self.text[begin:self.offsets[end] - 1]
+
+    def segment_at(self, seconds: float) -> int:
+        """seconds 秒の時点を含む（その時点より前で最も遅く始まる）区間の番号"""
+        return max(0, bisect_right(self.starts, seconds) - 1)
+
+    def timestamped(self, start: int = 0, end: Optional[int] = None) -> str:
+        """start〜end 番目の区間を「[秒s] 本文」の行にしたもの（プロンプト用）"""
+        end = len(self) if end is None else min(end, len(self))
+        return '\n'.join(f"[{int(self.starts[i])}s] {self.segment_text(i)}" for i in range(start, end))
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'starts': self.starts.tolist(),
+            'durations': self.durations.tolist(),
+            'offsets': self.offsets.tolist(),
+            'text': self.text,
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, data: str) -> "CompactTranscript":
+        """to_json の出力から復元する（旧形式の {'text', 'start', 'duration'} の配列なら正規化し直す）"""
+        obj = json.loads(data)
+        if isinstance(obj, list):
+            return cls.from_segments(obj)
+        return cls(array('d', obj['starts']), array('d', obj['durations']), array('I', obj['offsets']), obj['text'])
@@ -0,0 +1,130 @@
+"""
+字幕の永続キャッシュ。
+
+video_id と言語をキーに、取得済みの字幕を SQLite（backend/.cache/transcripts.db）に保存し、
+プロセス内では LRU で保持する。取得に失敗した動画も「字幕なし」として記録し、
+retry-after を過ぎるまでは再取得しない（yt-dlp フォールバックの繰り返しを防ぐ）。
+保存するのは正規化済みの CompactTranscript（services/transcript.py）。正規化前の
+セグメント配列で保存された古い行は、読み込み時に正規化し直す。
+
+設定（環境変数）:
+  TRANSCRIPT_CACHE_TTL_HOURS          取得済み字幕の有効期間（既定 720 = 30日、0 で無期限）
+  TRANSCRIPT_CACHE_RETRY_AFTER_HOURS  取得失敗を再試行するまでの時間（既定 24）
+  TRANSCRIPT_CACHE_LRU_SIZE           プロセス内 LRU の件数（既定 256）
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from services.sqlite_store import SqliteStore, cache_path
+from services.transcript import CompactTranscript
+
+TRANSCRIPT_CACHE_TTL_HOURS = float(os.getenv("TRANSCRIPT_CACHE_TTL_HOURS", "720"))
+TRANSCRIPT_CACHE_RETRY_AFTER_HOURS = float(os.getenv("TRANSCRIPT_CACHE_RETRY_AFTER_HOURS", "24"))
+TRANSCRIPT_CACHE_LRU_SIZE = int(os.getenv("TRANSCRIPT_CACHE_LRU_SIZE", "256"))
+
+
+class CachedTranscript(NamedTuple):
+    # 正規化済みの字幕（取得失敗として記録されている場合は None）
+    transcript: Optional[CompactTranscript]
+    expires_at: float
+
+
+class TranscriptCache(SqliteStore):
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS transcripts (
+        video_id   TEXT NOT NULL,
+        lang       TEXT NOT NULL,
+        segments   TEXT,            -- CompactTranscript の JSON。NULL は取得失敗（ネガティブキャッシュ）
+        fetched_at REAL NOT NULL,
+        expires_at REAL NOT NULL,   -- 失敗時はこの時刻以降に再試行する
+        PRIMARY KEY (video_id, lang)
+    );
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        ttl_hours: float = TRANSCRIPT_CACHE_TTL_HOURS,
+        retry_after_hours: float = TRANSCRIPT_CACHE_RETRY_AFTER_HOURS,
+        lru_size: int = TRANSCRIPT_CACHE_LRU_SIZE,
+    ):
+        super().__init__(path or cache_path("transcripts.db"))
+        self.ttl_seconds = ttl_hours * 3600
+        self.retry_after_seconds = retry_after_hours * 3600
+        self.lru_size = lru_size
+        self._lru: "OrderedDict[tuple, CachedTranscript]" = OrderedDict()
+        self._lru_lock = threading.Lock()
+
+    def _remember(self, key: tuple, entry: CachedTranscript):
+        with self._lru_lock:
+            self._lru[key] = entry
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def get(self, video_id: str, lang: str) -> Optional[CachedTranscript]:
+        """有効なキャッシュがあれば返す（期限切れ・未登録は None）"""
+        key = (video_id, lang)
+        now = time.time()
+
+        with self._lru_lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                if entry.expires_at > now:
+                    self._lru.move_to_end(key)
+                    return entry
+                del self._lru[key]
+
+        rows = self.execute(
+            "SELECT segments, expires_at FROM transcripts WHERE video_id = ? AND lang = ?",
+            (video_id, lang),
+        )
+        if not rows or rows[0][1] <= now:
+            return None
+
+        segments_json, expires_at = rows[0]
+        transcript = CompactTranscript.from_json(segments_json) if segments_json is not None else None
+        entry = CachedTranscript(transcript, expires_at)
+        self._remember(key, entry)
+        return entry
+
+    def put(self, video_id: str, lang: str, transcript: CompactTranscript):
+        """取得した字幕を保存する"""
+        now = time.time()
+        expires_at = now + self.ttl_seconds if self.ttl_seconds > 0 else float("inf")
+        self._store(video_id, lang, transcript, now, expires_at)
+
+    def put_missing(self, video_id: str, lang: str):
+        """字幕が取得できなかったことを retry-after 付きで記録する"""
+        now = time.time()
+        self._store(video_id, lang, None, now, now + self.retry_after_seconds)
+
+    def _store(
+        self, video_id: str, lang: str, transcript: Optional[CompactTranscript], fetched_at: float, expires_at: float
+    ):
+        self.execute(
+            "INSERT OR REPLACE INTO transcripts (video_id, lang, segments, fetched_at, expires_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (
+                video_id, lang,
+                transcript.to_json() if transcript is not None else None,
+                fetched_at, expires_at,
+            ),
+        )
+        self._remember((video_id, lang), CachedTranscript(transcript, expires_at))
+
+
+_shared_cache: Optional[TranscriptCache] = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_transcript_cache() -> TranscriptCache:
+    """プロセス内で共有する TranscriptCache を返す"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = TranscriptCache()
+        return _shared_cache
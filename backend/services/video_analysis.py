@@ -0,0 +1,228 @@
+"""
+字幕を区間に分けて商品を抽出する（analyze_video の map-reduce）。
+
+1本の動画の字幕全体を1プロンプトに入れると TPM を使い切るため、
+  1. 概要欄だけで商品リストを作る（従来どおりの1回）
+  2. 正規化済みの字幕（CompactTranscript）を、1区間あたり GEMINI_ANALYSIS_WINDOW_TOKENS に
+     収まるように先頭から区切る。区切りは区間の後半にある商品の言及（概要欄の商品名・ブランド名）の
+     直前に寄せ、言及とそれに続く感想が同じ区間に入るようにする
+  3. 1動画あたりの上限（区間数・推定トークン数）を超える場合は、言及の多い区間を優先して残す
+  4. 区間ごとの抽出結果を概要欄の商品リストに統合する（タイムスタンプは最初の言及、
+     sentiment は言及の多数決）
+ここには API 呼び出しを置かず、GeminiService から呼ぶ純粋な関数だけを置く。
+
+設定（環境変数）:
+  GEMINI_ANALYSIS_MODE                   chunked（既定）/ description（字幕を使わず概要欄のみ）
+  GEMINI_ANALYSIS_WINDOW_TOKENS          1区間の字幕の推定トークン数の上限（既定 6000）
+  GEMINI_ANALYSIS_MAX_WINDOWS            1動画あたりに送る区間数の上限（既定 4）
+  GEMINI_ANALYSIS_MAX_TOKENS_PER_VIDEO   1動画あたりの区間プロンプトの推定トークン数の上限（既定 30000）
+"""
+import logging
+import os
+import re
+import unicodedata
+from collections import Counter
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from services.product_matcher import normalize_name
+from services.token_estimator import estimate_tokens
+from services.transcript import CompactTranscript
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_MODE = os.getenv("GEMINI_ANALYSIS_MODE", "chunked")
+ANALYSIS_WINDOW_TOKENS = int(os.getenv("GEMINI_ANALYSIS_WINDOW_TOKENS", "6000"))
+ANALYSIS_MAX_WINDOWS = int(os.getenv("GEMINI_ANALYSIS_MAX_WINDOWS", "4"))
+ANALYSIS_MAX_TOKENS_PER_VIDEO = int(os.getenv("GEMINI_ANALYSIS_MAX_TOKENS_PER_VIDEO", "30000"))
+
+# 区切りを言及の直前に寄せるとき、区間に最低限残す量（区間の予算に対する割合）
+MIN_WINDOW_FILL = 0.5
+# 言及の検出に使う語の最短文字数（短すぎる語は無関係な箇所に一致する）
+MIN_HINT_CHARS = 3
+# 名寄せで部分一致を許す最短文字数
+MIN_CONTAINMENT_CHARS = 4
+
+SENTIMENTS = ('positive', 'negative', 'neutral')
+
+
+class AnalysisWindow(NamedTuple):
+    start: int          # 区間（CompactTranscript の区間番号）の先頭
+    end: int            # 末尾の次
+    tokens: int         # 字幕部分の推定トークン数
+    mentions: int       # 商品の言及を含む区間の数
+
+
+def _fold(text: str) -> str:
+    """言及検出用の正規化（NFKC・小文字・空白除去）"""
+    return re.sub(r'\s+', '', unicodedata.normalize('NFKC', text)).lower()
+
+
+def mention_hints(products: Sequence[Dict[str, Any]]) -> List[str]:
+    """概要欄の商品リストから、字幕中の言及の検出に使う語（ブランド名・商品名の各語）"""
+    hints = set()
+    for product in products:
+        for field in ('brand_name', 'product_name'):
+            value = product.get(field)
+            if not isinstance(value, str):
+                continue
+            hints.add(_fold(value))
+            for word in value.split():
+                word = _fold(word)
+                if not word.isdigit():
+                    hints.add(word)
+    return sorted(h for h in hints if len(h) >= MIN_HINT_CHARS)
+
+
+def _line(transcript: CompactTranscript, i: int) -> str:
+    return f"[{int(transcript.starts[i])}s] {transcript.segment_text(i)}\n"
+
+
+def plan_windows(
+    transcript: CompactTranscript,
+    hints: Sequence[str],
+    window_tokens: int = ANALYSIS_WINDOW_TOKENS,
+    count_tokens: Callable[[str], int] = estimate_tokens,
+) -> List[AnalysisWindow]:
+    """字幕全体を、1区間の推定トークン数が window_tokens に収まる区間に先頭から区切る"""
+    n = len(transcript)
+    costs = [count_tokens(_line(transcript, i)) for i in range(n)]
+    mentioned = [any(h in _fold(transcript.segment_text(i)) for h in hints) for i in range(n)] if hints else [False] * n
+
+    windows = []
+    start = 0
+    while start < n:
+        end, tokens = start, 0
+        while end < n and (end == start or tokens + costs[end] <= window_tokens):
+            tokens += costs[end]
+            end += 1
+
+        if end < n:
+            # 区間の後半に言及があれば、その直前で切って言及を次の区間の先頭にする
+            filled = tokens
+            for cut in range(end - 1, start, -1):
+                filled -= costs[cut]
+                if filled < window_tokens * MIN_WINDOW_FILL:
+                    break
+                if mentioned[cut] and not mentioned[cut - 1]:
+                    end, tokens = cut, filled
+                    break
+
+        windows.append(AnalysisWindow(start, end, tokens, sum(mentioned[start:end])))
+        start = end
+    return windows
+
+
+def select_windows(
+    windows: List[AnalysisWindow],
+    overhead_tokens: int = 0,
+    max_windows: int = ANALYSIS_MAX_WINDOWS,
+    max_tokens: int = ANALYSIS_MAX_TOKENS_PER_VIDEO,
+) -> List[AnalysisWindow]:
+    """
+    1動画あたりの上限に収まる区間を選ぶ（言及の多い区間を優先し、時刻順に並べて返す）。
+    overhead_tokens は字幕以外のプロンプト部分の推定トークン数（区間ごとに掛かる）。
+    """
+    selected, total = [], 0
+    for window in sorted(windows, key=lambda w: (-w.mentions, w.start)):
+        if len(selected) >= max_windows:
+            break
+        cost = window.tokens + overhead_tokens
+        if total + cost > max_tokens:
+            continue
+        selected.append(window)
+        total += cost
+    if len(selected) < len(windows):
+        logger.info(f"  字幕 {len(windows)} 区間のうち、1動画あたりの上限内の {len(selected)} 区間だけを解析します")
+    return sorted(selected, key=lambda w: w.start)
+
+
+def window_text(transcript: CompactTranscript, window: AnalysisWindow) -> str:
+    return transcript.timestamped(window.start, window.end)
+
+
+def _valid_items(items: Any) -> List[Dict[str, Any]]:
+    if not isinstance(items, list):
+        return []
+    return [item for item in items if isinstance(item, dict) and isinstance(item.get('product_name'), str) and item['product_name'].strip()]
+
+
+def _same_product(a: str, b: str) -> bool:
+    if a == b:
+        return True
+    if min(len(a), len(b)) < MIN_CONTAINMENT_CHARS:
+        return False
+    return a in b or b in a
+
+
+def _timestamp(item: Dict[str, Any], transcript: CompactTranscript, window: AnalysisWindow) -> int:
+    """回答のタイムスタンプ（区間の外を指していたら区間の先頭に寄せる）"""
+    low = transcript.starts[window.start]
+    last = window.end - 1
+    high = transcript.starts[last] + transcript.durations[last]
+    try:
+        seconds = float(item.get('timestamp_seconds'))
+    except (TypeError, ValueError):
+        return int(low)
+    return int(seconds) if low <= seconds <= high else int(low)
+
+
+def _description_timestamp(item: Dict[str, Any]) -> int:
+    """概要欄の解析で得た時刻（目次の秒数。なければ 0）"""
+    try:
+        return max(0, int(float(item.get('timestamp_seconds') or 0)))
+    except (TypeError, ValueError):
+        return 0
+
+
+def merge_window_results(
+    base: Any,
+    transcript: CompactTranscript,
+    windows: Sequence[AnalysisWindow],
+    window_results: Sequence[Any],
+) -> List[Dict[str, Any]]:
+    """
+    概要欄の商品リスト（base）に区間ごとの抽出結果を統合する。
+
+    - 概要欄の商品は名前・ブランド・カテゴリを概要欄のまま残し、字幕での最初の言及の時刻、
+      言及の多数決の sentiment、最初の言及の summary で上書きする
+    - 概要欄にない商品は区間の回答をそのまま加える（同じ商品の複数区間の言及は1件にまとめる）
+    - どの区間でも言及されなかった概要欄の商品は、概要欄の目次の時刻（なければ 0）のまま残す
+    """
+    merged = [dict(item) for item in _valid_items(base)]
+    keys = [normalize_name(item['product_name']) for item in merged]
+    mentions: List[List[Dict[str, Any]]] = [[] for _ in merged]
+
+    for window, items in zip(windows, window_results):
+        for item in _valid_items(items):
+            mention = dict(item, timestamp_seconds=_timestamp(item, transcript, window))
+            key = normalize_name(item['product_name'])
+            index = next((i for i, k in enumerate(keys) if _same_product(k, key)), None)
+            if index is None:
+                merged.append(dict(mention))
+                keys.append(key)
+                mentions.append([])
+                index = len(merged) - 1
+            mentions[index].append(mention)
+
+    for item, found in zip(merged, mentions):
+        if not found:
+            item['timestamp_seconds'] = _description_timestamp(item)
+            continue
+        first = min(found, key=lambda m: m['timestamp_seconds'])
+        item['timestamp_seconds'] = first['timestamp_seconds']
+        votes = Counter(m.get('sentiment') for m in found if m.get('sentiment') in SENTIMENTS)
+        if votes:
+            item['sentiment'] = votes.most_common(1)[0][0]
+        if first.get('summary'):
+            item['summary'] = first['summary']
+    return merged
+
+
+def describe_products(products: Sequence[Dict[str, Any]]) -> Optional[str]:
+    """区間プロンプトに入れる概要欄の商品リスト（なければ None）"""
+    lines = []
+    for product in _valid_items(products):
+        brand = product.get('brand_name') or '不明'
+        category = product.get('category') or '不明'
+        lines.append(f"- {product['product_name']}（ブランド: {brand} / カテゴリ: {category}）")
+    return '\n'.join(lines) or None
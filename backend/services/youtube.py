@@ -2,17 +2,34 @@ from googleapiclient.discovery import build
 from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled, NoTranscriptFound
 import os
 import logging
+from typing import Optional
+from services.scraper import get_scraper
+from services.subtitle_parser import iter_segments
+from services.transcript import CompactTranscript
+from services.transcript_cache import TranscriptCache, get_transcript_cache
+from services.youtube_quota import QuotaAwareClient, QuotaExceededError, YouTubeApiStore
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY")
 
+# 字幕の取得言語（キャッシュのキーにも使う）
+TRANSCRIPT_LANG = 'ja'
+
+# 字幕ファイルを受信・解析する単位
+SUBTITLE_CHUNK_BYTES = 64 * 1024
+
+# videos.list に1回で渡せる動画IDの上限（クォータ消費は件数によらず1回分）
+VIDEOS_LIST_MAX_IDS = 50
+
 class YouTubeService:
-    def __init__(self):
+    def __init__(self, transcript_cache: TranscriptCache = None, api_store: YouTubeApiStore = None):
         if not YOUTUBE_API_KEY:
             logger.warning("YOUTUBE_API_KEY not found in environment variables.")
-        self.youtube = build('youtube', 'v3', developerKey=YOUTUBE_API_KEY)
+        # クォータの計上・予算超過の事前拒否と ETag による条件付きリクエストを行うクライアント
+        self.youtube = QuotaAwareClient(build('youtube', 'v3', developerKey=YOUTUBE_API_KEY), api_store)
+        self.transcript_cache = transcript_cache or get_transcript_cache()
 
     def resolve_channel_id(self, channel_input: str) -> str:
         """
@@ -47,6 +64,8 @@ class YouTubeService:
                 items = response.get('items', [])
                 if items:
                     return items[0]['id']
+            except QuotaExceededError:
+                raise
             except Exception as e:
                 logger.warning(f"ハンドル解決エラー ({handle}): {e}")
                 # フォールバック: search API で検索
@@ -61,6 +80,8 @@ class YouTubeService:
                     items = response.get('items', [])
                     if items:
                         return items[0]['snippet']['channelId']
+                except QuotaExceededError:
+                    raise
                 except Exception as e2:
                     logger.error(f"チャンネル検索エラー: {e2}")
             return None
@@ -84,12 +105,73 @@ class YouTubeService:
                 items = response.get('items', [])
                 if items:
                     return items[0]['snippet']['channelId']
+            except QuotaExceededError:
+                raise
             except Exception as e:
                 logger.error(f"チャンネル名解決エラー: {e}")
 
         logger.error(f"チャンネルIDを解決できません: {channel_input}")
         return None
 
+    def get_uploads_playlist_id(self, channel_id: str):
+        """チャンネルの uploads プレイリストIDを返す（見つからなければ None）"""
+        ch_request = self.youtube.channels().list(
+            part="contentDetails",
+            id=channel_id
+        )
+        ch_response = ch_request.execute()
+        items = ch_response.get('items', [])
+        if not items:
+            logger.error(f"チャンネルが見つかりません: {channel_id}")
+            return None
+        return items[0]['contentDetails']['relatedPlaylists']['uploads']
+
+    def get_playlist_videos(
+        self,
+        playlist_id: str,
+        max_results: int = 50,
+        stop_at_video_id: str = None,
+        published_after: str = None,
+    ) -> list:
+        """
+        プレイリストの動画を新しい順に取得する。
+
+        stop_at_video_id（前回までに処理した最新の動画）に達するか、
+        published_after（その公開日時、ISO 8601）より古い動画が現れた時点でページングを止める。
+        日次の差分同期なら1〜2ページ（API 1〜2回）で済む。
+        """
+        videos = []
+        next_page_token = None
+
+        while len(videos) < max_results:
+            pl_request = self.youtube.playlistItems().list(
+                part="snippet",
+                playlistId=playlist_id,
+                maxResults=min(50, max_results - len(videos)),
+                pageToken=next_page_token
+            )
+            pl_response = pl_request.execute()
+
+            for item in pl_response.get('items', []):
+                video_id = item['snippet']['resourceId']['videoId']
+                published_at = item['snippet']['publishedAt']
+                if video_id == stop_at_video_id or (published_after and published_at < published_after):
+                    return videos
+                videos.append({
+                    'video_id': video_id,
+                    'title': item['snippet']['title'],
+                    'description': item['snippet'].get('description', ''),
+                    'channel_name': item['snippet']['channelTitle'],
+                    'published_at': published_at,
+                    'thumbnail_url': item['snippet']['thumbnails'].get('high', {}).get('url', ''),
+                })
+
+            next_page_token = pl_response.get('nextPageToken')
+            if not next_page_token:
+                break
+
+        return videos
+
     def get_channel_videos(self, channel_id: str, max_results: int = 50) -> list:
         """
         チャンネルの動画一覧を取得する。
@@ -100,49 +182,17 @@ class YouTubeService:
         """
         try:
             # チャンネルの uploads プレイリストIDを取得
-            ch_request = self.youtube.channels().list(
-                part="contentDetails",
-                id=channel_id
-            )
-            ch_response = ch_request.execute()
-            items = ch_response.get('items', [])
-            if not items:
-                logger.error(f"チャンネルが見つかりません: {channel_id}")
+            uploads_playlist_id = self.get_uploads_playlist_id(channel_id)
+            if not uploads_playlist_id:
                 return []
-            
-            uploads_playlist_id = items[0]['contentDetails']['relatedPlaylists']['uploads']
-            
+
             # プレイリストから動画を取得
-            videos = []
-            next_page_token = None
-            
-            while len(videos) < max_results:
-                pl_request = self.youtube.playlistItems().list(
-                    part="snippet",
-                    playlistId=uploads_playlist_id,
-                    maxResults=min(50, max_results - len(videos)),
-                    pageToken=next_page_token
-                )
-                pl_response = pl_request.execute()
-                
-                for item in pl_response.get('items', []):
-                    video_id = item['snippet']['resourceId']['videoId']
-                    videos.append({
-                        'video_id': video_id,
-                        'title': item['snippet']['title'],
-                        'description': item['snippet'].get('description', ''),
-                        'channel_name': item['snippet']['channelTitle'],
-                        'published_at': item['snippet']['publishedAt'],
-                        'thumbnail_url': item['snippet']['thumbnails'].get('high', {}).get('url', ''),
-                    })
-                
-                next_page_token = pl_response.get('nextPageToken')
-                if not next_page_token:
-                    break
-            
+            videos = self.get_playlist_videos(uploads_playlist_id, max_results=max_results)
             logger.info(f"チャンネル {channel_id} から {len(videos)} 本の動画を取得")
             return videos
             
+        except QuotaExceededError:
+            raise
         except Exception as e:
             logger.error(f"チャンネル動画取得エラー: {e}")
             return []
@@ -163,6 +213,8 @@ class YouTubeService:
             )
             response = request.execute()
             return response.get('items', [])
+        except QuotaExceededError:
+            raise
         except Exception as e:
             logger.error(f"Error searching videos: {e}")
             return []
@@ -171,46 +223,94 @@ class YouTubeService:
         """
         Get detailed information for a specific video.
         """
-        try:
-            request = self.youtube.videos().list(
-                part="snippet,contentDetails,statistics",
-                id=video_id
-            )
-            response = request.execute()
-            items = response.get('items', [])
-            if items:
-                return items[0]
-            return None
-        except Exception as e:
-            logger.error(f"Error getting video details: {e}")
-            return None
+        return self.get_videos_details([video_id]).get(video_id)
+
+    def get_videos_details(self, video_ids: list, part: str = "snippet,contentDetails,statistics") -> dict:
+        """
+        複数の動画の詳細を VIDEOS_LIST_MAX_IDS 件ずつまとめて取得する（1,000本なら20回の呼び出し）。
+
+        Returns:
+            dict: {動画ID: videos.list の item}。非公開・削除済み・存在しない動画と、
+                  取得エラーになった分は含まれない（ログに件数と ID を出す）
+        """
+        video_ids = list(dict.fromkeys(video_ids))
+        details = {}
+        failed = []
+        for i in range(0, len(video_ids), VIDEOS_LIST_MAX_IDS):
+            chunk = video_ids[i:i + VIDEOS_LIST_MAX_IDS]
+            try:
+                response = self.youtube.videos().list(part=part, id=','.join(chunk)).execute()
+            except QuotaExceededError as e:
+                # 予算切れ以降は送信しない（取得済みの分だけ返す）
+                logger.error(str(e))
+                failed.extend(video_ids[i:])
+                break
+            except Exception as e:
+                logger.error(f"Error getting video details ({len(chunk)} videos): {e}")
+                failed.extend(chunk)
+                continue
+            for item in response.get('items', []):
+                details[item['id']] = item
+
+        missing = [v for v in video_ids if v not in details and v not in failed]
+        if missing:
+            logger.warning(f"非公開・削除済み・存在しない動画: {len(missing)} 本 ({', '.join(missing)})")
+        if failed:
+            logger.warning(f"取得エラーで詳細を取得できなかった動画: {len(failed)} 本")
+        return details
 
-    def get_transcript(self, video_id: str):
+    def get_transcript(self, video_id: str) -> Optional[CompactTranscript]:
         """
-        Get the transcript for a video using youtube-transcript-api.
-        Returns a list of dicts with 'text', 'start', 'duration'.
+        Get the transcript for a video, using the on-disk transcript cache.
+        Returns a CompactTranscript (rolling auto-caption duplicates removed, cues merged
+        into fixed time windows), or None.
+        """
+        cached = self.transcript_cache.get(video_id, TRANSCRIPT_LANG)
+        if cached is not None:
+            if cached.transcript is None:
+                logger.info(f"字幕キャッシュ: {video_id} は取得失敗として記録済み（再試行待ち）")
+            return cached.transcript
+
+        transcript = self._fetch_transcript(video_id)
+        if transcript:
+            self.transcript_cache.put(video_id, TRANSCRIPT_LANG, transcript)
+        else:
+            self.transcript_cache.put_missing(video_id, TRANSCRIPT_LANG)
+            transcript = None
+        return transcript
+
+    def _fetch_transcript(self, video_id: str) -> Optional[CompactTranscript]:
+        """
+        Get the transcript for a video using youtube-transcript-api
+        (falls back to yt-dlp). Returns a CompactTranscript or None.
         """
         try:
             transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
             # Filter for Japanese or auto-generated Japanese
             try:
-                transcript = transcript_list.find_transcript(['ja'])
+                transcript = transcript_list.find_transcript([TRANSCRIPT_LANG])
             except NoTranscriptFound:
-                transcript = transcript_list.find_generated_transcript(['ja'])
+                transcript = transcript_list.find_generated_transcript([TRANSCRIPT_LANG])
             
-            return transcript.fetch()
+            segments = transcript.fetch()
+            if hasattr(segments, 'to_raw_data'):
+                # 新しい youtube-transcript-api はオブジェクトを返すので dict のリストに揃える
+                segments = segments.to_raw_data()
+            # 手動字幕はロールアップしないので重複除去をしない（自動字幕はキューの重なりから判定する）
+            return CompactTranscript.from_segments(
+                ({'text': s['text'], 'start': s['start'], 'duration': s.get('duration', 0)} for s in segments),
+                rolling=None if transcript.is_generated else False,
+            )
         except Exception as e:
             logger.warning(f"Standard transcript fetch failed for {video_id}: {e}. Trying manual fallback.")
             return self._get_transcript_manual(video_id)
 
-    def _get_transcript_manual(self, video_id: str):
+    def _get_transcript_manual(self, video_id: str) -> Optional[CompactTranscript]:
         """
         Fallback method to get transcript using yt-dlp.
         """
         try:
             from yt_dlp import YoutubeDL
-            import requests
-            import re
             
             logger.info(f"Attempting yt-dlp fetch for {video_id}...")
             
@@ -218,7 +318,7 @@ class YouTubeService:
                 'skip_download': True,
                 'writesubtitles': True,
                 'writeautomaticsub': True,
-                'subtitleslangs': ['ja'],
+                'subtitleslangs': [TRANSCRIPT_LANG],
                 'quiet': True,
             }
             
@@ -231,7 +331,7 @@ class YouTubeService:
                     logger.warning(f"No subtitles found via yt-dlp for {video_id}")
                     return None
                 
-                ja_sub = subs.get('ja')
+                ja_sub = subs.get(TRANSCRIPT_LANG)
                 if not ja_sub:
                     logger.warning(f"No 'ja' subtitles found via yt-dlp for {video_id}")
                     return None
@@ -240,64 +340,19 @@ class YouTubeService:
                 if not url:
                     return None
                     
-                # Fetch content (it's usually VTT or SRV/XML)
-                res = requests.get(url)
+            # yt-dlp は手動字幕があればそちらを選ぶ。なければ自動字幕（ロールアップ形式）
+            rolling = TRANSCRIPT_LANG not in (info.get('subtitles') or {})
+
+            # 字幕ファイル（VTT / SRV3 / JSON3）は受信しながら1回の走査で解析し、
+            # セグメントのリストを作らずにそのまま CompactTranscript に詰める
+            with get_scraper().get(url, stream=True) as res:
                 if res.status_code != 200:
                     logger.error(f"Failed to fetch subtitle content from {url}")
                     return None
-                
-                content = res.text
-                
-                # Simple VTT parser to extract text and timestamps
-                # VTT format:
-                # 00:00:00.120 --> 00:00:01.589
-                # Text
-                
-                transcript_data = []
-                
-                # Regex for VTT timestamp line: 00:00:00.000 --> 00:00:00.000
-                time_pattern = re.compile(r'(\d{2}:\d{2}:\d{2}\.\d{3}) --> (\d{2}:\d{2}:\d{2}\.\d{3})')
-                
-                lines = content.splitlines()
-                current_start = 0.0
-                current_duration = 0.0
-                
-                for i, line in enumerate(lines):
-                    match = time_pattern.search(line)
-                    if match:
-                        start_str = match.group(1)
-                        end_str = match.group(2)
-                        
-                        def parse_time(t_str):
-                            h, m, s = t_str.split(':')
-                            return float(h) * 3600 + float(m) * 60 + float(s)
-                            
-                        current_start = parse_time(start_str)
-                        current_duration = parse_time(end_str) - current_start
-                        
-                        # Get text from next lines until empty line or next timestamp
-                        text_parts = []
-                        j = i + 1
-                        while j < len(lines):
-                            next_line = lines[j].strip()
-                            if not next_line:
-                                break
-                            if time_pattern.search(next_line):
-                                break
-                            # Remove VTT tags like <c>...</c>, <00:00:00.000>
-                            clean_line = re.sub(r'<[^>]+>', '', next_line)
-                            if clean_line:
-                                text_parts.append(clean_line)
-                            j += 1
-                        
-                        if text_parts:
-                            transcript_data.append({
-                                'text': " ".join(text_parts),
-                                'start': current_start,
-                                'duration': current_duration
-                            })
-                            
-                return transcript_data
+                return CompactTranscript.from_segments(
+                    iter_segments(res.iter_content(SUBTITLE_CHUNK_BYTES), fmt=ja_sub.get('ext')),
+                    rolling=rolling,
+                )
 
         except Exception as e:
             logger.error(f"yt-dlp fetch failed for {video_id}: {e}")
@@ -0,0 +1,245 @@
+"""
+YouTube Data API のクォータ管理と ETag による条件付きリクエスト。
+
+googleapiclient のクライアントを QuotaAwareClient で包み、呼び出しごとに
+  1. メソッドごとのコスト（search.list は 100、その他の list は 1）を当日の使用量に予約し、
+     1日の予算（YOUTUBE_DAILY_QUOTA）を超える呼び出しは送信前に QuotaExceededError で断る
+  2. 前回のレスポンスの ETag を If-None-Match で送り、304（変更なし）なら保存済みの
+     レスポンスを返す（YOUTUBE_NOT_MODIFIED_COST 以外のコストは返却する）
+  3. サーバーからクォータ超過（403 quotaExceeded）が返ったら、当日の残りを使い切ったものとして記録する
+使用量とレスポンスは SQLite（backend/.cache/youtube_api.db）に保存するので、
+同じマシンの複数プロセスで予算を共有できる。クォータは太平洋時間の0時にリセットされる。
+
+呼び出し側のコードは googleapiclient と同じ書き方のまま使える:
+    client.playlistItems().list(part="snippet", playlistId=...).execute()
+
+設定（環境変数）:
+  YOUTUBE_DAILY_QUOTA           1日に使ってよいクォータ（既定 10000）
+  YOUTUBE_NOT_MODIFIED_COST     304 応答1回あたりに計上するコスト（既定 0）
+  YOUTUBE_ETAG_CACHE_TTL_DAYS   保存したレスポンスを条件付きリクエストに使う期間（既定 30）
+"""
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from googleapiclient.errors import HttpError
+
+from services.sqlite_store import SqliteStore, cache_path
+
+logger = logging.getLogger(__name__)
+
+YOUTUBE_DAILY_QUOTA = int(os.getenv("YOUTUBE_DAILY_QUOTA", "10000"))
+YOUTUBE_NOT_MODIFIED_COST = int(os.getenv("YOUTUBE_NOT_MODIFIED_COST", "0"))
+YOUTUBE_ETAG_CACHE_TTL_DAYS = float(os.getenv("YOUTUBE_ETAG_CACHE_TTL_DAYS", "30"))
+
+# メソッドごとのクォータコスト（https://developers.google.com/youtube/v3/determine_quota_cost）
+QUOTA_COSTS = {
+    'search.list': 100,
+    'channels.list': 1,
+    'playlistItems.list': 1,
+    'videos.list': 1,
+    'commentThreads.list': 1,
+}
+DEFAULT_QUOTA_COST = 1
+
+# クォータは太平洋時間の0時にリセットされる
+QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+
+# サーバー側でクォータ超過と判定されたときの reason
+QUOTA_ERROR_REASONS = ('quotaExceeded', 'dailyLimitExceeded')
+
+
+class QuotaExceededError(Exception):
+    """当日のクォータ予算が足りないため、リクエストを送らずに断った"""
+
+
+def quota_day(now: datetime.datetime = None) -> str:
+    """クォータの集計日（太平洋時間の日付）"""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return now.astimezone(QUOTA_TIMEZONE).date().isoformat()
+
+
+def quota_cost(method: str) -> int:
+    return QUOTA_COSTS.get(method, DEFAULT_QUOTA_COST)
+
+
+class YouTubeApiStore(SqliteStore):
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS quota_usage (
+        day    TEXT NOT NULL,       -- 太平洋時間の日付
+        method TEXT NOT NULL,       -- 例: playlistItems.list
+        units  INTEGER NOT NULL,
+        calls  INTEGER NOT NULL,
+        PRIMARY KEY (day, method)
+    );
+    CREATE TABLE IF NOT EXISTS responses (
+        request_key TEXT PRIMARY KEY,   -- メソッド名 + パラメータ（JSON）
+        etag        TEXT NOT NULL,
+        body        TEXT NOT NULL,      -- レスポンス（JSON）
+        fetched_at  REAL NOT NULL
+    );
+    """
+
+    def __init__(self, path: str = None, daily_quota: int = YOUTUBE_DAILY_QUOTA):
+        super().__init__(path or cache_path("youtube_api.db"))
+        self.daily_quota = daily_quota
+
+    def reserve(self, method: str, units: int) -> bool:
+        """
+        当日の使用量に units を加える。予算を超える場合は加えずに False を返す。
+        確認と加算を1文で行うので、複数プロセスから同時に呼んでも予算を超えない。
+        """
+        day = quota_day()
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO quota_usage (day, method, units, calls) "
+                "SELECT ?, ?, ?, 1 WHERE (SELECT COALESCE(SUM(units), 0) FROM quota_usage WHERE day = ?) + ? <= ? "
+                "ON CONFLICT(day, method) DO UPDATE SET units = units + excluded.units, calls = calls + 1",
+                (day, method, units, day, units, self.daily_quota),
+            )
+            reserved = cur.rowcount > 0
+            self._conn.commit()
+            return reserved
+
+    def refund(self, method: str, units: int):
+        """予約したコストを返す（呼び出し回数はそのまま）"""
+        if units <= 0:
+            return
+        self.execute(
+            "UPDATE quota_usage SET units = MAX(0, units - ?) WHERE day = ? AND method = ?",
+            (units, quota_day(), method),
+        )
+
+    def mark_exhausted(self):
+        """サーバーがクォータ超過を返したので、当日の残りを使い切ったものとして記録する"""
+        day = quota_day()
+        remaining = self.daily_quota - self.used(day)
+        if remaining > 0:
+            self.execute(
+                "INSERT INTO quota_usage (day, method, units, calls) VALUES (?, '(quota exceeded)', ?, 0) "
+                "ON CONFLICT(day, method) DO UPDATE SET units = units + excluded.units",
+                (day, remaining),
+            )
+
+    def used(self, day: str = None) -> int:
+        rows = self.execute("SELECT COALESCE(SUM(units), 0) FROM quota_usage WHERE day = ?", (day or quota_day(),))
+        return rows[0][0]
+
+    def usage(self, day: str = None) -> Dict[str, Tuple[int, int]]:
+        """メソッドごとの (使用量, 呼び出し回数)"""
+        rows = self.execute(
+            "SELECT method, units, calls FROM quota_usage WHERE day = ? ORDER BY units DESC",
+            (day or quota_day(),),
+        )
+        return {method: (units, calls) for method, units, calls in rows}
+
+    def get_response(self, request_key: str) -> Optional[Tuple[str, Any]]:
+        """保存済みの (ETag, レスポンス)。YOUTUBE_ETAG_CACHE_TTL_DAYS より古いものは None"""
+        rows = self.execute(
+            "SELECT etag, body FROM responses WHERE request_key = ? AND fetched_at > ?",
+            (request_key, time.time() - YOUTUBE_ETAG_CACHE_TTL_DAYS * 86400),
+        )
+        if not rows:
+            return None
+        return rows[0][0], json.loads(rows[0][1])
+
+    def put_response(self, request_key: str, etag: str, body: Any):
+        self.execute(
+            "INSERT OR REPLACE INTO responses (request_key, etag, body, fetched_at) VALUES (?, ?, ?, ?)",
+            (request_key, etag, json.dumps(body, ensure_ascii=False), time.time()),
+        )
+
+
+_shared_store: Optional[YouTubeApiStore] = None
+_shared_store_lock = threading.Lock()
+
+
+def get_youtube_api_store() -> YouTubeApiStore:
+    """プロセス内で共有する YouTubeApiStore を返す"""
+    global _shared_store
+    with _shared_store_lock:
+        if _shared_store is None:
+            _shared_store = YouTubeApiStore()
+        return _shared_store
+
+
+def _is_quota_error(error: HttpError) -> bool:
+    if error.resp.status != 403:
+        return False
+    try:
+        reasons = [e.get('reason') for e in json.loads(error.content).get('error', {}).get('errors', [])]
+    except (ValueError, AttributeError):
+        return False
+    return any(reason in QUOTA_ERROR_REASONS for reason in reasons)
+
+
+class _QuotaAwareRequest:
+    def __init__(self, client: "QuotaAwareClient", collection: str, method: str, kwargs: dict):
+        self.client = client
+        self.collection = collection
+        self.method = method
+        self.kwargs = kwargs
+
+    @property
+    def name(self) -> str:
+        return f"{self.collection}.{self.method}"
+
+    def execute(self, **execute_kwargs):
+        store = self.client.store
+        cost = quota_cost(self.name)
+        if not store.reserve(self.name, cost):
+            raise QuotaExceededError(
+                f"YouTube API のクォータ予算が残っていません（{self.name}: コスト {cost}、"
+                f"本日の使用量 {store.used()}/{store.daily_quota}）"
+            )
+
+        request_key = self.name + json.dumps(self.kwargs, sort_keys=True, ensure_ascii=False)
+        cached = store.get_response(request_key)
+        request = getattr(getattr(self.client.resource, self.collection)(), self.method)(**self.kwargs)
+        if cached:
+            request.headers['If-None-Match'] = cached[0]
+
+        try:
+            response = request.execute(**execute_kwargs)
+        except HttpError as e:
+            if e.resp.status == 304 and cached:
+                store.refund(self.name, cost - YOUTUBE_NOT_MODIFIED_COST)
+                self.client.not_modified += 1
+                return cached[1]
+            if _is_quota_error(e):
+                logger.error(f"YouTube API のクォータ超過が返されました。本日の残りのリクエストは送信しません: {self.name}")
+                store.mark_exhausted()
+            raise
+
+        etag = response.get('etag') if isinstance(response, dict) else None
+        if etag:
+            store.put_response(request_key, etag, response)
+        return response
+
+
+class _QuotaAwareCollection:
+    def __init__(self, client: "QuotaAwareClient", collection: str):
+        self.client = client
+        self.collection = collection
+
+    def __getattr__(self, method: str):
+        def build_request(**kwargs) -> _QuotaAwareRequest:
+            return _QuotaAwareRequest(self.client, self.collection, method, kwargs)
+        return build_request
+
+
+class QuotaAwareClient:
+    """googleapiclient の YouTube リソースを包み、クォータの計上と ETag キャッシュを行う"""
+
+    def __init__(self, resource, store: YouTubeApiStore = None):
+        self.resource = resource
+        self.store = store or get_youtube_api_store()
+        self.not_modified = 0   # このプロセスで 304 により保存済みレスポンスを返した回数
+
+    def __getattr__(self, collection: str):
+        return lambda: _QuotaAwareCollection(self, collection)
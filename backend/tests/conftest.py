@@ -0,0 +1,16 @@
+"""
+テスト共通の設定。
+
+backend/ を import パスに入れ、DB とキャッシュの保存先をテスト用の一時領域に向ける
+（services/ や models を import する前に環境変数を決める必要があるため、ここで設定する）。
+"""
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE_DIR = os.path.join(BACKEND_DIR, "tests", "fixtures")
+
+sys.path.insert(0, BACKEND_DIR)
+os.environ["DATABASE_URL"] = "sqlite://"
+os.environ["CACHE_DIR"] = tempfile.mkdtemp(prefix="youtube-cosme-test-cache-")
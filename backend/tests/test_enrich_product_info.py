@@ -0,0 +1,102 @@
+"""enrich_product_info.py: 1商品ずつの生成で、失敗した呼び出しも使用量台帳に記録する"""
+import importlib
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from services import gemini_usage
+from services.gemini import GeminiResponseCache
+
+NUM_KEYS = 6
+
+
+@pytest.fixture
+def enrich(monkeypatch, tmp_path):
+    # スクリプトは import 時に API キーを読み、モデルを作る（ネットワークには接続しない）
+    for i in range(1, NUM_KEYS + 1):
+        monkeypatch.setenv(f"GEMINI_API_KEY_{i}", f"test-key-{i}")
+    monkeypatch.delenv("GEMINI_API_KEY", raising=False)
+    module = importlib.import_module("enrich_product_info")
+
+    records = []
+    monkeypatch.setattr(module, "usage_ledger", SimpleNamespace(record=records.append))
+    monkeypatch.setattr(module, "response_cache", GeminiResponseCache(str(tmp_path / "responses.db")))
+    monkeypatch.setattr(module.time, "sleep", lambda seconds: None)
+    module.records = records
+    return module
+
+
+class FakeModel:
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+
+    def generate_content(self, prompt):
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return SimpleNamespace(
+            text=json.dumps(outcome, ensure_ascii=False),
+            usage_metadata=SimpleNamespace(prompt_token_count=120, candidates_token_count=80, total_token_count=200),
+        )
+
+
+def _use(enrich, monkeypatch, outcomes):
+    model = FakeModel(outcomes)
+    monkeypatch.setattr(enrich, "model", model)
+    monkeypatch.setattr(enrich, "get_next_model", lambda: model)
+    return model
+
+
+def test_rate_limited_call_is_recorded_before_key_switch(enrich, monkeypatch):
+    _use(enrich, monkeypatch, [Exception("429 Resource has been exhausted"), {'volume': '30ml'}])
+
+    assert enrich.generate_product_details("リップ", "ブランド") == {'volume': '30ml'}
+    assert [(r.status, r.retries) for r in enrich.records] == [
+        (gemini_usage.STATUS_ERROR, 0), (gemini_usage.STATUS_OK, 1),
+    ]
+    assert enrich.records[0].input_tokens is None
+    assert enrich.records[1].total_tokens == 200
+    assert all(r.prompt_type == gemini_usage.PROMPT_ENRICHMENT for r in enrich.records)
+
+
+def test_other_errors_are_recorded(enrich, monkeypatch):
+    _use(enrich, monkeypatch, [Exception("500 internal error")])
+
+    assert enrich.generate_product_details("リップ") == {}
+    assert [(r.status, r.retries) for r in enrich.records] == [(gemini_usage.STATUS_ERROR, 0)]
+
+
+def test_every_attempt_is_recorded_when_giving_up(enrich, monkeypatch):
+    attempts = len(enrich.API_KEYS) + 1
+    _use(enrich, monkeypatch, [Exception("429 quota exceeded")] * attempts)
+
+    assert enrich.generate_product_details("リップ") == {}
+    assert [r.retries for r in enrich.records] == list(range(attempts))
+    assert {r.status for r in enrich.records} == {gemini_usage.STATUS_ERROR}
+
+
+def test_invalid_json_records_the_successful_call_once(enrich, monkeypatch):
+    model = _use(enrich, monkeypatch, [])
+    model.generate_content = lambda prompt: SimpleNamespace(text="JSON ではない", usage_metadata=None)
+
+    assert enrich.generate_product_details("リップ") == {}
+    assert [r.status for r in enrich.records] == [gemini_usage.STATUS_OK]
+
+
+def test_batch_mode_uses_the_script_model(enrich, monkeypatch, tmp_path):
+    """一括生成（--batch-size > 1）でも、1商品ずつの生成と同じモデルで生成・キャッシュする"""
+    from services.gemini import GeminiService, _build_enrichment_batch_prompt
+
+    cache = GeminiResponseCache(str(tmp_path / "batch.db"))
+    service = GeminiService(
+        api_keys=enrich.API_KEYS, response_cache=cache, usage_ledger=SimpleNamespace(record=lambda r: None),
+        model_name=enrich.GEMINI_MODEL,
+    )
+    assert service.model.model_name == f"models/{enrich.GEMINI_MODEL}"
+    monkeypatch.setattr(service, "_generate_with_retry", lambda prompt, prompt_type: "[]")
+    service.generate("prompt")
+    assert cache.get(enrich.GEMINI_MODEL, "prompt") == "[]"
+
+    prompt = _build_enrichment_batch_prompt([{'product_id': 1, 'name': 'リップ'}])
+    assert '日本語で回答すること' in prompt and '推測' in prompt
@@ -0,0 +1,53 @@
+"""
+services/gemini.py: キー専用クライアントの差し込み（google-generativeai の非公開属性に依存）が効いていること。
+SDK を更新してこのテストが落ちたら、_build_model / _build_async_model を見直す。
+"""
+import asyncio
+
+import google.ai.generativelanguage as glm
+
+from services.gemini import _build_async_model, _build_model
+
+
+def _response(text):
+    return glm.GenerateContentResponse(candidates=[
+        glm.Candidate(content=glm.Content(parts=[glm.Part(text=text)], role='model'), finish_reason=1),
+    ])
+
+
+class FakeClient:
+    def __init__(self):
+        self.requests = []
+
+    def generate_content(self, request, **kwargs):
+        self.requests.append(request)
+        return _response('sync')
+
+
+class FakeAsyncClient(FakeClient):
+    async def generate_content(self, request, **kwargs):
+        self.requests.append(request)
+        return _response('async')
+
+
+def test_build_model_uses_key_client():
+    model = _build_model('test-key', 'gemini-2.5-flash')
+    assert isinstance(model._client, glm.GenerativeServiceClient)
+
+    fake = FakeClient()
+    model._client = fake
+    assert model.generate_content('こんにちは').text == 'sync'
+    assert fake.requests[0].model == 'models/gemini-2.5-flash'
+
+
+def test_build_async_model_uses_key_client():
+    async def run():
+        model = _build_async_model('test-key', 'gemini-2.5-flash')
+        assert isinstance(model._async_client, glm.GenerativeServiceAsyncClient)
+        fake = FakeAsyncClient()
+        model._async_client = fake
+        response = await model.generate_content_async('こんにちは')
+        return response.text, fake.requests
+
+    text, requests = asyncio.run(run())
+    assert text == 'async' and len(requests) == 1
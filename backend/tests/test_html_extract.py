@@ -0,0 +1,114 @@
+"""services/html_extract.py: 部分解析が全体解析と同じ結果になること、文字コードの扱い"""
+import os
+
+import pytest
+import requests
+from bs4 import BeautifulSoup
+
+from conftest import FIXTURE_DIR
+from fetch_product_images import (
+    COSME_FALLBACK_IMAGE_SELECTOR, COSME_IMAGE_SELECTOR, RAKUTEN_IMAGE_MARKERS, RAKUTEN_IMAGE_SELECTOR,
+    find_cosme_image,
+)
+from services.amazon import parse_search_page
+from services.html_extract import normalize_encoding, parse_html, select_first, sniff_encoding
+from services.scraper import ScraperClient
+
+
+def _fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURE_DIR, "html", name), "rb") as f:
+        return f.read()
+
+
+def _full_parse(content: bytes, encoding: str) -> BeautifulSoup:
+    """従来の解析（正しい文字コードでデコードしたページ全体を html.parser で解析）"""
+    return BeautifulSoup(content.decode(encoding), "html.parser")
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("amazon_search.html", "utf-8"),
+    ("cosme_search_sjis.html", "cp932"),
+    ("rakuten_search_eucjp.html", "euc_jp"),
+])
+def test_sniff_encoding(name, expected):
+    assert sniff_encoding(_fixture(name)) == expected
+
+
+def test_normalize_encoding():
+    assert normalize_encoding("Shift_JIS") == "cp932"
+    assert normalize_encoding("EUC-JP") == "euc_jp"
+    assert normalize_encoding("UTF8") == "utf-8"
+    assert normalize_encoding("x-unknown") is None
+    assert normalize_encoding(None) is None
+
+
+@pytest.mark.parametrize("size", [64 * 1024, 400, 200])
+def test_amazon_first_result_matches_full_parse(size, monkeypatch):
+    content = _fixture("amazon_search.html")
+    # ページ先頭の <script> にも目印があるので、断片では見つからず全体解析に戻る経路も通る
+    first = _full_parse(content, "utf-8").select_one('[data-component-type="s-search-result"]')
+    partial = select_first(content, '[data-component-type="s-search-result"]', [b's-search-result'], size=size)
+    assert partial is not None
+    assert partial.get("data-asin") == first.get("data-asin") == "B07QZ9XW1K"
+
+    result = parse_search_page(content)
+    assert result.asin == "B07QZ9XW1K"
+    assert result.price == "￥660"
+    assert result.image_url == "https://m.media-amazon.com/images/I/41cezanne.jpg"
+    assert result.url == "https://www.amazon.co.jp/セザンヌ-皮脂テカリ防止下地/dp/B07QZ9XW1K"
+
+
+def test_cosme_shift_jis_page():
+    content = _fixture("cosme_search_sjis.html")
+    full = _full_parse(content, "cp932")
+    expected = full.select_one(COSME_IMAGE_SELECTOR) or full.select_one(COSME_FALLBACK_IMAGE_SELECTOR)
+
+    img = find_cosme_image(content)
+    assert img is not None
+    assert img.get("data-src") == expected.get("data-src")
+    # ヘッダーの遅延読み込み画像ではなく、商品一覧の先頭の画像
+    assert img.get("data-src").endswith("/10084512.jpg")
+    assert img.get("alt") == "マシュマロフィニッシュパウダー"
+
+
+def test_rakuten_euc_jp_page():
+    content = _fixture("rakuten_search_eucjp.html")
+    expected = _full_parse(content, "euc_jp").select_one(RAKUTEN_IMAGE_SELECTOR)
+    img = select_first(content, RAKUTEN_IMAGE_SELECTOR, RAKUTEN_IMAGE_MARKERS)
+    assert img.get("src") == expected.get("src")
+    assert img.get("alt") == "ルナソル アイカラーレーション 01"
+
+
+def test_explicit_encoding_wins_over_default():
+    html = '<html><body><p class="name">髙評価の下地</p></body></html>'.encode("cp932")
+    assert select_first(html, "p.name", [b'class="name"'], "Shift_JIS").get_text() == "髙評価の下地"
+    assert parse_html(html, "shift_jis").select_one("p.name").get_text() == "髙評価の下地"
+
+
+def test_marker_absent_skips_parsing():
+    assert select_first(_fixture("rakuten_search_eucjp.html"), "img.s-image", [b's-image']) is None
+
+
+def _response(body: bytes, content_type: str) -> requests.Response:
+    resp = requests.Response()
+    resp.status_code = 200
+    resp._content = body
+    resp.headers["Content-Type"] = content_type
+    resp.encoding = requests.utils.get_encoding_from_headers(resp.headers)
+    return resp
+
+
+@pytest.mark.parametrize("name, content_type, expected", [
+    # ヘッダの charset を優先する
+    ("cosme_search_sjis.html", "text/html; charset=Shift_JIS", "cp932"),
+    # charset のない text/html（requests は ISO-8859-1 とみなす）は <meta charset> を使う
+    ("rakuten_search_eucjp.html", "text/html", "euc_jp"),
+    ("amazon_search.html", "text/html", "utf-8"),
+])
+def test_scraper_page_encoding(name, content_type, expected, monkeypatch):
+    client = ScraperClient(host_intervals={})
+    body = _fixture(name)
+    monkeypatch.setattr(client, "get", lambda url, **kwargs: _response(body, content_type))
+    page = client.get_page("https://example.com/")
+    assert page.content == body
+    assert page.encoding == expected
@@ -0,0 +1,135 @@
+"""services/job_queue.py: SQLite 上での登録・取り出し・失敗と再試行・リース切れ"""
+import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from models import Job
+from services import job_queue
+
+
+@pytest.fixture
+def session_factory():
+    # 接続を1本だけ共有するインメモリ DB（複数のセッション = 複数のワーカーとして使う）
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Job.__table__.create(bind=engine)
+    return sessionmaker(bind=engine, autocommit=False, autoflush=False)
+
+
+def _job(db, job_id) -> Job:
+    db.expire_all()
+    return db.get(Job, job_id)
+
+
+def test_enqueue_skips_active_duplicates(session_factory):
+    db = session_factory()
+    first = job_queue.enqueue(db, job_queue.JOB_EXTRACT, "video1", {"n": 1})
+    assert first is not None
+    assert job_queue.enqueue(db, job_queue.JOB_EXTRACT, "video1", {"n": 2}) is None
+    # 種類が違えば別のジョブ
+    assert job_queue.enqueue(db, job_queue.JOB_CLASSIFY, "video1") is not None
+    db.commit()
+
+    # 別のセッション（別プロセス相当）からも重複は積めない
+    other = session_factory()
+    assert job_queue.enqueue(other, job_queue.JOB_EXTRACT, "video1") is None
+    other.commit()
+    assert db.query(Job).filter(Job.job_type == job_queue.JOB_EXTRACT).count() == 1
+    assert job_queue.payload_of(_job(db, first)) == {"n": 1}
+
+
+def test_unique_index_rejects_plain_duplicate_insert(session_factory):
+    db = session_factory()
+    db.add(Job(job_type=job_queue.JOB_EXTRACT, key="video1", status=job_queue.STATUS_PENDING))
+    db.add(Job(job_type=job_queue.JOB_EXTRACT, key="video1", status=job_queue.STATUS_RUNNING))
+    with pytest.raises(IntegrityError):
+        db.commit()
+
+
+def test_enqueue_again_after_completion(session_factory):
+    db = session_factory()
+    job_queue.enqueue(db, job_queue.JOB_EXTRACT, "video1")
+    db.commit()
+    [job] = job_queue.claim(db, job_queue.JOB_EXTRACT, 10, "w1")
+    assert job_queue.complete(db, job, "w1")
+    db.commit()
+    assert job_queue.enqueue(db, job_queue.JOB_EXTRACT, "video1") is not None
+
+
+def test_claim_does_not_hand_out_the_same_job_twice(session_factory):
+    db = session_factory()
+    for i in range(5):
+        job_queue.enqueue(db, job_queue.JOB_EXTRACT, f"video{i}")
+    db.commit()
+
+    first = job_queue.claim(session_factory(), job_queue.JOB_EXTRACT, 3, "w1")
+    second = job_queue.claim(session_factory(), job_queue.JOB_EXTRACT, 3, "w2")
+    assert [j.key for j in first] == ["video0", "video1", "video2"]
+    assert [j.key for j in second] == ["video3", "video4"]
+    assert all(j.status == job_queue.STATUS_RUNNING and j.attempts == 1 for j in first + second)
+    assert job_queue.claim(session_factory(), job_queue.JOB_EXTRACT, 3, "w3") == []
+
+
+def test_fail_backs_off_then_gives_up(session_factory, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_MAX_ATTEMPTS", 2)
+    db = session_factory()
+    job_id = job_queue.enqueue(db, job_queue.JOB_EXTRACT, "video1")
+    db.commit()
+
+    [job] = job_queue.claim(db, job_queue.JOB_EXTRACT, 10, "w1")
+    assert job_queue.fail(db, job, "w1", "boom") is True
+    db.commit()
+    job = _job(db, job_id)
+    assert job.status == job_queue.STATUS_PENDING
+    assert job.last_error == "boom"
+    assert job.available_at > datetime.datetime.utcnow()
+    # バックオフ中は取り出せない
+    assert job_queue.claim(db, job_queue.JOB_EXTRACT, 10, "w1") == []
+
+    job.available_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+    db.commit()
+    [job] = job_queue.claim(db, job_queue.JOB_EXTRACT, 10, "w1")
+    assert job.attempts == 2
+    assert job_queue.fail(db, job, "w1", "boom again") is False
+    db.commit()
+    assert _job(db, job_id).status == job_queue.STATUS_FAILED
+
+
+def test_retry_delay_is_exponential_and_capped(monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_RETRY_BASE_SECONDS", 10)
+    monkeypatch.setattr(job_queue, "JOB_RETRY_MAX_SECONDS", 100)
+    assert 8 <= job_queue.retry_delay(1) <= 12
+    assert 32 <= job_queue.retry_delay(3) <= 48
+    assert 80 <= job_queue.retry_delay(10) <= 120
+
+
+def test_expired_lease_is_taken_over(session_factory):
+    db = session_factory()
+    job_id = job_queue.enqueue(db, job_queue.JOB_EXTRACT, "video1")
+    db.commit()
+
+    [stale] = job_queue.claim(session_factory(), job_queue.JOB_EXTRACT, 10, "w1", lease_seconds=-1)
+    [taken] = job_queue.claim(session_factory(), job_queue.JOB_EXTRACT, 10, "w2")
+    assert taken.id == job_id and taken.locked_by == "w2" and taken.attempts == 2
+
+    # リースを失ったワーカーの結果では上書きしない
+    late = session_factory()
+    assert job_queue.complete(late, stale, "w1") is False
+    assert job_queue.extend_leases(late, [job_id], "w1") == 0
+    late.commit()
+    assert _job(db, job_id).locked_by == "w2"
+    assert job_queue.extend_leases(session_factory(), [job_id], "w2") == 1
+
+
+def test_exhausted_job_with_expired_lease_is_failed(session_factory, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_MAX_ATTEMPTS", 1)
+    db = session_factory()
+    job_id = job_queue.enqueue(db, job_queue.JOB_EXTRACT, "video1")
+    db.commit()
+    job_queue.claim(session_factory(), job_queue.JOB_EXTRACT, 10, "w1", lease_seconds=-1)
+
+    assert job_queue.claim(session_factory(), job_queue.JOB_EXTRACT, 10, "w2") == []
+    assert _job(db, job_id).status == job_queue.STATUS_FAILED
@@ -0,0 +1,38 @@
+"""batch_processor.process_video_item: 1本の動画の失敗で呼び出し側のループを止めない"""
+import logging
+
+import pytest
+
+import batch_processor
+from services.gemini import VideoAnalysisError
+
+SNIPPET = {'title': '春の新作コスメ', 'description': '概要欄', 'channelTitle': 'テストチャンネル'}
+
+
+class BrokenYouTube:
+    def get_transcript(self, video_id):
+        raise RuntimeError("字幕の解析に失敗")
+
+
+class NoTranscriptYouTube:
+    def get_transcript(self, video_id):
+        return None
+
+
+class FailingGemini:
+    def __init__(self, error):
+        self.error = error
+
+    def analyze_video(self, transcript, description, title):
+        raise self.error
+
+
+@pytest.mark.parametrize("youtube, gemini, message", [
+    (NoTranscriptYouTube(), FailingGemini(VideoAnalysisError("429")), "Gemini analysis failed"),
+    (BrokenYouTube(), FailingGemini(VideoAnalysisError("unused")), "Video processing failed"),
+    (NoTranscriptYouTube(), FailingGemini(ValueError("区間の統合に失敗")), "Video processing failed"),
+])
+def test_errors_skip_only_the_video(youtube, gemini, message, caplog):
+    with caplog.at_level(logging.ERROR, logger=batch_processor.logger.name):
+        batch_processor.process_video_item(None, youtube, gemini, 'v1', SNIPPET, known_new=True)
+    assert message in caplog.text and 'v1' in caplog.text
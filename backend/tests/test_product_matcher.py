@@ -0,0 +1,133 @@
+"""services/product_matcher.py: n-gram 候補索引による名寄せとバッチ照合"""
+import random
+from difflib import SequenceMatcher
+
+from services.product_matcher import (
+    BRAND_BONUS, BRAND_MATCH_THRESHOLD, MATCH_THRESHOLD, ProductMatcher, normalize_name,
+)
+
+CATALOG = [
+    ('1', 'エアリーチェンジリキッド 01', 'セザンヌ'),
+    ('2', 'UV イデア XL プロテクション トーンアップ', 'ラロッシュポゼ'),
+    ('3', 'カラーステイ リップ', 'レブロン'),
+    ('4', 'ジューシーラスティングティント', 'ロムアンド'),
+    ('5', 'ジューシーラスティングティント', 'ロムアンド'),   # 同じ名前は先に登録したものを返す
+    ('6', 'マキアージュ ドラマティックパウダリー EX', '資生堂'),
+]
+
+
+def _matcher(catalog=CATALOG):
+    matcher = ProductMatcher()
+    for product_id, name, brand in catalog:
+        matcher.add(product_id, name, brand)
+    return matcher
+
+
+def full_scan(catalog, product_name, brand_name=None):
+    """索引を使わない従来の全件走査（先勝ち）"""
+    normalized_new = normalize_name(product_name)
+    if not normalized_new:
+        return None
+    for product_id, name, _ in catalog:
+        if normalize_name(name) == normalized_new:
+            return product_id, 1.0
+    best = None
+    best_score = 0.0
+    for product_id, name, brand in catalog:
+        score = SequenceMatcher(None, normalized_new, normalize_name(name)).ratio()
+        if brand_name and brand:
+            if SequenceMatcher(None, normalize_name(brand_name), normalize_name(brand)).ratio() > BRAND_MATCH_THRESHOLD:
+                score += BRAND_BONUS
+        if score > best_score:
+            best, best_score = product_id, score
+    return (best, best_score) if best_score >= MATCH_THRESHOLD else None
+
+
+def test_normalize_name():
+    assert normalize_name('ＵＶ イデア　XL (Medicube)') == 'uvイデアxl'
+    assert normalize_name('') == ''
+
+
+def test_exact_and_fuzzy():
+    matcher = _matcher()
+    exact = matcher.find('エアリーチェンジ リキッド 01')
+    assert exact.product_id == '1' and exact.exact
+    assert matcher.find('ジューシーラスティングティント').product_id == '4'
+
+    fuzzy = matcher.find('エアリーチェンジリキッド 02', 'セザンヌ')
+    assert fuzzy.product_id == '1' and not fuzzy.exact and fuzzy.score >= MATCH_THRESHOLD
+    assert matcher.find('ベルベットマットリップ') is None
+    assert matcher.find('') is None
+
+
+def test_brand_bonus():
+    # 商品名だけでは閾値に届かず（類似度 0.8）、ブランドの一致で届く
+    matcher = _matcher([('1', 'カラーステイリップ', 'レブロン')])
+    assert matcher.find('カラーステイ') is None
+    assert matcher.find('カラーステイ', 'ロレアル') is None
+    match = matcher.find('カラーステイ', 'レブロン')
+    assert match is not None and match.product_id == '1'
+
+
+def test_remove_and_replace():
+    matcher = _matcher()
+    matcher.remove('4')
+    assert matcher.find('ジューシーラスティングティント').product_id == '5'
+    matcher.add('3', 'ベルベットマットリップ', 'レブロン')
+    assert matcher.find('ベルベットマットリップ').product_id == '3'
+    assert matcher.find('カラーステイ リップ') is None
+    assert len(matcher) == len(CATALOG) - 1
+
+
+def _mutate(rng, name):
+    chars = list(name)
+    for _ in range(rng.randint(0, 3)):
+        op = rng.random()
+        pos = rng.randrange(len(chars) + 1)
+        if op < 0.4 and chars:
+            chars.pop(min(pos, len(chars) - 1))
+        elif op < 0.8:
+            chars.insert(pos, rng.choice('アイウリップ0123 '))
+        elif chars:
+            chars[min(pos, len(chars) - 1)] = rng.choice('カキクケコ')
+    return ''.join(chars)
+
+
+def test_shortlist_matches_full_scan():
+    """候補を n-gram で絞っても、全件走査と同じ商品を返す"""
+    rng = random.Random(0)
+    kana = 'アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモラリルレロ'
+    catalog = list(CATALOG)
+    for i in range(300):
+        name = ''.join(rng.choice(kana) for _ in range(rng.randint(4, 14)))
+        catalog.append((str(100 + i), name, rng.choice(['セザンヌ', 'キャンメイク', 'ケイト', None])))
+    matcher = _matcher(catalog)
+
+    for _ in range(300):
+        _, name, brand = rng.choice(catalog)
+        query, query_brand = _mutate(rng, name), rng.choice([brand, None, 'ケイト'])
+        expected = full_scan(catalog, query, query_brand)
+        result = matcher.find(query, query_brand)
+        if expected is None:
+            assert result is None
+        else:
+            assert result is not None
+            assert (result.product_id, round(result.score, 9)) == (expected[0], round(expected[1], 9))
+            assert matcher.find_many([(query, query_brand)])[0].match == result
+
+
+def test_find_many_dedupes_within_batch():
+    matcher = _matcher()
+    results = matcher.find_many([
+        ('ベルベットマットリップ', 'レブロン'),
+        ('エアリーチェンジリキッド 01', 'セザンヌ'),
+        ('ベルベット マットリップ', 'レブロン'),
+        ('ベルベットマットリップス', 'レブロン'),
+        ('', None),
+        ('ヌーディーグロウ', 'ケイト'),
+    ])
+    assert [r.duplicate_of for r in results] == [None, None, 0, 0, None, None]
+    assert [r.match and r.match.product_id for r in results] == [None, '1', None, None, None, None]
+    # 既存商品に一致した要素はバッチ内の重複判定に使わない
+    again = matcher.find_many([('エアリーチェンジリキッド 01', None), ('エアリーチェンジリキッド 01', None)])
+    assert [(r.match.product_id, r.duplicate_of) for r in again] == [('1', None), ('1', None)]
@@ -0,0 +1,117 @@
+"""services/rate_limiter.py: トークンバケットとキーごとのレートリミッター"""
+import threading
+
+import pytest
+
+from services import rate_limiter
+from services.rate_limiter import KeyRateLimiter, TokenBucket, parse_retry_delay
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter.time, 'monotonic', clock)
+    return clock
+
+
+def test_token_bucket_refills_continuously(clock):
+    bucket = TokenBucket(60)        # 1秒に1トークン
+    assert bucket.wait_time(60, clock.now) == 0
+    bucket.consume(60, clock.now)
+    assert bucket.wait_time(1, clock.now) == pytest.approx(1.0)
+    assert bucket.wait_time(10, clock.now) == pytest.approx(10.0)
+
+    clock.now += 5
+    assert bucket.wait_time(5, clock.now) == 0
+    assert bucket.utilization(clock.now) == pytest.approx(55 / 60)
+    # 補充は容量で頭打ち
+    clock.now += 3600
+    assert bucket.utilization(clock.now) == 0.0
+    assert bucket.tokens == 60
+
+
+def test_token_bucket_oversized_request_and_adjust(clock):
+    bucket = TokenBucket(100)
+    # 容量を超える要求は満タンなら通し、バケットを空にする
+    assert bucket.wait_time(500, clock.now) == 0
+    bucket.consume(500, clock.now)
+    assert bucket.tokens == 0
+
+    bucket.adjust(-30, clock.now)   # 見積もりより少なかった分を戻す
+    assert bucket.tokens == pytest.approx(30)
+    bucket.adjust(50, clock.now)    # 多かった分を追加で消費（マイナスまで）
+    assert bucket.tokens == pytest.approx(-20)
+    assert bucket.wait_time(10, clock.now) == pytest.approx(30 / (100 / 60))
+    bucket.drain(clock.now)
+    assert bucket.tokens == pytest.approx(-20)
+
+
+def test_parse_retry_delay():
+    assert parse_retry_delay("429 Quota exceeded. Please retry in 17.5s.") == 17.5
+    assert parse_retry_delay("retry_delay {\n  seconds: 42\n}") == 42.0
+    assert parse_retry_delay("500 internal") is None
+
+
+def test_limiter_rotates_keys_and_respects_rpm(clock):
+    limiter = KeyRateLimiter(num_keys=2, rpm=2, tpm=1_000_000)
+    assert [limiter.try_acquire()[0] for _ in range(4)] == [0, 1, 0, 1]
+    index, wait = limiter.try_acquire()
+    assert index is None and wait == pytest.approx(30.0)
+
+    clock.now += 30
+    assert limiter.try_acquire()[0] == 0
+    assert [u['requests'] for u in limiter.utilization()] == [3, 2]
+
+
+def test_limiter_respects_tpm_and_usage_correction(clock):
+    limiter = KeyRateLimiter(num_keys=1, rpm=100, tpm=600)     # 1秒に10トークン
+    assert limiter.try_acquire(500)[0] == 0
+    index, wait = limiter.try_acquire(200)
+    assert index is None and wait == pytest.approx(10.0)
+
+    # 実際は 300 トークンだった → 200 戻る
+    limiter.record_usage(0, actual_tokens=300, estimated_tokens=500)
+    assert limiter.try_acquire(200)[0] == 0
+    assert limiter.try_acquire(200, exclude={0}) == (None, None)
+
+
+def test_penalize_blocks_key(clock):
+    limiter = KeyRateLimiter(num_keys=2, rpm=100, tpm=1_000_000, cooldown_seconds=60)
+    limiter.penalize(0, retry_after=15)
+    assert [limiter.try_acquire()[0] for _ in range(3)] == [1, 1, 1]
+
+    limiter.penalize(1)
+    index, wait = limiter.try_acquire()
+    assert index is None and wait == pytest.approx(15.0)
+    clock.now += 15
+    assert limiter.try_acquire()[0] == 0
+    usage = limiter.utilization()
+    assert [u['throttled'] for u in usage] == [1, 1]
+    assert usage[1]['blocked_seconds'] == pytest.approx(45.0)
+
+
+def test_acquire_waits_until_capacity():
+    """acquire は空くまで待つ（実時間で短い周期のバケットを使う）"""
+    limiter = KeyRateLimiter(num_keys=1, rpm=1, tpm=1_000_000)
+    limiter._rpm[0] = TokenBucket(1, period_seconds=0.2)
+    assert limiter.acquire() == 0
+
+    done = threading.Event()
+
+    def worker():
+        limiter.acquire()
+        done.set()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    assert not done.wait(0.05)
+    assert done.wait(2)
+    thread.join()
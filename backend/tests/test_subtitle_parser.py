@@ -0,0 +1,122 @@
+"""services/subtitle_parser.py: vtt / srv / json3 のストリーミング解析と形式の推定"""
+import json
+
+import pytest
+
+from services.subtitle_parser import iter_segments, sniff_format
+
+VTT = """WEBVTT
+Kind: captions
+Language: ja
+
+00:00:01.000 --> 00:00:03.500 align:start position:0%
+今日は<00:00:01.500><c>新作の</c><00:00:02.000><c>リップ</c>を
+
+00:00:03.500 --> 00:00:05.000
+紹介します
+R&amp;B みたいな色 &lt;赤&gt;
+
+01:00:00.000 --> 01:00:02.250
+最後
+"""
+
+SRV3 = """<?xml version="1.0" encoding="utf-8" ?><timedtext format="3">
+<body>
+<p t="1000" d="2500">今日は新作の<s>リップ</s>を</p>
+<p t="3500" d="1500">R&amp;amp;B と &lt;赤&gt;</p>
+<p t="6000" d="500">   </p>
+</body></timedtext>
+"""
+
+SRV1 = """<?xml version="1.0" encoding="utf-8" ?><transcript>
+<text start="1.5" dur="2.25">ファンデの
+仕上がり</text>
+<text start="3.75" dur="1">AT&amp;T</text>
+</transcript>
+"""
+
+JSON3 = json.dumps({
+    "wireMagic": "pb3",
+    "events": [
+        {"tStartMs": 0, "dDurationMs": 5000, "id": 1, "wpWinPosId": 1},
+        {"tStartMs": 1000, "dDurationMs": 2500, "segs": [{"utf8": "今日は"}, {"utf8": "新作の", "tOffsetMs": 400}]},
+        {"tStartMs": 2000, "segs": [{"utf8": "\n"}]},
+        {"tStartMs": 3500, "dDurationMs": 1500, "segs": [{"utf8": "R&amp;B\nカラー"}]},
+    ],
+}, ensure_ascii=False)
+
+
+def _chunks(text: str, size: int):
+    data = text.encode('utf-8')
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def _parse(text: str, fmt=None, size: int = 65536):
+    return list(iter_segments(_chunks(text, size), fmt=fmt))
+
+
+def test_vtt():
+    assert _parse(VTT, 'vtt') == [
+        {'text': '今日は新作のリップを', 'start': 1.0, 'duration': 2.5},
+        {'text': '紹介します R&B みたいな色 <赤>', 'start': 3.5, 'duration': 1.5},
+        {'text': '最後', 'start': 3600.0, 'duration': 2.25},
+    ]
+
+
+def test_srv3_unescapes_entities_once():
+    assert _parse(SRV3, 'srv3') == [
+        {'text': '今日は新作のリップを', 'start': 1.0, 'duration': 2.5},
+        # 字幕の本文が "R&amp;B" なら、そのまま "R&amp;B" として残す
+        {'text': 'R&amp;B と <赤>', 'start': 3.5, 'duration': 1.5},
+    ]
+
+
+def test_srv1():
+    assert _parse(SRV1, 'srv1') == [
+        {'text': 'ファンデの 仕上がり', 'start': 1.5, 'duration': 2.25},
+        {'text': 'AT&T', 'start': 3.75, 'duration': 1.0},
+    ]
+
+
+def test_json3():
+    assert _parse(JSON3, 'json3') == [
+        {'text': '今日は新作の', 'start': 1.0, 'duration': 2.5},
+        {'text': 'R&B カラー', 'start': 3.5, 'duration': 1.5},
+    ]
+
+
+@pytest.mark.parametrize("text, fmt", [(VTT, 'vtt'), (SRV3, 'srv3'), (SRV1, 'srv3'), (JSON3, 'json3')])
+def test_sniff_format(text, fmt):
+    assert sniff_format(('﻿\n' + text).encode('utf-8')) == fmt
+    # 形式が分からなければ先頭から推定する（拡張子の違う ttml などを渡された場合も）
+    assert _parse(text, None) == _parse(text, fmt)
+    assert _parse(text, 'ttml') == _parse(text, fmt)
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        _parse("1\n00:00:01,000 --> 00:00:02,000\nsrt\n", None)
+    assert sniff_format(b'') is None
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64])
+@pytest.mark.parametrize("text, fmt", [(VTT, 'vtt'), (SRV3, 'srv3'), (JSON3, 'json3')])
+def test_chunk_boundaries(text, fmt, size):
+    # 行・要素・多バイト文字の途中でチャンクが切れても結果は同じ
+    assert _parse(text, fmt, size) == _parse(text, fmt)
+    assert _parse(text, None, size) == _parse(text, fmt)
+
+
+def test_segments_are_yielded_lazily():
+    """先頭のキューは、ファイルの残りを受信する前に返る"""
+    received = []
+
+    def chunks():
+        for chunk in _chunks(VTT, 16):
+            received.append(chunk)
+            yield chunk
+
+    segments = iter_segments(chunks(), 'vtt')
+    first = next(segments)
+    assert first['text'] == '今日は新作のリップを'
+    assert sum(map(len, received)) < len(VTT.encode('utf-8'))
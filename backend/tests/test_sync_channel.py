@@ -0,0 +1,107 @@
+"""batch_processor.sync_channel_videos: 失敗した動画を同期位置より古くしない"""
+import pytest
+
+import batch_processor
+from database import SessionLocal
+from models import ChannelSyncState
+from services.gemini import VideoAnalysisError
+
+
+def _video(video_id: str, published_at: str, title: str = "2024年ベストコスメ") -> dict:
+    return {
+        'video_id': video_id, 'title': title, 'description': '概要欄', 'published_at': published_at,
+        'channel_name': 'テストチャンネル', 'thumbnail_url': '',
+    }
+
+
+class FakeYouTube:
+    def __init__(self, videos):
+        self.videos = videos
+
+    def get_playlist_videos(self, playlist_id, max_results, stop_at_video_id=None, published_after=None):
+        return [v for v in self.videos if not published_after or v['published_at'] > published_after]
+
+    def get_transcript(self, video_id):
+        return None
+
+
+class FakeUsageLedger:
+    def summary(self, run_id=None):
+        return []
+
+
+class FakeGemini:
+    """failing の動画だけ Gemini の呼び出しが失敗し、他は商品なし"""
+
+    usage_ledger = FakeUsageLedger()
+
+    def __init__(self, failing):
+        self.failing = set(failing)
+
+    def analyze_video(self, transcript, description, title):
+        if title in self.failing:
+            raise VideoAnalysisError("429")
+        return []
+
+    def cache_stats(self):
+        return {'hits': 0, 'misses': 0}
+
+    def key_utilization(self):
+        return []
+
+
+def _videos():
+    return [
+        _video('v3', '2024-03-01T00:00:00Z', '3月のベストコスメ'),
+        _video('v2', '2024-02-01T00:00:00Z', '2月のベストコスメ'),
+        _video('v1', '2024-01-01T00:00:00Z', '1月のベストコスメ'),
+        _video('v0', '2023-12-01T00:00:00Z', '雑談'),    # ①で除外（意図した除外なので同期位置は進めてよい）
+    ]
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    session.query(ChannelSyncState).delete()
+    state = ChannelSyncState(channel_id='UC1', channel_input='@test', uploads_playlist_id='UU1')
+    session.add(state)
+    session.commit()
+    yield session
+    session.close()
+
+
+def _sync(db, failing):
+    state = db.get(ChannelSyncState, 'UC1')
+    return batch_processor.sync_channel_videos(
+        db, FakeYouTube(_videos()), FakeGemini(failing), state, max_videos=50, title_only=True,
+    ), state
+
+
+def test_watermark_stops_before_oldest_failure(db):
+    stats, state = _sync(db, failing={'2月のベストコスメ'})
+    assert stats['failed'] == 1
+    assert stats['failed_video_ids'] == ['v2']
+    assert stats['processed'] == 2
+    assert state.newest_video_id == 'v1'
+    assert state.newest_published_at == '2024-01-01T00:00:00Z'
+
+    # 次回は失敗した動画から取り直し、成功すれば最新まで進む
+    stats, state = _sync(db, failing=set())
+    assert stats['total'] == 2
+    assert stats['failed'] == 0
+    assert state.newest_video_id == 'v3'
+
+
+def test_watermark_advances_through_filtered_videos_only(db):
+    stats, state = _sync(db, failing={'1月のベストコスメ'})
+    # v0 は①で除外されただけなので、同期位置は v0 まで進めてよい
+    assert state.newest_video_id == 'v0'
+    stats, state = _sync(db, failing={'1月のベストコスメ'})
+    assert state.newest_video_id == 'v0'
+
+
+def test_every_video_lands_in_one_bucket(db):
+    stats, _ = _sync(db, failing={'3月のベストコスメ', '1月のベストコスメ'})
+    excluded_by_title = stats['total'] - stats['skipped_existing'] - stats['pass_title']
+    assert stats['processed'] + stats['failed'] + excluded_by_title + stats['skipped_existing'] == stats['total']
+    assert sorted(stats['failed_video_ids']) == ['v1', 'v3']
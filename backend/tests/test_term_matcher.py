@@ -0,0 +1,80 @@
+"""services/term_matcher.py: 複数語の一括カウントと時間枠ごとの密度"""
+import random
+
+import pytest
+
+from services.term_matcher import TermMatcher, term_density
+from services.transcript import CompactTranscript
+
+TERMS = ['ツヤ', 'ツヤ肌', '肌', 'リップ', 'ップ', 'aa', 'aaa', 'UV', 'SPF', 'あ']
+
+
+def _random_text(rng, length):
+    alphabet = 'ツヤ肌リップaUVSPFあい '
+    return ''.join(rng.choice(alphabet) for _ in range(length))
+
+
+@pytest.mark.parametrize("min_automaton_terms", [0, 1000])
+def test_count_matches_str_count(min_automaton_terms):
+    """オートマトン / str.find のどちらでも、語ごとの str.count の合計と一致する"""
+    matcher = TermMatcher(TERMS, min_automaton_terms=min_automaton_terms)
+    assert matcher.use_automaton == (min_automaton_terms == 0)
+    rng = random.Random(min_automaton_terms)
+    for _ in range(300):
+        text = _random_text(rng, rng.randint(0, 80))
+        assert matcher.count(text) == sum(text.count(t) for t in TERMS)
+        counts = matcher.counts(text)
+        assert counts == {t: text.count(t) for t in TERMS if text.count(t)}
+
+
+def test_automaton_and_scan_find_same_positions():
+    automaton = TermMatcher(TERMS, min_automaton_terms=0)
+    scan = TermMatcher(TERMS, min_automaton_terms=1000)
+    rng = random.Random(1)
+    for _ in range(100):
+        text = _random_text(rng, 60)
+        assert sorted(automaton.matches(text)) == scan.matches(text)
+        for start, index in scan.matches(text):
+            assert text.startswith(TERMS[index], start)
+
+
+def test_overlapping_occurrences_follow_str_count():
+    matcher = TermMatcher(['aa', 'aaa'], min_automaton_terms=0)
+    assert matcher.count('aaaaa') == 'aaaaa'.count('aa') + 'aaaaa'.count('aaa') == 3
+    # 重複・空の語は無視する
+    assert TermMatcher(['ツヤ', 'ツヤ', '']).terms == ['ツヤ']
+
+
+def _transcript(texts, seconds=10.0):
+    segments = [{'text': t, 'start': i * seconds, 'duration': seconds} for i, t in enumerate(texts)]
+    return CompactTranscript.from_segments(segments, window_seconds=0, rolling=False)
+
+
+def test_window_density_uses_global_definition():
+    rng = random.Random(2)
+    transcript = _transcript([_random_text(rng, 20).strip() or 'あ' for _ in range(30)])
+    matcher = TermMatcher(TERMS)
+
+    # 全体を1枠にすれば、字幕全体の密度と同じになる
+    [whole] = matcher.window_density(transcript, 10_000)
+    assert whole.chars == len(transcript.text)
+    assert whole.hits == matcher.count(transcript.text)
+    assert whole.density == term_density(matcher.count(transcript.text), len(transcript.text))
+
+    # 枠ごとの文字数は、その枠の区間を区切りでつないだ文字列の長さ
+    windows = matcher.window_density(transcript, 50)
+    assert len(windows) == 6
+    for n, window in enumerate(windows):
+        texts = [transcript.segment_text(i) for i in range(n * 5, n * 5 + 5)]
+        assert window.chars == len(' '.join(texts))
+        assert (window.start, window.end) == (n * 50.0, n * 50.0 + 50.0)
+    assert sum(w.hits for w in windows) == whole.hits
+
+
+def test_window_density_counts_hits_per_window():
+    transcript = _transcript(['今日は雑談', 'ツヤ肌リップ', 'ごはん'], seconds=100.0)
+    windows = TermMatcher(TERMS).window_density(transcript, 100)
+    assert [(w.hits, w.chars) for w in windows] == [(0, 5), (5, 6), (0, 3)]
+    assert windows[1].density == pytest.approx(5 / 6 * 100)
+    assert TermMatcher(TERMS).window_density(CompactTranscript.from_segments([]), 100) == []
+    assert term_density(1, 0) == 0.0
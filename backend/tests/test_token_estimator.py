@@ -0,0 +1,39 @@
+"""services/token_estimator.py: 文字種ごとのトークン見積もりと切り詰め"""
+import random
+
+from services.token_estimator import estimate_tokens, truncate_to_tokens
+
+
+def test_estimate_tokens_by_character_kind():
+    assert estimate_tokens('') == 0
+    assert estimate_tokens('リップ') == 3
+    assert estimate_tokens('SPF50') == 2            # 英数字は4文字で1トークン（切り上げ）
+    assert estimate_tokens('保湿 \n\t 乾燥') == 4     # 空白は数えない
+    assert estimate_tokens('★！') == 2
+
+
+def test_truncate_within_budget_is_unchanged():
+    text = 'セザンヌ エアリーチェンジリキッド https://example.com/item/12345'
+    assert truncate_to_tokens(text, estimate_tokens(text)) == text
+    assert truncate_to_tokens('', 10) == ''
+
+
+def test_truncate_fits_budget():
+    text = 'コスメ' * 50 + 'abcd' * 50 + '！' * 50
+    for budget in (1, 10, 149, 150, 151, 175, 199):
+        cut = truncate_to_tokens(text, budget)
+        assert text.startswith(cut)
+        assert estimate_tokens(cut) <= budget
+
+
+def test_truncate_matches_character_slice_for_short_text():
+    """
+    見積もりは文字数を超えないので、上限の文字数に収まる概要欄は以前の文字数での切り詰め
+    （description[:N]）と同じ文字列になる（レスポンスキャッシュのキーが変わらない）
+    """
+    rng = random.Random(0)
+    alphabet = 'あいうコスメ色肌abcXYZ019 \n！★🌸'
+    for _ in range(200):
+        limit = rng.randint(1, 60)
+        text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, limit)))
+        assert truncate_to_tokens(text, limit) == text[:limit]
@@ -0,0 +1,89 @@
+"""services/transcript.py: ロールアップ字幕の重複除去と CompactTranscript"""
+import json
+
+from services.transcript import CompactTranscript, collapse_rolling, is_rolling
+
+
+def _cue(text, start, duration):
+    return {'text': text, 'start': start, 'duration': duration}
+
+
+# YouTube の自動字幕（前のキューの最終行が次のキューの先頭行として繰り返され、表示時間が重なる）
+ROLLING = [
+    _cue('今日は新作の', 0.0, 4.0),
+    _cue('今日は新作の\nリップを紹介します', 2.0, 4.0),
+    _cue('リップを紹介します\n色は赤です', 4.0, 4.0),
+    _cue('色は赤です\nとても かわいい', 6.0, 4.0),
+]
+
+# 手動字幕（キューは順に切り替わり、同じ言葉が続いても発話どおり）
+MANUAL = [
+    _cue('かわいい', 0.0, 2.0),
+    _cue('かわいい', 2.0, 2.0),
+    _cue('本当に かわいい', 4.0, 2.0),
+    _cue('かわいい 色', 6.0, 2.0),
+]
+
+
+def test_is_rolling():
+    assert is_rolling(ROLLING)
+    assert not is_rolling(MANUAL)
+    assert not is_rolling(ROLLING[:1])
+    assert not is_rolling([])
+
+
+def test_collapse_rolling_removes_repeated_lines():
+    texts = [s.text for s in collapse_rolling(ROLLING)]
+    assert texts == ['今日は新作の', 'リップを紹介します', '色は赤です', 'とても かわいい']
+
+
+def test_repeated_words_are_kept_when_not_rolling():
+    assert [s.text for s in collapse_rolling(MANUAL, rolling=False)] == ['かわいい', 'かわいい', '本当に かわいい', 'かわいい 色']
+    # 判定（rolling=None）でも手動字幕の語は消さない
+    transcript = CompactTranscript.from_segments(MANUAL, window_seconds=0)
+    assert transcript.text == 'かわいい かわいい 本当に かわいい かわいい 色'
+
+
+def test_from_segments_detects_rolling():
+    transcript = CompactTranscript.from_segments(ROLLING, window_seconds=0)
+    assert transcript.text == '今日は新作の リップを紹介します 色は赤です とても かわいい'
+    # 明示した指定が優先される（ストリーミングで渡す場合）
+    assert CompactTranscript.from_segments(iter(ROLLING), window_seconds=0, rolling=True).text == transcript.text
+    raw = CompactTranscript.from_segments(iter(ROLLING), window_seconds=0, rolling=False)
+    assert raw.text.count('今日は新作の') == 2
+
+
+def test_windows_and_offsets():
+    transcript = CompactTranscript.from_segments(ROLLING, window_seconds=5)
+    assert list(transcript.starts) == [0.0, 6.0]
+    assert list(transcript.durations) == [8.0, 4.0]
+    assert [transcript.segment_text(i) for i in range(len(transcript))] == [
+        '今日は新作の リップを紹介します 色は赤です', 'とても かわいい',
+    ]
+    assert transcript.offsets[-1] == len(transcript.text) + 1
+    assert transcript.segment_at(7.5) == 1
+    assert transcript.timestamped() == '[0s] 今日は新作の リップを紹介します 色は赤です\n[6s] とても かわいい'
+
+
+def test_sample_does_not_split_segments():
+    transcript = CompactTranscript.from_segments(MANUAL, window_seconds=0)
+    assert transcript.sample(12) == 'かわいい かわいい'
+    assert transcript.sample(2) == 'かわ'
+    assert transcript.sample(1000) == transcript.text
+
+
+def test_json_round_trip_and_legacy_list():
+    transcript = CompactTranscript.from_segments(ROLLING)
+    restored = CompactTranscript.from_json(transcript.to_json())
+    assert restored.text == transcript.text
+    assert list(restored.offsets) == list(transcript.offsets)
+
+    assert CompactTranscript.from_json(json.dumps(ROLLING)).text == transcript.text
+    assert CompactTranscript.from_json(json.dumps(MANUAL)).text.count('かわいい') == 4
+
+
+def test_empty():
+    transcript = CompactTranscript.from_segments([_cue('  ', 0, 1)])
+    assert not transcript
+    assert transcript.text == ''
+    assert bool(CompactTranscript.from_text('字幕なし'))
@@ -0,0 +1,103 @@
+"""services/transcript_cache.py: 字幕キャッシュの有効期限とネガティブキャッシュ"""
+import json
+
+import pytest
+
+from services import transcript_cache
+from services.transcript import CompactTranscript
+from services.transcript_cache import TranscriptCache
+
+HOUR = 3600
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(transcript_cache.time, 'time', clock)
+    return clock
+
+
+def _transcript():
+    return CompactTranscript.from_segments([{'text': 'リップを紹介します', 'start': 1.0, 'duration': 2.0}])
+
+
+def _cache(tmp_path, **kwargs):
+    return TranscriptCache(str(tmp_path / 'transcripts.db'), **kwargs)
+
+
+def test_put_and_get_survives_restart(tmp_path, clock):
+    cache = _cache(tmp_path, ttl_hours=1)
+    assert cache.get('v1', 'ja') is None
+    cache.put('v1', 'ja', _transcript())
+
+    entry = cache.get('v1', 'ja')
+    assert entry.transcript.text == 'リップを紹介します'
+    assert entry.expires_at == clock.now + HOUR
+    assert cache.get('v1', 'en') is None
+
+    # 別プロセス（LRU が空）でも SQLite から読める
+    reopened = _cache(tmp_path, ttl_hours=1)
+    assert reopened.get('v1', 'ja').transcript.text == 'リップを紹介します'
+
+
+def test_ttl_expires_entries(tmp_path, clock):
+    cache = _cache(tmp_path, ttl_hours=1)
+    cache.put('v1', 'ja', _transcript())
+    clock.now += HOUR - 1
+    assert cache.get('v1', 'ja') is not None
+    clock.now += 1
+    assert cache.get('v1', 'ja') is None
+    assert _cache(tmp_path, ttl_hours=1).get('v1', 'ja') is None
+
+
+def test_zero_ttl_never_expires(tmp_path, clock):
+    cache = _cache(tmp_path, ttl_hours=0)
+    cache.put('v1', 'ja', _transcript())
+    clock.now += 10 * 365 * 24 * HOUR
+    assert cache.get('v1', 'ja').transcript is not None
+
+
+def test_missing_entries_until_retry_after(tmp_path, clock):
+    cache = _cache(tmp_path, retry_after_hours=24)
+    cache.put_missing('v1', 'ja')
+
+    entry = cache.get('v1', 'ja')
+    assert entry is not None and entry.transcript is None
+    assert _cache(tmp_path).get('v1', 'ja').transcript is None
+
+    # retry-after を過ぎたら未登録と同じ扱いになり、取得し直した字幕で上書きできる
+    clock.now += 24 * HOUR
+    assert cache.get('v1', 'ja') is None
+    cache.put('v1', 'ja', _transcript())
+    assert cache.get('v1', 'ja').transcript.text == 'リップを紹介します'
+
+
+def test_lru_is_bounded(tmp_path, clock):
+    cache = _cache(tmp_path, lru_size=2)
+    for video_id in ('v1', 'v2', 'v3'):
+        cache.put(video_id, 'ja', _transcript())
+    assert list(cache._lru) == [('v2', 'ja'), ('v3', 'ja')]
+    # LRU から外れたものは SQLite から読み直す
+    assert cache.get('v1', 'ja') is not None
+    assert list(cache._lru) == [('v3', 'ja'), ('v1', 'ja')]
+
+
+def test_legacy_segment_rows_are_normalized(tmp_path, clock):
+    cache = _cache(tmp_path)
+    legacy = [
+        {'text': '今日は新作の', 'start': 0.0, 'duration': 4.0},
+        {'text': '今日は新作の\nリップ', 'start': 2.0, 'duration': 4.0},
+    ]
+    cache.execute(
+        "INSERT INTO transcripts (video_id, lang, segments, fetched_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+        ('v1', 'ja', json.dumps(legacy, ensure_ascii=False), clock.now, clock.now + HOUR),
+    )
+    assert cache.get('v1', 'ja').transcript.text == '今日は新作の リップ'
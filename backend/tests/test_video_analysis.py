@@ -0,0 +1,112 @@
+"""services/video_analysis.py: 字幕の区間分けと区間ごとの抽出結果の統合"""
+from services.transcript import CompactTranscript
+from services.video_analysis import (
+    AnalysisWindow, merge_window_results, mention_hints, plan_windows, select_windows,
+)
+
+
+def _transcript(texts):
+    """1区間 = 10秒のキュー"""
+    segments = [{'text': t, 'start': i * 10.0, 'duration': 10.0} for i, t in enumerate(texts)]
+    return CompactTranscript.from_segments(segments, window_seconds=0, rolling=False)
+
+
+def _flat(line):
+    return 10
+
+
+BASE = [
+    {'product_name': 'エアリーチェンジリキッド 01', 'brand_name': 'セザンヌ', 'category': 'ファンデーション',
+     'timestamp_seconds': 0, 'sentiment': 'neutral', 'summary': ''},
+    {'product_name': 'カラーステイ リップ', 'brand_name': 'レブロン', 'category': 'リップ',
+     'timestamp_seconds': 195, 'sentiment': 'neutral', 'summary': ''},
+]
+
+
+def test_mention_hints():
+    hints = mention_hints(BASE)
+    assert 'セザンヌ' in hints
+    assert 'エアリーチェンジリキッド' in hints
+    # 色番号や短すぎる語は使わない
+    assert '01' not in hints
+    assert all(len(h) >= 3 for h in hints)
+
+
+def test_plan_windows_covers_transcript_within_budget():
+    transcript = _transcript([f'話 {i}' for i in range(23)])
+    windows = plan_windows(transcript, [], window_tokens=50, count_tokens=_flat)
+    assert [(w.start, w.end) for w in windows] == [(0, 5), (5, 10), (10, 15), (15, 20), (20, 23)]
+    assert all(w.tokens <= 50 for w in windows)
+    assert all(w.mentions == 0 for w in windows)
+
+
+def test_plan_windows_cuts_before_mention():
+    texts = ['前置き'] * 8 + ['セザンヌのファンデ', '塗りやすい'] + ['雑談'] * 5
+    transcript = _transcript(texts)
+    windows = plan_windows(transcript, mention_hints(BASE), window_tokens=100, count_tokens=_flat)
+    # 言及（8番目）とその感想が同じ区間に入るように、言及の直前で切る
+    assert (windows[0].start, windows[0].end) == (0, 8)
+    assert windows[1].start == 8 and windows[1].mentions == 1
+
+
+def test_plan_windows_keeps_minimum_fill():
+    texts = ['前置き', 'セザンヌ'] + ['雑談'] * 10
+    windows = plan_windows(_transcript(texts), mention_hints(BASE), window_tokens=100, count_tokens=_flat)
+    # 区間の半分に満たない位置では切らない
+    assert (windows[0].start, windows[0].end) == (0, 10)
+
+
+def test_select_windows_prefers_mentions():
+    windows = [AnalysisWindow(i * 5, i * 5 + 5, 50, m) for i, m in enumerate([0, 2, 0, 1, 3])]
+    selected = select_windows(windows, overhead_tokens=10, max_windows=2, max_tokens=1000)
+    assert [w.start for w in selected] == [5, 20]
+    # トークン上限に収まらない区間は飛ばす
+    assert select_windows(windows, overhead_tokens=10, max_windows=10, max_tokens=130) == sorted(
+        [windows[4], windows[1]], key=lambda w: w.start
+    )
+
+
+def test_merge_window_results():
+    transcript = _transcript([f'話 {i}' for i in range(20)])
+    windows = [AnalysisWindow(0, 10, 100, 1), AnalysisWindow(10, 20, 100, 1)]
+    window_results = [
+        [
+            {'product_name': 'エアリーチェンジリキッド', 'brand_name': 'セザンヌ', 'timestamp_seconds': 40,
+             'sentiment': 'positive', 'summary': '軽い'},
+            # 区間の外を指す時刻は区間の先頭に寄せる
+            {'product_name': 'ラスティングリップ', 'brand_name': 'ロムアンド', 'timestamp_seconds': 999,
+             'sentiment': 'negative', 'summary': '乾く'},
+        ],
+        [
+            {'product_name': 'エアリーチェンジリキッド 01', 'brand_name': 'セザンヌ', 'timestamp_seconds': 120,
+             'sentiment': 'positive', 'summary': '崩れない'},
+            {'product_name': 'ラスティングリップ', 'brand_name': 'ロムアンド', 'timestamp_seconds': 150,
+             'sentiment': 'negative', 'summary': ''},
+        ],
+    ]
+    merged = merge_window_results(BASE, transcript, windows, window_results)
+
+    assert [m['product_name'] for m in merged] == ['エアリーチェンジリキッド 01', 'カラーステイ リップ', 'ラスティングリップ']
+    foundation, lip, other = merged
+    assert (foundation['timestamp_seconds'], foundation['sentiment'], foundation['summary']) == (40, 'positive', '軽い')
+    assert foundation['category'] == 'ファンデーション'
+    # 字幕で言及されなかった商品は概要欄の目次の時刻のまま
+    assert lip['timestamp_seconds'] == 195 and lip['sentiment'] == 'neutral'
+    assert (other['timestamp_seconds'], other['sentiment']) == (0, 'negative')
+    # 入力は書き換えない
+    assert BASE[0]['timestamp_seconds'] == 0
+
+
+def test_merge_ignores_invalid_results():
+    transcript = _transcript(['話'])
+    windows = [AnalysisWindow(0, 1, 10, 0)]
+    merged = merge_window_results(None, transcript, windows, [[{'product_name': ''}, 'x', {'brand_name': 'a'}]])
+    assert merged == []
+
+
+def test_description_prompt_does_not_mention_transcript():
+    from services.gemini import _build_analysis_prompt
+
+    prompt = _build_analysis_prompt("01:05 セザンヌ エアリーチェンジリキッド", "春の新作")
+    assert 'エアリーチェンジリキッド' in prompt and '春の新作' in prompt
+    assert '字幕' not in prompt